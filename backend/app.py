@@ -1,9 +1,26 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 import numpy as np
-import joblib
+import json
 import os
 import logging
+import threading
+import time
+import datetime
+import heartbeat
+import metrics
+import profiling
+from compiled_model import default_calibration_path, file_sha256, load_scorer
+from feature_plan import FeatureTransformPlan
+from coalescer import BATCH_SIZE_BUCKETS, QUEUE_DELAY_BUCKETS_MS, RequestCoalescer
+from prediction_cache import PredictionCache, deduplicate_rows
+from warmup import StartupTracker, preload_modules
+from jobs import JobRunner, JobStore, new_job_id
+from hot_reload import ModelBundle, ModelReloader
+from precomputed import PrecomputedResponse, PrecomputedResponses
+from schema import SERVING_FEATURES, FeatureSchema, SchemaValidationError, ValidationSummary
+from explain import ExplainBudget, explain_rows
+from columnar import COLUMNAR_FORMATS, encode_columnar
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -20,293 +37,872 @@ NUMERICAL_FEATURES = ['年龄', '身高', '体重', 'BMI', '前白细胞', '前
                      '总蛋白', '白蛋白', '球蛋白', '白球比', '手术时间']
 
 # 加载模型和预处理器
+MODEL_PATH = os.path.join(os.path.dirname(__file__), 'svm_model.pkl')
+COMPILED_MODEL_PATH = os.path.splitext(MODEL_PATH)[0] + '.npz'
+CALIBRATION_PATH = default_calibration_path(MODEL_PATH)
+# 可选的标准化参数文件 {"features": [...], "mean": [...], "scale": [...]}，不存在时使用预设值
+SCALER_PATH = os.path.join(os.path.dirname(__file__), 'svm_scaler.json')
+# 管理接口触发重新加载时更新该文件，多进程部署时其他工作进程据此跟随更新
+RELOAD_TRIGGER_PATH = os.path.join(os.path.dirname(__file__), 'svm_model.reload')
+# 当前模型版本的只读镜像，实际打分使用请求开始时取得的ModelBundle
 model = None
-scaler = None
-selected_features = ['性别', '年龄', '高血压', 'BMI', '前白细胞', '前血小板', '前淋巴细胞', 'NLR', '前红细胞', '前血红蛋白', '前单核细胞', '前尿白细胞', '前肌酐', '前尿酸', '白蛋白', '球蛋白', '手术时间']
+model_version = None
+plan = None
+selected_features = list(SERVING_FEATURES)
+# selected_features 的类型和取值范围约束，见 schema.py
+feature_schema = FeatureSchema.for_features(selected_features)
+DEFAULT_MEAN = [0.5, 45.0, 0.3, 25.0, 7.0, 250.0, 2.0, 3.0, 4.5, 140.0, 0.15, 0.08, 80.0, 300.0, 40.0, 30.0, 120.0]
+DEFAULT_SCALE = [0.5, 15.0, 0.5, 5.0, 3.0, 100.0, 1.0, 2.0, 2.0, 20.0, 0.1, 0.05, 20.0, 100.0, 10.0, 10.0, 60.0]
 
-def load_model():
-    """加载训练好的模型"""
-    global model, scaler
-    try:
-        # 导入model.py中的模型相关函数
-        from sklearn.preprocessing import StandardScaler
-        
-        # 加载SVM模型
-        model_path = os.path.join(os.path.dirname(__file__), 'svm_model.pkl')
-        logger.info(f"尝试加载模型文件: {model_path}")
-        logger.info(f"当前工作目录: {os.getcwd()}")
-        logger.info(f"文件是否存在: {os.path.exists(model_path)}")
-        
-        if os.path.exists(model_path):
-            model = joblib.load(model_path)
-            logger.info("SVM模型加载成功")
+def load_sklearn_model(model_path):
+    """用joblib加载模型；模型本身没有概率输出时套上单独保存的校准器"""
+    import joblib
+    svc = joblib.load(model_path)
+    if hasattr(svc, 'predict_proba'):
+        return svc
+    from calibration import CalibratedSVC, load_calibrator
+    calibrator, calibrated_sha256 = load_calibrator(CALIBRATION_PATH)
+    if calibrated_sha256 != file_sha256(model_path):
+        logger.warning(f"校准文件 {CALIBRATION_PATH} 与 {model_path} 不一致，请重新训练")
+    return CalibratedSVC(svc, calibrator)
+
+def build_plan():
+    """构建特征转换计划；svm_scaler.json存在时使用其中的均值和标准差，否则使用预设值"""
+    mean, scale = DEFAULT_MEAN, DEFAULT_SCALE
+    if os.path.exists(SCALER_PATH):
+        with open(SCALER_PATH, encoding='utf-8') as f:
+            stats = json.load(f)
+        if stats.get('features') != selected_features:
+            raise ValueError(f"{SCALER_PATH} 中的特征与配置的特征不一致")
+        mean, scale = stats['mean'], stats['scale']
+    return FeatureTransformPlan(selected_features, mean=mean, scale=scale)
+
+def load_bundle():
+    """从磁盘加载模型和标准化参数，返回新的ModelBundle（尚未校验和预热）"""
+    # 加载SVM模型
+    model_path = MODEL_PATH
+    logger.info(f"尝试加载模型文件: {model_path}")
+    logger.info(f"当前工作目录: {os.getcwd()}")
+    logger.info(f"文件是否存在: {os.path.exists(model_path)}")
+
+    # 优先使用导出的纯NumPy打分文件，避免运行时依赖sklearn
+    compiled_path = COMPILED_MODEL_PATH
+    model = None
+    source = None
+    if os.path.exists(compiled_path):
+        compiled = load_scorer(compiled_path)
+        if not os.path.exists(model_path) or compiled.source_sha256 == file_sha256(model_path):
+            model = compiled
+            source = compiled_path
+            logger.info(f"已加载导出的SVM打分文件: {compiled_path}")
         else:
-            # 如果模型文件不存在，使用默认SVM模型
-            from sklearn.svm import SVC
-            model = SVC(probability=True)
-            logger.warning(f"模型文件不存在: {model_path}，使用默认SVM模型")
-        
-        # 初始化标准化器
-        scaler = StandardScaler()
-        # 使用预设的均值和标准差初始化标准化器
-        scaler.mean_ = np.array([0.5, 45.0, 0.3, 25.0, 7.0, 250.0, 2.0, 3.0, 4.5, 140.0, 0.15, 0.08, 80.0, 300.0, 40.0, 30.0, 120.0])
-        scaler.scale_ = np.array([0.5, 15.0, 0.5, 5.0, 3.0, 100.0, 1.0, 2.0, 2.0, 20.0, 0.1, 0.05, 20.0, 100.0, 10.0, 10.0, 60.0])
-        logger.info("标准化器初始化成功")
+            logger.warning(f"导出的打分文件与 {model_path} 不一致，请重新运行 compiled_model.py 导出")
+
+    if model is None and os.path.exists(model_path):
+        model = load_sklearn_model(model_path)
+        source = model_path
+        logger.info("SVM模型加载成功")
+    elif model is None:
+        # 如果模型文件不存在，使用默认SVM模型
+        from sklearn.svm import SVC
+        model = SVC(probability=True)
+        logger.warning(f"模型文件不存在: {model_path}，使用默认SVM模型")
+
+    plan = build_plan()
+    logger.info("特征转换计划初始化成功")
 
+    # 模型版本取模型文件（以及校准文件、标准化参数文件）的哈希，版本变化时清空预测缓存
+    version = file_sha256(model_path)[:12] if os.path.exists(model_path) else 'default'
+    for path in (CALIBRATION_PATH, SCALER_PATH):
+        if os.path.exists(path):
+            version += '-' + file_sha256(path)[:8]
+    return ModelBundle(model, plan, version, source)
+
+def load_model():
+    """加载训练好的模型并设为当前版本"""
+    try:
+        reloader.activate(load_bundle())
         return True
     except Exception as e:
         logger.error(f"模型加载失败: {e}")
         return False
 
-def preprocess_data(data):
+def preprocess_data(data, bundle):
     """预处理数据"""
     try:
-        # 创建特征向量，按照selected_features的顺序
-        feature_vector = []
-        
-        for feature in selected_features:
-            if feature in data:
-                value = data[feature]
-                # 处理缺失值
-                if value is None or value == '':
-                    value = 0
-                feature_vector.append(float(value))
-            else:
-                # 如果特征不存在，使用0填充
-                feature_vector.append(0.0)
-        
-        # 转换为numpy数组
-        processed_data = np.array([feature_vector])
-        
-        # 应用标准化
-        if scaler:
-            try:
-                processed_data = scaler.transform(processed_data)
-            except Exception as e:
-                logger.warning(f"使用StandardScaler转换失败: {e}，尝试手动标准化")
-                # 如果StandardScaler转换失败，使用手动标准化
-                if hasattr(scaler, 'mean_') and hasattr(scaler, 'scale_'):
-                    processed_data = (processed_data - scaler.mean_) / scaler.scale_
-        
-        return processed_data
+        # 按照selected_features的顺序构建特征矩阵，校验后缺失值填充0并标准化
+        values, invalid = bundle.plan.records_to_matrix([data])
+        feature_schema.validate(values, invalid).raise_for_row(0)
+        return bundle.plan.transform(values, out=values)
     except Exception as e:
         logger.error(f"数据预处理失败: {e}")
         raise e
 
+def validate_batch(block, summary=None):
+    """对一块上传数据做向量化校验，必须在preprocess_batch原地标准化之前调用"""
+    report = feature_schema.validate(block.values, block.invalid)
+    if summary is not None:
+        summary.add(report)
+    return report
+
+def preprocess_batch(values, bundle):
+    """批量预处理特征矩阵：缺失值（NaN）使用0填充后标准化"""
+    return bundle.plan.transform(values, out=values)
+
+# 单样本请求合并：PREDICT_COALESCE_WINDOW_MS大于0时启用，
+# 在该时间窗口内或凑满PREDICT_COALESCE_MAX_BATCH个请求后统一打分
+COALESCE_WINDOW_MS = float(os.environ.get('PREDICT_COALESCE_WINDOW_MS', 0))
+COALESCE_MAX_BATCH = int(os.environ.get('PREDICT_COALESCE_MAX_BATCH', 64))
+# 只有同一模型版本的请求会被合并打分
+coalescer = RequestCoalescer(lambda X, bundle: bundle.score(X), COALESCE_WINDOW_MS,
+                             COALESCE_MAX_BATCH) if COALESCE_WINDOW_MS > 0 else None
+
+# 预测结果缓存：PREDICT_CACHE_SIZE为0时关闭，条目在PREDICT_CACHE_TTL秒后过期，
+# 模型文件变化时自动失效
+CACHE_SIZE = int(os.environ.get('PREDICT_CACHE_SIZE', 10000))
+CACHE_TTL = float(os.environ.get('PREDICT_CACHE_TTL', 300))
+prediction_cache = PredictionCache(CACHE_SIZE, CACHE_TTL, watch_paths=[MODEL_PATH, COMPILED_MODEL_PATH, CALIBRATION_PATH]) if CACHE_SIZE > 0 else None
+
+# 启动预热：SVM_WARMUP=background（默认，后台线程预热，端口立即可用）、
+# sync（预热完成后才开始服务）或 off（在第一个预测请求中完成）
+WARMUP_MODE = os.environ.get('SVM_WARMUP', 'background').lower()
+WARMUP_TIMEOUT = float(os.environ.get('SVM_WARMUP_TIMEOUT', 60))
+# 文件上传和模板下载才会用到的重型模块，预热时提前导入
+HEAVY_MODULES = ('pandas', 'openpyxl', 'xlsxwriter', 'ingestion')
+startup = StartupTracker()
+_warmup_lock = threading.Lock()
+
+def validate_model(bundle):
+    """校验模型的输入维度和类别"""
+    n_features = getattr(bundle.model, 'n_features_in_', None)
+    if n_features is not None and n_features != len(selected_features):
+        raise ValueError(f"模型需要{n_features}个特征，但配置了{len(selected_features)}个")
+    classes = getattr(bundle.model, 'classes_', None)
+    if classes is not None and len(classes) != 2:
+        raise ValueError(f"模型应为二分类，实际类别为{list(classes)}")
+
+def warm_bundle(bundle):
+    """单样本和批量路径各走一遍，触发缓存和延迟初始化，并确认概率输出有效"""
+    processed_data = preprocess_data({}, bundle)
+    predictions, probabilities = bundle.score(processed_data)
+    if probabilities is not None and not np.all(np.isfinite(probabilities)):
+        raise ValueError('预热预测得到无效的概率')
+    bundle.score(preprocess_batch(np.full((64, len(selected_features)), np.nan), bundle))
+
+def prepare_bundle():
+    """热更新时在后台线程中加载、校验并预热新版本"""
+    bundle = load_bundle()
+    validate_model(bundle)
+    warm_bundle(bundle)
+    return bundle
+
+def _on_swap(previous, bundle):
+    global model, model_version, plan
+    model, model_version, plan = bundle.model, bundle.version, bundle.plan
+    if prediction_cache is not None:
+        prediction_cache.set_version(bundle.version)
+    try:
+        precompute_responses(bundle)
+    except Exception as e:
+        # 生成失败时在第一次请求中重试，不影响模型替换
+        logger.warning(f"预先生成版本 {bundle.version} 的静态响应失败: {e}")
+
+# 模型热更新：SVM_RELOAD_INTERVAL秒检查一次模型文件（0表示不监视），
+# 也可以通过 POST /api/admin/reload 触发（需要请求头 X-Admin-Token 等于 SVM_ADMIN_TOKEN）
+RELOAD_INTERVAL = float(os.environ.get('SVM_RELOAD_INTERVAL', 2))
+RELOAD_TIMEOUT = float(os.environ.get('SVM_RELOAD_TIMEOUT', 60))
+ADMIN_TOKEN = os.environ.get('SVM_ADMIN_TOKEN')
+reloader = ModelReloader(prepare_bundle, _on_swap, poll_interval=RELOAD_INTERVAL,
+                         watch_paths=[MODEL_PATH, COMPILED_MODEL_PATH, CALIBRATION_PATH, SCALER_PATH, RELOAD_TRIGGER_PATH])
+
+def current_bundle():
+    return reloader.current
+
+# 模板文件、特征信息和模型信息每个模型版本只生成一次，以字节保存在内存中并带强ETag，
+# If-None-Match 命中时直接返回304，不再调用pandas和xlsxwriter
+STATIC_MAX_AGE = int(os.environ.get('SVM_STATIC_MAX_AGE', 300))
+TEMPLATE_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+# 固定模板文件的创建时间，同一内容在各个工作进程中得到相同的字节和ETag
+TEMPLATE_CREATED = datetime.datetime(2024, 1, 1)
+precomputed = PrecomputedResponses()
+
+def _json_response(data):
+    # 与jsonify的输出完全相同
+    return PrecomputedResponse(app.json.response(data).get_data(), 'application/json')
+
+def build_features_response(bundle):
+    return _json_response({
+        'categorical_features': CATEGORICAL_FEATURES,
+        'numerical_features': NUMERICAL_FEATURES,
+        'all_features': CATEGORICAL_FEATURES + NUMERICAL_FEATURES
+    })
+
+def build_model_info_response(bundle):
+    # 只包含随版本变化的内容（不含加载时间），各工作进程的ETag一致
+    return _json_response({
+        'model_type': 'SVM',
+        'features_count': len(selected_features) if selected_features else 0,
+        'selected_features': selected_features[:10] if selected_features else [],  # 只显示前10个特征
+        'model_version': bundle.version,
+        'model_class': type(bundle.model).__name__,
+        'source': bundle.source
+    })
+
+def build_template_response(bundle):
+    import pandas as pd
+    import io
+
+    # 创建一个包含所有特征的DataFrame
+    template_data = {feature: [""] for feature in selected_features}
+    df = pd.DataFrame(template_data)
+
+    # 添加一行示例数据
+    example_data = {
+        '性别': 1,  # 1表示男性
+        '年龄': 65,
+        '高血压': 1,  # 1表示有
+        'BMI': 24.5,
+        '前白细胞': 6.5,
+        '前血小板': 200,
+        '前淋巴细胞': 1.8,
+        'NLR': 2.5,
+        '前红细胞': 4.5,
+        '前血红蛋白': 140,
+        '前单核细胞': 0.5,
+        '前尿白细胞': 0,
+        '前肌酐': 80,
+        '前尿酸': 350,
+        '白蛋白': 40,
+        '球蛋白': 25,
+        '手术时间': 120
+    }
+
+    # 确保示例数据中包含所有需要的特征
+    for feature in selected_features:
+        if feature not in example_data:
+            example_data[feature] = 0
+
+    # 添加示例数据行
+    df.loc[1] = [example_data[feature] for feature in selected_features]
+
+    # 创建一个BytesIO对象
+    output = io.BytesIO()
+
+    # 将DataFrame写入Excel文件
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        df.to_excel(writer, index=False, sheet_name='Template')
+
+        # 获取xlsxwriter工作簿和工作表对象
+        workbook = writer.book
+        worksheet = writer.sheets['Template']
+        workbook.set_properties({'created': TEMPLATE_CREATED})
+
+        # 添加一些格式
+        header_format = workbook.add_format({
+            'bold': True,
+            'text_wrap': True,
+            'valign': 'top',
+            'border': 1
+        })
+
+        # 写入列标题
+        for col_num, value in enumerate(df.columns.values):
+            worksheet.write(0, col_num, value, header_format)
+
+        # 设置列宽
+        worksheet.set_column(0, len(df.columns) - 1, 15)
+
+    return PrecomputedResponse(output.getvalue(), TEMPLATE_MIMETYPE, {
+        'Content-Disposition': 'attachment; filename=prediction_template.xlsx'
+    })
+
+RESPONSE_BUILDERS = {
+    'features': build_features_response,
+    'model-info': build_model_info_response,
+    'template': build_template_response,
+}
+
+def get_precomputed(name, bundle=None):
+    """取得当前模型版本的预生成响应，版本变化后第一次调用时重新生成"""
+    bundle = current_bundle() if bundle is None else bundle
+    return precomputed.get(name, getattr(bundle, 'version', None), lambda: RESPONSE_BUILDERS[name](bundle))
+
+def precompute_responses(bundle):
+    for name in RESPONSE_BUILDERS:
+        get_precomputed(name, bundle)
+
+def warm_up():
+    """启动预热：预加载重型模块、加载并校验模型、执行一次预测，记录各阶段耗时"""
+    with _warmup_lock:
+        if startup.ready:
+            return True
+        startup.begin()
+        try:
+            with startup.stage('preload_modules'):
+                preload_modules(HEAVY_MODULES)
+            with startup.stage('load_model'):
+                bundle = load_bundle()
+            with startup.stage('validate_model'):
+                validate_model(bundle)
+            with startup.stage('warm_predict'):
+                warm_bundle(bundle)
+            reloader.activate(bundle)
+            startup.mark_ready()
+            logger.info(f"模型预热完成，各阶段耗时(ms): {startup.timings_ms}")
+            return True
+        except Exception as e:
+            startup.mark_failed(e)
+            logger.error(f"模型预热失败: {e}")
+            return False
+
+def _reset_warm_up_after_fork():
+    """预热线程不会被子进程继承；预热未完成（未启动或失败）时子进程重新开始"""
+    global _warmup_lock
+    _warmup_lock = threading.Lock()
+    if not startup.ready:
+        startup.reset()
+
+# 先导入再fork的部署（gunicorn --preload）应使用SVM_WARMUP=sync，在fork前完成预热，
+# 否则子进程可能继承导入到一半的模块
+os.register_at_fork(after_in_child=_reset_warm_up_after_fork)
+
+def start_warm_up():
+    """按SVM_WARMUP配置启动预热；已经启动（且没有失败）时不重复启动"""
+    if startup.started and startup.error is None:
+        return True
+    if WARMUP_MODE == 'sync':
+        return warm_up()
+    if WARMUP_MODE == 'background':
+        threading.Thread(target=warm_up, name='model-warmup', daemon=True).start()
+    return True
+
+def ensure_ready():
+    """等待预热完成；未启动或上次失败时在当前请求中同步预热"""
+    if startup.ready:
+        # fork之后在各个工作进程中分别启动模型文件监视线程
+        reloader.ensure_watching()
+        return True
+    if not startup.started or startup.error is not None:
+        return warm_up()
+    return startup.wait(WARMUP_TIMEOUT)
+
+def score_batch(processed_data, report, bundle, row_offset=0):
+    """对通过校验的行打分，返回 (有效行掩码, 预测, 概率)，没有有效行时预测和概率为None"""
+    valid_rows = ~report.rejected
+    predictions = probabilities = None
+    if valid_rows.any():
+        # 相同的行只打分一次
+        with metrics.time_stage('dedup'):
+            unique_rows, inverse = deduplicate_rows(processed_data[valid_rows])
+        with metrics.time_stage('score'):
+            predictions, probabilities = bundle.score(unique_rows)
+        predictions = predictions[inverse]
+        if probabilities is not None:
+            probabilities = probabilities[inverse]
+    metrics.inc('svm_rows_scored_total', value=int(valid_rows.sum()))
+    if report.errors:
+        metrics.inc('svm_row_errors_total', value=len(report.errors))
+        for i, error in report.errors.items():
+            logger.error(f"处理第{row_offset + i + 1}行数据时出错: {error}")
+    return valid_rows, predictions, probabilities
+
+def build_batch_results(processed_data, report, bundle, row_offset=0, explain=None):
+    """对一批特征矩阵打分并生成逐行结果，report为validate_batch的结果，row_offset为该批第一行之前的行数
+
+    explain为ExplainBudget时，在上限内为有效行附加逐特征贡献
+    """
+    row_errors = report.errors
+    explanations = {}
+    if explain is not None:
+        with metrics.time_stage('explain'):
+            explanations = explain_rows(bundle.explainer(), processed_data,
+                                        explain.take(np.flatnonzero(~report.rejected)), selected_features)
+
+    valid_rows, predictions, probabilities = score_batch(processed_data, report, bundle, row_offset)
+    if predictions is not None:
+        predictions = predictions.tolist()
+    if probabilities is not None:
+        probabilities = probabilities.tolist()
+
+    results = []
+    k = 0
+    for i in range(len(processed_data)):
+        row = row_offset + i + 1
+        if not valid_rows[i]:
+            results.append({
+                'row': row,
+                'error': f'处理失败: {row_errors[i]}',
+                'errors': report.row_errors(i)
+            })
+            continue
+
+        pred = predictions[k]
+        result = {
+            'row': row,
+            'prediction': int(pred),
+            'prediction_label': 'Positive' if pred == 1 else 'Negative'
+        }
+
+        if probabilities is not None:
+            prob = probabilities[k]
+            result['confidence'] = max(prob)
+            result['probabilities'] = {
+                'negative': prob[0],
+                'positive': prob[1]
+            }
+
+        if i in explanations:
+            result['explanation'] = explanations[i]
+
+        results.append(result)
+        k += 1
+
+    return results
+
+def build_batch_columns(processed_data, report, bundle, explain=None):
+    """对一批特征矩阵打分，直接由NumPy结果生成并行数组（行号、预测、正类概率），不构建逐行的dict
+
+    返回 (columns, meta)：columns为 {名称: 数组}，meta中是未通过校验的行和逐特征贡献的特征顺序
+    """
+    valid_rows, predictions, probabilities = score_batch(processed_data, report, bundle)
+    rows = np.flatnonzero(valid_rows)
+    if predictions is None:
+        predictions, probabilities = np.zeros(0), np.zeros((0, 2))
+    columns = {'row': (rows + 1).astype(np.uint32), 'prediction': predictions.astype(np.int8)}
+    if probabilities is not None:
+        columns['probability'] = probabilities[:, 1]
+
+    meta = {'errors': [{'row': i + 1, 'error': f'处理失败: {error}', 'errors': report.row_errors(i)}
+                       for i, error in report.errors.items()]}
+    if explain is not None:
+        with metrics.time_stage('explain'):
+            explained = explain.take(rows)
+            contributions, decision = bundle.explainer()(processed_data[explained])
+        columns['explain_row'] = (explained + 1).astype(np.uint32)
+        columns['decision'] = decision
+        columns['contributions'] = contributions
+        meta['features'] = selected_features
+    return columns, meta
+
+def response_format():
+    """批量预测的响应格式：rows（默认，逐行对象）、columnar 或 columnar-f32"""
+    return request.args.get('format', 'rows').lower()
+
+def wants_explain():
+    """客户端是否请求逐特征解释（?explain=true）"""
+    return request.args.get('explain', '').lower() in ('1', 'true', 'yes')
+
+def wants_stream():
+    """客户端是否请求NDJSON流式响应"""
+    if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return 'application/x-ndjson' in request.headers.get('Accept', '')
+
+def stream_batch_predictions(file, bundle, explain=None):
+    """按块读取上传文件并逐块打分，以NDJSON格式流式返回结果"""
+    from ingestion import detach_upload, iter_upload_blocks
+
+    file = detach_upload(file)
+    blocks = iter_upload_blocks(file, selected_features)
+
+    def generate():
+        total = 0
+        summary = ValidationSummary()
+        try:
+            while True:
+                with metrics.time_stage('parse'):
+                    block = next(blocks, None)
+                if block is None:
+                    break
+                with metrics.time_stage('preprocess'):
+                    report = validate_batch(block, summary)
+                    processed_data = preprocess_batch(block.values, bundle)
+                results = build_batch_results(processed_data, report, bundle, row_offset=total, explain=explain)
+                total += len(results)
+                with metrics.time_stage('serialize'):
+                    body = ''.join(json.dumps(result) + '\n' for result in results)
+                yield body
+            done = {'success': True, 'total_samples': total, 'model_version': bundle.version,
+                    'validation': summary.to_dict()}
+            if explain is not None:
+                done['explain'] = explain.to_dict()
+            yield json.dumps(done) + '\n'
+        except Exception as e:
+            logger.error(f"流式预测在第{total}行之后失败: {e}")
+            yield json.dumps({'success': False, 'error': f'文件读取失败: {str(e)}', 'total_samples': total}) + '\n'
+        finally:
+            file.close()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        # 关闭nginx的响应缓冲，使结果逐块到达客户端
+        headers={'X-Accel-Buffering': 'no', 'Cache-Control': 'no-cache'}
+    )
+
+# 异步批量预测任务：上传文件保存在SVM_JOBS_DIR中，由后台线程分块打分，
+# 结果和进度写入同一目录下的SQLite数据库
+JOBS_DIR = os.environ.get('SVM_JOBS_DIR', os.path.join(os.path.dirname(__file__), 'jobs'))
+JOB_WORKERS = int(os.environ.get('SVM_JOB_WORKERS', 1))
+job_store = None
+job_runner = None
+
+def score_job_block(block, row_offset):
+    """任务线程中对一块数据打分"""
+    if not ensure_ready():
+        raise RuntimeError(f'模型未加载: {startup.error}')
+    bundle = current_bundle()
+    report = validate_batch(block)
+    return build_batch_results(preprocess_batch(block.values, bundle), report, bundle, row_offset=row_offset)
+
+def get_job_runner():
+    """首次使用时创建任务存储并启动任务线程（fork之后在各个工作进程中分别启动）"""
+    global job_store, job_runner
+    if job_runner is None:
+        os.makedirs(JOBS_DIR, exist_ok=True)
+        job_store = JobStore(os.path.join(JOBS_DIR, 'jobs.db'))
+        job_runner = JobRunner(job_store, selected_features, score_job_block, json.dumps, workers=JOB_WORKERS)
+    job_runner.ensure_started()
+    return job_runner
+
+# 请求级指标：耗时按端点和状态码分组，请求体大小只统计预测和任务提交
+def _metrics_collector():
+    """把预测缓存和请求合并的统计导出为指标"""
+    samples = []
+    if prediction_cache is not None:
+        stats = prediction_cache.stats()
+        for name in ('hits', 'misses', 'evictions', 'expirations', 'invalidations'):
+            samples.append(('counter', f'svm_cache_{name}_total', '', stats[name]))
+        samples.append(('gauge', 'svm_cache_entries', '', stats['size']))
+    if coalescer is not None:
+        stats = coalescer.stats()
+        samples.append(('counter', 'svm_coalescer_errors_total', '', stats['errors']))
+        samples.append(('gauge', 'svm_coalescer_queued', '', stats['queued']))
+        for name, key, scale in (('svm_coalescer_batch_size', 'batch_size', 1.0),
+                                 ('svm_coalescer_queue_delay_seconds', 'queue_delay_ms', 0.001)):
+            snapshot = stats[key]
+            samples.append(('histogram', name, '', list(snapshot['buckets'].values()) + [snapshot['sum'] * scale]))
+    return samples
+
+metrics.registry.define('svm_cache_hits_total', 'counter', '预测缓存命中次数')
+metrics.registry.define('svm_cache_misses_total', 'counter', '预测缓存未命中次数')
+metrics.registry.define('svm_cache_evictions_total', 'counter', '预测缓存淘汰次数')
+metrics.registry.define('svm_cache_expirations_total', 'counter', '预测缓存过期次数')
+metrics.registry.define('svm_cache_invalidations_total', 'counter', '预测缓存因模型变化被清空的次数')
+metrics.registry.define('svm_cache_entries', 'gauge', '预测缓存当前条目数')
+metrics.registry.define('svm_coalescer_errors_total', 'counter', '请求合并打分失败的批数')
+metrics.registry.define('svm_coalescer_queued', 'gauge', '等待合并打分的请求数')
+metrics.registry.define('svm_coalescer_batch_size', 'histogram', '合并后的批大小', BATCH_SIZE_BUCKETS)
+metrics.registry.define('svm_coalescer_queue_delay_seconds', 'histogram', '请求在合并队列中的等待时间（秒）',
+                        tuple(b / 1000.0 for b in QUEUE_DELAY_BUCKETS_MS))
+metrics.registry.add_collector(_metrics_collector)
+
+@app.before_request
+def _start_timer():
+    request.environ['svm.start'] = time.perf_counter()
+
+@app.after_request
+def _record_request(response):
+    start = request.environ.get('svm.start')
+    if start is not None and request.endpoint != 'get_metrics':
+        labels = f'endpoint="{request.endpoint}",status="{response.status_code}"'
+        metrics.observe('svm_request_seconds', labels, time.perf_counter() - start)
+        if response.status_code >= 400:
+            metrics.inc('svm_request_errors_total', labels)
+        if request.content_length and request.endpoint in ('predict', 'submit_job'):
+            metrics.observe('svm_request_bytes', f'endpoint="{request.endpoint}"', request.content_length)
+    return response
+
+# 按SVM_PROFILE_RATE抽样或按请求头 X-SVM-Profile 剖析预测请求，未开启时为None
+profiler = profiling.install(app)
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus格式的指标，多进程部署时汇总所有工作进程"""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    """健康检查端点"""
-    return jsonify({'status': 'healthy', 'message': 'SVM预测服务运行正常'})
+    """健康检查端点，预热完成前返回503"""
+    if not startup.started:
+        # 尚未启动预热时（SVM_WARMUP=off，或预热未完成时fork出的工作进程）在后台启动，
+        # 只靠健康检查探测的实例也能就绪
+        threading.Thread(target=warm_up, name='model-warmup', daemon=True).start()
+    if not startup.ready:
+        message = '模型预热失败' if startup.error is not None else '模型预热中'
+        return jsonify({'status': startup.status, 'message': message, 'startup': startup.snapshot()}), 503
+    return jsonify({'status': 'healthy', 'message': 'SVM预测服务运行正常', 'startup': startup.snapshot(),
+                    'reload': reloader.status()})
 
 @app.route('/api/predict', methods=['POST'])
 def predict():
     """预测端点"""
     try:
-        if model is None:
-            if not load_model():
-                return jsonify({'error': '模型未加载'}), 500
+        if not ensure_ready():
+            if startup.error is not None:
+                return jsonify({'error': f'模型未加载: {startup.error}'}), 500
+            return jsonify({'error': '模型预热中，请稍后重试'}), 503
+        # 整个请求使用同一个模型版本，热更新不影响进行中的请求
+        bundle = current_bundle()
+        explain = None
+        if wants_explain():
+            try:
+                bundle.explainer()
+            except ValueError as e:
+                return jsonify({'error': f'当前模型不支持解释: {str(e)}'}), 400
+            explain = ExplainBudget()
 
         if request.is_json:
             # JSON数据 - 单个样本预测
-            data = request.get_json()
-            processed_data = preprocess_data(data)
+            metrics.inc('svm_requests_total', 'kind="json"')
+            with metrics.time_stage('decode'):
+                data = request.get_json()
+            with metrics.time_stage('preprocess'):
+                processed_data = preprocess_data(data, bundle)
             
-            # 预测
-            predictions = model.predict(processed_data)
-            probabilities = model.predict_proba(processed_data) if hasattr(model, 'predict_proba') else None
+            # 预测：先查缓存，启用请求合并时与其他并发请求一起打分
+            cached = prediction_cache.get(processed_data[0], bundle.version) if prediction_cache is not None else None
+            if cached is not None:
+                pred, prob = cached
+            else:
+                with metrics.time_stage('score'):
+                    if coalescer is not None:
+                        pred, prob = coalescer.submit(processed_data[0], bundle)
+                    else:
+                        predictions, probabilities = bundle.score(processed_data)
+                        pred = predictions[0]
+                        prob = None if probabilities is None else probabilities[0]
+                metrics.inc('svm_rows_scored_total')
+                if prediction_cache is not None:
+                    prediction_cache.put(processed_data[0], (pred, prob), bundle.version)
             
             # 准备结果
-            pred = predictions[0]
             result = {
                 'prediction': int(pred),
                 'prediction_label': 'Positive' if pred == 1 else 'Negative'
             }
             
-            if probabilities is not None:
-                result['confidence'] = float(max(probabilities[0]))
+            if prob is not None:
+                result['confidence'] = float(max(prob))
                 result['probabilities'] = {
-                    'negative': float(probabilities[0][0]),
-                    'positive': float(probabilities[0][1])
+                    'negative': float(prob[0]),
+                    'positive': float(prob[1])
                 }
-            
-            return jsonify({
+
+            response = {
                 'success': True,
-                'result': result
-            })
+                'result': result,
+                'model_version': bundle.version
+            }
+            if explain is not None:
+                with metrics.time_stage('explain'):
+                    explanations = explain_rows(bundle.explainer(), processed_data,
+                                                explain.take(np.arange(1)), selected_features)
+                if explanations:
+                    result['explanation'] = explanations[0]
+                response['explain'] = explain.to_dict()
+            
+            with metrics.time_stage('serialize'):
+                return jsonify(response)
         else:
             # 文件上传 - 批量预测
-            if 'file' not in request.files:
+            with metrics.time_stage('upload'):
+                files = request.files
+            if 'file' not in files:
                 return jsonify({'error': '没有文件上传'}), 400
-            file = request.files['file']
+            file = files['file']
             if file.filename == '':
                 return jsonify({'error': '没有选择文件'}), 400
+            if not file.filename.endswith(('.csv', '.xlsx', '.xls')):
+                return jsonify({'error': '支持CSV和Excel文件格式'}), 400
+            fmt = response_format()
+            if fmt != 'rows' and fmt not in COLUMNAR_FORMATS:
+                return jsonify({'error': f"不支持的响应格式: {fmt}，可选 rows、{'、'.join(COLUMNAR_FORMATS)}"}), 400
+            # 列式响应本身已足够紧凑，不使用流式模式
+            if fmt == 'rows' and wants_stream():
+                metrics.inc('svm_requests_total', 'kind="stream"')
+                return stream_batch_predictions(file, bundle, explain)
+            metrics.inc('svm_requests_total', 'kind="file"' if fmt == 'rows' else 'kind="columnar"')
             
             # 读取文件内容
             try:
-                import io
-                import pandas as pd
-                
-                if file.filename.endswith('.csv'):
-                    # CSV文件处理
-                    file_content = file.read().decode('utf-8')
-                    lines = file_content.strip().split('\n')
-                    headers = lines[0].split(',')
-                    data_rows = []
-                    for line in lines[1:]:
-                        values = line.split(',')
-                        row_data = {headers[i].strip(): values[i].strip() for i in range(len(headers))}
-                        data_rows.append(row_data)
-                elif file.filename.endswith(('.xlsx', '.xls')):
-                    # Excel文件处理
-                    file.seek(0)  # 重置文件指针
-                    df = pd.read_excel(file)
-                    data_rows = df.to_dict('records')
-                else:
-                    return jsonify({'error': '支持CSV和Excel文件格式'}), 400
-                
-                # 批量预测
-                results = []
-                for i, row_data in enumerate(data_rows):
-                    try:
-                        processed_data = preprocess_data(row_data)
-                        pred = model.predict(processed_data)[0]
-                        prob = model.predict_proba(processed_data)[0] if hasattr(model, 'predict_proba') else None
-                        
-                        result = {
-                            'row': i + 1,
-                            'prediction': int(pred),
-                            'prediction_label': 'Positive' if pred == 1 else 'Negative'
-                        }
-                        
-                        if prob is not None:
-                            result['confidence'] = float(max(prob))
-                            result['probabilities'] = {
-                                'negative': float(prob[0]),
-                                'positive': float(prob[1])
-                            }
-                        
-                        results.append(result)
-                    except Exception as e:
-                        logger.error(f"处理第{i+1}行数据时出错: {e}")
-                        results.append({
-                            'row': i + 1,
-                            'error': f'处理失败: {str(e)}'
-                        })
+                from ingestion import read_upload_matrix
+
+                # 只读取selected_features列，直接得到float64特征矩阵
+                with metrics.time_stage('parse'):
+                    block = read_upload_matrix(file, selected_features)
+                heartbeat.beat()
+
+                # 批量预测：整个文件构成一个特征矩阵，未通过校验的行通过掩码剔除后一次性打分
+                summary = ValidationSummary()
+                with metrics.time_stage('preprocess'):
+                    report = validate_batch(block, summary)
+                    processed_data = preprocess_batch(block.values, bundle)
+                heartbeat.beat()
+
+                if fmt in COLUMNAR_FORMATS:
+                    columns, meta = build_batch_columns(processed_data, report, bundle, explain=explain)
+                    with metrics.time_stage('serialize'):
+                        meta = {'success': True, 'format': fmt, 'total_samples': len(processed_data),
+                                'model_version': bundle.version, 'validation': summary.to_dict(), **meta}
+                        if explain is not None:
+                            meta['explain'] = explain.to_dict()
+                        body, mimetype = encode_columnar(meta, columns, fmt)
+                        return Response(body, mimetype=mimetype)
+
+                results = build_batch_results(processed_data, report, bundle, explain=explain)
                 
-                return jsonify({
-                    'success': True,
-                    'predictions': results,
-                    'total_samples': len(results)
-                })
+                with metrics.time_stage('serialize'):
+                    response = {
+                        'success': True,
+                        'predictions': results,
+                        'total_samples': len(results),
+                        'model_version': bundle.version,
+                        'validation': summary.to_dict()
+                    }
+                    if explain is not None:
+                        response['explain'] = explain.to_dict()
+                    return jsonify(response)
                 
             except Exception as e:
                 return jsonify({'error': f'文件读取失败: {str(e)}'}), 400
         
+    except SchemaValidationError as e:
+        return jsonify({'error': f'输入数据无效: {str(e)}', 'errors': e.errors}), 400
     except Exception as e:
         logger.error(f"预测失败: {e}")
         return jsonify({'error': f'预测失败: {str(e)}'}), 500
 
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """提交批量预测任务，立即返回任务ID"""
+    if 'file' not in request.files:
+        return jsonify({'error': '没有文件上传'}), 400
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'error': '没有选择文件'}), 400
+    if not file.filename.endswith(('.csv', '.xlsx', '.xls')):
+        return jsonify({'error': '支持CSV和Excel文件格式'}), 400
+
+    try:
+        runner = get_job_runner()
+        job_id = new_job_id()
+        path = os.path.join(JOBS_DIR, job_id + os.path.splitext(file.filename)[1].lower())
+        file.save(path)
+        job_store.create(job_id, file.filename, path)
+        runner.wake()
+    except Exception as e:
+        logger.error(f"提交任务失败: {e}")
+        return jsonify({'error': f'提交任务失败: {str(e)}'}), 500
+
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': f'/api/jobs/{job_id}',
+        'results_url': f'/api/jobs/{job_id}/results'
+    }), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """查询任务状态和进度"""
+    job = get_job_runner().store.get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs/<job_id>/results', methods=['GET'])
+def get_job_results(job_id):
+    """下载已完成任务的结果，格式与/api/predict相同，支持NDJSON"""
+    store = get_job_runner().store
+    job = store.get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    if job['status'] != 'done':
+        return jsonify({'error': '任务尚未完成', 'status': job['status'], 'job_error': job['error']}), 409
+
+    if wants_stream():
+        def generate_ndjson():
+            yield from store.iter_results(job_id)
+            yield json.dumps({'success': True, 'total_samples': job['processed_rows']}) + '\n'
+        return Response(generate_ndjson(), mimetype='application/x-ndjson')
+
+    def generate_json():
+        # 结果按NDJSON保存，拼接为JSON数组时无需重新解析
+        yield '{"success": true, "predictions": ['
+        first = True
+        for body in store.iter_results(job_id):
+            if not body:
+                continue
+            yield ('' if first else ',') + body.rstrip('\n').replace('\n', ',')
+            first = False
+        yield f'], "total_samples": {job["processed_rows"]}}}'
+    return Response(generate_json(), mimetype='application/json')
+
+@app.route('/api/coalescer-stats', methods=['GET'])
+def get_coalescer_stats():
+    """获取请求合并的批大小分布和排队延迟"""
+    if coalescer is None:
+        return jsonify({'enabled': False})
+    return jsonify(coalescer.stats())
+
+@app.route('/api/cache-stats', methods=['GET'])
+def get_cache_stats():
+    """获取预测缓存的命中、未命中和淘汰计数"""
+    if prediction_cache is None:
+        return jsonify({'enabled': False})
+    return jsonify(prediction_cache.stats())
+
 @app.route('/api/features', methods=['GET'])
 def get_features():
     """获取特征信息"""
-    return jsonify({
-        'categorical_features': CATEGORICAL_FEATURES,
-        'numerical_features': NUMERICAL_FEATURES,
-        'all_features': CATEGORICAL_FEATURES + NUMERICAL_FEATURES
-    })
+    return get_precomputed('features').respond(f'public, max-age={STATIC_MAX_AGE}')
 
 @app.route('/api/model-info', methods=['GET'])
 def get_model_info():
     """获取模型信息"""
     try:
-        if model is None:
+        if current_bundle() is None:
             return jsonify({'error': '模型未加载'}), 500
-        
-        return jsonify({
-            'model_type': 'SVM',
-            'features_count': len(selected_features) if selected_features else 0,
-            'selected_features': selected_features[:10] if selected_features else []  # 只显示前10个特征
-        })
+        # 热更新后版本随时可能变化，客户端每次都需要用ETag重新验证
+        return get_precomputed('model-info').respond('no-cache')
     except Exception as e:
         return jsonify({'error': f'获取模型信息失败: {str(e)}'}), 500
 
+@app.route('/api/admin/reload', methods=['POST'])
+def admin_reload():
+    """重新加载模型：在后台线程中加载、校验和预热，成功后替换当前版本"""
+    if not ADMIN_TOKEN:
+        return jsonify({'error': '未配置SVM_ADMIN_TOKEN，管理接口已关闭'}), 403
+    if request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        return jsonify({'error': '管理令牌无效'}), 401
+
+    previous = getattr(current_bundle(), 'version', None)
+    thread, result = reloader.reload_async('admin')
+    # 分段等待并更新心跳，serve.py不会把等待中的工作进程当作卡死
+    deadline = time.monotonic() + RELOAD_TIMEOUT
+    while thread.is_alive() and time.monotonic() < deadline:
+        thread.join(min(1.0, max(0.0, deadline - time.monotonic())))
+        heartbeat.beat()
+    if thread.is_alive():
+        return jsonify({'success': False, 'status': 'loading', 'model_version': previous}), 202
+    if not result['success']:
+        return jsonify({'success': False, 'error': f"模型加载失败: {result['value']}", 'model_version': previous}), 500
+
+    # 通知其他工作进程跟随更新
+    try:
+        with open(RELOAD_TRIGGER_PATH, 'w', encoding='utf-8') as f:
+            f.write(result['value'].version)
+        reloader.sync_signature()
+    except OSError as e:
+        logger.warning(f"写入 {RELOAD_TRIGGER_PATH} 失败，其他工作进程不会自动更新: {e}")
+    return jsonify({'success': True, 'previous_version': previous, **result['value'].info()})
+
 @app.route('/api/download-template', methods=['GET'])
 def download_template():
     """下载模板文件"""
     try:
-        import pandas as pd
-        import io
-        from flask import send_file
-        
-        # 创建一个包含所有特征的DataFrame
-        template_data = {feature: [""] for feature in selected_features}
-        df = pd.DataFrame(template_data)
-        
-        # 添加一行示例数据
-        example_data = {
-            '性别': 1,  # 1表示男性
-            '年龄': 65,
-            '高血压': 1,  # 1表示有
-            'BMI': 24.5,
-            '前白细胞': 6.5,
-            '前血小板': 200,
-            '前淋巴细胞': 1.8,
-            'NLR': 2.5,
-            '前红细胞': 4.5,
-            '前血红蛋白': 140,
-            '前单核细胞': 0.5,
-            '前尿白细胞': 0,
-            '前肌酐': 80,
-            '前尿酸': 350,
-            '白蛋白': 40,
-            '球蛋白': 25,
-            '手术时间': 120
-        }
-        
-        # 确保示例数据中包含所有需要的特征
-        for feature in selected_features:
-            if feature not in example_data:
-                example_data[feature] = 0
-        
-        # 添加示例数据行
-        df.loc[1] = [example_data[feature] for feature in selected_features]
-        
-        # 创建一个BytesIO对象
-        output = io.BytesIO()
-        
-        # 将DataFrame写入Excel文件
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, index=False, sheet_name='Template')
-            
-            # 获取xlsxwriter工作簿和工作表对象
-            workbook = writer.book
-            worksheet = writer.sheets['Template']
-            
-            # 添加一些格式
-            header_format = workbook.add_format({
-                'bold': True,
-                'text_wrap': True,
-                'valign': 'top',
-                'border': 1
-            })
-            
-            # 写入列标题
-            for col_num, value in enumerate(df.columns.values):
-                worksheet.write(0, col_num, value, header_format)
-                
-            # 设置列宽
-            worksheet.set_column(0, len(df.columns) - 1, 15)
-        
-        # 设置指针到开始
-        output.seek(0)
-        
-        # 发送文件
-        return send_file(
-            output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name='prediction_template.xlsx'
-        )
+        return get_precomputed('template').respond(f'public, max-age={STATIC_MAX_AGE}')
     except Exception as e:
         logger.error(f"生成模板文件时出错: {e}")
         return jsonify({
@@ -314,10 +910,14 @@ def download_template():
             'error': f'生成模板文件失败: {str(e)}'
         }), 500
 
+# 导入时按SVM_WARMUP启动预热，由WSGI服务器（gunicorn、waitress等）加载时同样生效；
+# 预热期间/api/health返回503
+if WARMUP_MODE != 'off':
+    start_warm_up()
+
 if __name__ == '__main__':
-    # 启动时加载模型
-    if load_model():
-        logger.info("系统启动成功，模型已加载")
+    if start_warm_up():
+        logger.info(f"系统启动成功，模型预热方式: {WARMUP_MODE}")
     else:
-        logger.error("系统启动失败，模型加载失败")
+        logger.error("系统启动失败，模型预热失败")
     app.run(debug=True, host='0.0.0.0', port=5001)
@@ -1,8 +1,13 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
+import json
 import os
 import logging
 from simple_model import SimpleSVMPredictor
+from feature_plan import FeatureTransformPlan
+from warmup import StartupTracker
+from schema import SERVING_FEATURES, FeatureSchema, SchemaValidationError, ValidationSummary
+from explain import ExplainBudget, explain_rows
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -13,11 +18,14 @@ CORS(app)
 
 # 全局变量
 model = None
-selected_features = ['性别', '年龄', '高血压', 'BMI', '前白细胞', '前血小板', '前淋巴细胞', 'NLR', '前红细胞', '前血红蛋白', '前单核细胞', '前尿白细胞', '前肌酐', '前尿酸', '白蛋白', '球蛋白', '手术时间']
+plan = None
+selected_features = list(SERVING_FEATURES)
+# selected_features 的类型和取值范围约束，见 schema.py
+feature_schema = FeatureSchema.for_features(selected_features)
 
 def load_model():
     """加载训练好的模型"""
-    global model
+    global model, plan
     try:
         model = SimpleSVMPredictor()
         # 尝试加载原始模型文件，如果失败则使用默认参数
@@ -28,44 +36,161 @@ def load_model():
             logger.warning("模型文件不存在，使用默认参数")
             model.load_model(None)
         
+        # 特征转换计划只负责列映射和缺失值填充，标准化由SimpleSVMPredictor完成
+        plan = FeatureTransformPlan(selected_features)
+
         logger.info("简化模型加载成功")
         return True
     except Exception as e:
         logger.error(f"模型加载失败: {e}")
         return False
 
+# Serverless冷启动时同步完成预热；pandas、openpyxl等只在文件上传时用到，
+# 有意保持延迟导入，不计入冷启动时间
+startup = StartupTracker()
+
+def warm_up():
+    """加载模型并执行一次预测，记录各阶段耗时"""
+    import numpy as np
+
+    startup.begin()
+    try:
+        with startup.stage('load_model'):
+            if not load_model():
+                raise RuntimeError('模型加载失败')
+        with startup.stage('warm_predict'):
+            _, probabilities = model.predict(plan.transform(np.full((1, len(selected_features)), np.nan)))
+            if not np.all(np.isfinite(probabilities)):
+                raise ValueError('预热预测得到无效的概率')
+        startup.mark_ready()
+        logger.info(f"模型预热完成，各阶段耗时(ms): {startup.timings_ms}")
+        return True
+    except Exception as e:
+        startup.mark_failed(e)
+        logger.error(f"模型预热失败: {e}")
+        return False
+
 def preprocess_data(data):
     """预处理数据"""
     try:
-        # 创建特征向量
-        feature_vector = []
+        # 调试日志只在DEBUG级别下格式化，避免在每个请求中序列化输入和特征向量
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"预处理输入数据: {data}")
         
-        # 打印输入数据用于调试
-        logger.info(f"预处理输入数据: {data}")
+        missing = [feature for feature in selected_features if feature not in data]
+        if missing:
+            # 如果找不到特征，记录并使用默认值
+            logger.warning(f"找不到特征 {', '.join(missing)} 的匹配项")
         
-        for feature in selected_features:
-            if feature in data:
-                value = data[feature]
-                if value is None or value == '':
-                    value = 0
-                feature_vector.append(float(value))
-            else:
-                # 如果找不到特征，记录并使用默认值
-                logger.warning(f"找不到特征 {feature} 的匹配项")
-                feature_vector.append(0.0)
+        values, invalid = plan.records_to_matrix([data])
+        feature_schema.validate(values, invalid).raise_for_row(0)
+        feature_vector = plan.transform(values, out=values)
         
-        # 打印生成的特征向量用于调试
-        logger.info(f"生成的特征向量: {feature_vector}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"生成的特征向量: {feature_vector[0].tolist()}")
         
         return feature_vector
     except Exception as e:
         logger.error(f"数据预处理失败: {e}")
         raise e
 
+def preprocess_batch(block, summary=None):
+    """批量校验并预处理特征矩阵，返回填充缺失值后的特征矩阵和校验结果"""
+    report = feature_schema.validate(block.values, block.invalid)
+    if summary is not None:
+        summary.add(report)
+
+    # 缺失值使用0填充
+    return plan.transform(block.values, out=block.values), report
+
+def build_batch_results(processed_data, report, row_offset=0, explain=None):
+    """对一批特征矩阵打分并生成逐行结果，未通过校验的行返回错误信息
+
+    explain为ExplainBudget时，在上限内为有效行附加逐特征贡献（weights * x_scaled）
+    """
+    import numpy as np
+
+    results = [None] * len(processed_data)
+    valid_rows = np.flatnonzero(~report.rejected)
+    explanations = {}
+    if explain is not None:
+        explanations = explain_rows(model.feature_contributions, processed_data, explain.take(valid_rows), selected_features)
+    if len(valid_rows):
+        predictions, probabilities = model.predict(processed_data[valid_rows])
+        for i, prediction, probability in zip(valid_rows.tolist(), predictions.tolist(), probabilities.tolist()):
+            confidence = max(probability, 1 - probability)
+
+            results[i] = {
+                'row': row_offset + i + 1,
+                'prediction': prediction,
+                'prediction_label': 'Positive' if prediction == 1 else 'Negative',
+                'confidence': confidence,
+                'probabilities': {
+                    'negative': 1 - probability,
+                    'positive': probability
+                }
+            }
+            if i in explanations:
+                results[i]['explanation'] = explanations[i]
+
+    for i, error in report.errors.items():
+        logger.error(f"处理第{row_offset + i + 1}行数据时出错: {error}")
+        results[i] = {
+            'row': row_offset + i + 1,
+            'error': f'处理失败: {error}',
+            'errors': report.row_errors(i)
+        }
+    return results
+
+def wants_explain():
+    """客户端是否请求逐特征解释（?explain=true）"""
+    return request.args.get('explain', '').lower() in ('1', 'true', 'yes')
+
+def wants_stream():
+    """客户端是否请求NDJSON流式响应"""
+    if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return 'application/x-ndjson' in request.headers.get('Accept', '')
+
+def stream_batch_predictions(file, explain=None):
+    """按块读取上传文件并逐块打分，以NDJSON格式流式返回结果"""
+    from ingestion import detach_upload, iter_upload_blocks
+
+    file = detach_upload(file)
+    blocks = iter_upload_blocks(file, selected_features)
+
+    def generate():
+        total = 0
+        summary = ValidationSummary()
+        try:
+            for block in blocks:
+                processed_data, report = preprocess_batch(block, summary)
+                results = build_batch_results(processed_data, report, row_offset=total, explain=explain)
+                total += len(results)
+                yield ''.join(json.dumps(result) + '\n' for result in results)
+            done = {'success': True, 'total_samples': total, 'validation': summary.to_dict()}
+            if explain is not None:
+                done['explain'] = explain.to_dict()
+            yield json.dumps(done) + '\n'
+        except Exception as e:
+            logger.error(f"流式预测在第{total}行之后失败: {e}")
+            yield json.dumps({'success': False, 'error': f'文件处理错误: {str(e)}', 'total_samples': total}) + '\n'
+        finally:
+            file.close()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        # 关闭nginx的响应缓冲，使结果逐块到达客户端
+        headers={'X-Accel-Buffering': 'no', 'Cache-Control': 'no-cache'}
+    )
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    """健康检查端点"""
-    return jsonify({'status': 'healthy', 'message': 'SVM预测服务运行正常'})
+    """健康检查端点，预热未完成时返回503"""
+    if not startup.ready:
+        return jsonify({'status': startup.status, 'message': '模型未就绪', 'startup': startup.snapshot()}), 503
+    return jsonify({'status': 'healthy', 'message': 'SVM预测服务运行正常', 'startup': startup.snapshot()})
 
 @app.route('/api/predict', methods=['POST'])
 def predict():
@@ -76,6 +201,7 @@ def predict():
                 'success': False,
                 'error': '模型未加载'
             }), 500
+        explain = ExplainBudget() if wants_explain() else None
 
         # 处理 JSON 数据
         if request.is_json:
@@ -102,10 +228,18 @@ def predict():
                 }
             }
             
-            return jsonify({
+            response = {
                 'success': True,
                 'result': result
-            })
+            }
+            if explain is not None:
+                import numpy as np
+
+                explanations = explain_rows(model.feature_contributions, processed_data, explain.take(np.arange(1)), selected_features)
+                if explanations:
+                    result['explanation'] = explanations[0]
+                response['explain'] = explain.to_dict()
+            return jsonify(response)
         
         # 处理文件上传
         elif 'file' in request.files:
@@ -115,104 +249,54 @@ def predict():
             
             if not (file.filename.lower().endswith('.csv') or file.filename.lower().endswith('.xlsx') or file.filename.lower().endswith('.xls')):
                 return jsonify({'success': False, 'error': '仅支持CSV和Excel文件'}), 400
+
+            if wants_stream():
+                return stream_batch_predictions(file, explain)
             
-            # 处理不同文件格式
-            if file.filename.endswith('.csv'):
-                # CSV文件处理
-                content = file.read().decode('utf-8')
-                lines = content.strip().split('\n')
-                
-                if len(lines) < 2:
+            # 只读取selected_features列，直接得到float64特征矩阵
+            try:
+                from ingestion import read_upload_matrix
+                block = read_upload_matrix(file, selected_features)
+            except Exception as e:
+                return jsonify({'success': False, 'error': f'文件处理错误: {str(e)}'}), 400
+
+            if file.filename.lower().endswith('.csv'):
+                if len(block.values) == 0:
                     return jsonify({'success': False, 'error': 'CSV文件格式错误'}), 400
-                
-                headers = [h.strip() for h in lines[0].split(',')]
-                data_rows = []
-                
-                for i, line in enumerate(lines[1:], 1):
-                    values = [v.strip() for v in line.split(',')]
-                    if len(values) != len(headers):
-                        continue
-                    
-                    # 创建数据字典
-                    row_data = dict(zip(headers, values))
-                    data_rows.append(row_data)
-            
-            elif file.filename.endswith(('.xlsx', '.xls')):
-                # Excel文件处理
-                try:
-                    import pandas as pd
-                    import io
-                    
-                    # 保存上传的文件到内存中
-                    file_stream = io.BytesIO(file.read())
-                    
-                    # 使用pandas读取Excel文件
-                    df = pd.read_excel(file_stream)
-                    
-                    # 打印列名用于调试
-                    logger.info(f"Excel文件列名: {list(df.columns)}")
-                    
-                    # 检查是否包含所有必要的特征列
-                    missing_features = [feature for feature in selected_features if feature not in df.columns]
-                    if missing_features:
-                        error_msg = f"Excel文件缺少必要的特征列: {', '.join(missing_features)}"
-                        logger.error(error_msg)
-                        return jsonify({'success': False, 'error': error_msg}), 400
-                    
-                    # 转换为字典列表
-                    data_rows = df.to_dict('records')
-                    
-                    if len(data_rows) == 0:
-                        return jsonify({'success': False, 'error': 'Excel文件为空'}), 400
-                        
-                    # 打印第一行数据用于调试
-                    if data_rows:
-                        logger.info(f"第一行数据: {data_rows[0]}")
-                        logger.info(f"Excel第一行数据类型: {type(data_rows[0]).__name__}")
-                        logger.info(f"Excel数据行数: {len(data_rows)}")
-                    
-                except Exception as e:
-                    return jsonify({'success': False, 'error': f'Excel文件处理错误: {str(e)}'}), 400
-            
             else:
-                return jsonify({'success': False, 'error': '仅支持CSV和Excel文件格式'}), 400
+                # 检查是否包含所有必要的特征列
+                if block.missing_features:
+                    error_msg = f"Excel文件缺少必要的特征列: {', '.join(block.missing_features)}"
+                    logger.error(error_msg)
+                    return jsonify({'success': False, 'error': error_msg}), 400
+                if len(block.values) == 0:
+                    return jsonify({'success': False, 'error': 'Excel文件为空'}), 400
+                logger.info(f"Excel数据行数: {len(block.values)}")
             
-            # 批量预测
-            results = []
-            for i, row_data in enumerate(data_rows, 1):
-                
-                try:
-                    # 预处理和预测
-                    processed_data = preprocess_data(row_data)
-                    predictions, probabilities = model.predict(processed_data)
-                    prediction = int(predictions[0])
-                    probability = float(probabilities[0])
-                    
-                    confidence = max(probability, 1 - probability)
-                    
-                    results.append({
-                        'row': i,
-                        'prediction': prediction,
-                        'prediction_label': 'Positive' if prediction == 1 else 'Negative',
-                        'confidence': confidence,
-                        'probabilities': {
-                            'negative': 1 - probability,
-                            'positive': probability
-                        }
-                    })
-                except Exception as e:
-                    logger.error(f"处理第{i}行数据时出错: {e}")
-                    continue
+            # 批量预测：整个文件一次性打分
+            summary = ValidationSummary()
+            processed_data, report = preprocess_batch(block, summary)
+            results = build_batch_results(processed_data, report, explain=explain)
             
-            return jsonify({
+            response = {
                 'success': True,
                 'total_samples': len(results),
-                'predictions': results
-            })
+                'predictions': results,
+                'validation': summary.to_dict()
+            }
+            if explain is not None:
+                response['explain'] = explain.to_dict()
+            return jsonify(response)
         
         else:
             return jsonify({'success': False, 'error': '无效的请求格式'}), 400
             
+    except SchemaValidationError as e:
+        return jsonify({
+            'success': False,
+            'error': f'输入数据无效: {str(e)}',
+            'errors': e.errors
+        }), 400
     except Exception as e:
         logger.error(f"预测过程中出错: {e}")
         return jsonify({
@@ -323,7 +407,7 @@ def download_template():
         }), 500
 
 # 初始化模型
-if load_model():
+if warm_up():
     logger.info("系统启动成功，模型已加载")
 else:
     logger.error("系统启动失败，模型加载失败")
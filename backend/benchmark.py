@@ -0,0 +1,242 @@
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+import warnings
+
+import numpy as np
+
+# 基准测试直接调用Flask测试客户端，关闭预测缓存以测量真实的打分开销
+os.environ.setdefault('PREDICT_CACHE_SIZE', '0')
+os.environ.setdefault('SVM_WARMUP', 'off')
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 每项结果中用于回归比较的指标（越小越好）
+PRIMARY_METRIC = {
+    'model_load': 'median_ms',
+    'single': 'p50_ms',
+    'batch': 'seconds',
+}
+
+def synthetic_patients(features, n, mean, scale, seed=0):
+    """按特征的均值和标准差生成合成患者数据，取值满足 schema.py 中的约束（整数/二值特征取整，超出范围时截断）"""
+    from schema import FeatureSchema
+
+    rng = np.random.default_rng(seed)
+    values = rng.normal(mean, scale, size=(n, len(features)))
+    values = np.abs(values)
+    for j, name in enumerate(features):
+        if name in ('性别', '高血压'):
+            values[:, j] = (values[:, j] > mean[j]).astype(np.float64)
+    schema = FeatureSchema.for_features(features)
+    values = np.round(values, 2)
+    values[:, schema.integer_columns] = np.round(values[:, schema.integer_columns])
+    return np.clip(values, schema.lower_, schema.upper_)
+
+def summarize_latencies(latencies):
+    latencies = np.asarray(latencies) * 1000.0
+    return {
+        'requests': len(latencies),
+        'mean_ms': float(latencies.mean()),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p90_ms': float(np.percentile(latencies, 90)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'max_ms': float(latencies.max()),
+        'throughput_rps': float(len(latencies) / (latencies.sum() / 1000.0)),
+    }
+
+def bench_model_load(name, load, repeat):
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        if not load():
+            raise RuntimeError(f'{name} 模型加载失败')
+        timings.append(time.perf_counter() - t0)
+    timings = np.asarray(timings) * 1000.0
+    return {'kind': 'model_load', 'repeat': repeat, 'median_ms': float(np.median(timings)),
+            'min_ms': float(timings.min()), 'max_ms': float(timings.max())}
+
+def bench_single(client, records, warmup=50):
+    """逐个发送JSON单样本请求，记录每个请求的延迟"""
+    for record in records[:warmup]:
+        client.post('/api/predict', json=record)
+    latencies = []
+    for record in records:
+        t0 = time.perf_counter()
+        response = client.post('/api/predict', json=record)
+        latencies.append(time.perf_counter() - t0)
+        if response.status_code != 200:
+            raise RuntimeError(f'单样本预测失败: {response.status_code} {response.get_data(as_text=True)[:200]}')
+    return {'kind': 'single', **summarize_latencies(latencies)}
+
+def bench_batch(client, payload, filename, rows, repeat, query=''):
+    """上传批量文件repeat次，记录端到端耗时的中位数"""
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        response = client.post('/api/predict' + query, data={'file': (io.BytesIO(payload), filename)})
+        body = response.get_data()
+        timings.append(time.perf_counter() - t0)
+        if response.status_code != 200:
+            raise RuntimeError(f'批量预测失败: {response.status_code} {body[:200]!r}')
+        if b'"error"' in body:
+            # 有行未通过校验时只会测到错误处理的路径
+            raise RuntimeError(f'批量预测中有行未通过校验: {body[:200]!r}')
+    seconds = float(np.median(timings))
+    return {'kind': 'batch', 'rows': rows, 'bytes': len(payload), 'repeat': repeat, 'seconds': seconds,
+            'min_seconds': float(min(timings)), 'rows_per_second': rows / seconds}
+
+def make_files(features, values, formats):
+    import pandas as pd
+
+    df = pd.DataFrame(values, columns=features)
+    files = {}
+    if 'csv' in formats:
+        files['csv'] = (df.to_csv(index=False).encode('utf-8'), 'bench.csv')
+    if 'xlsx' in formats:
+        output = io.BytesIO()
+        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+            df.to_excel(writer, index=False)
+        files['xlsx'] = (output.getvalue(), 'bench.xlsx')
+    return files
+
+def run(args):
+    import logging
+
+    os.chdir(BACKEND_DIR)
+    sys.path.insert(0, BACKEND_DIR)
+
+    t0 = time.perf_counter()
+    import app
+    import_app_ms = (time.perf_counter() - t0) * 1000.0
+    t0 = time.perf_counter()
+    import app_vercel
+    import_vercel_ms = (time.perf_counter() - t0) * 1000.0
+    # 两个应用都在导入时把日志级别设为INFO，基准测试中只保留警告以上
+    logging.getLogger().setLevel(logging.WARNING)
+    # svm_model.pkl 训练时带有列名，直接传入矩阵时sklearn每次都会警告
+    warnings.filterwarnings('ignore', message='X does not have valid feature names')
+
+    if not app.warm_up():
+        raise RuntimeError(f'模型预热失败: {app.startup.error}')
+
+    features = app.selected_features
+    mean, scale = app.plan.mean_, app.plan.scale_
+    results = {
+        'import_app': {'kind': 'model_load', 'repeat': 1, 'median_ms': import_app_ms},
+        'import_app_vercel': {'kind': 'model_load', 'repeat': 1, 'median_ms': import_vercel_ms},
+    }
+
+    def use_model(model):
+        # 换成指定的模型对象，沿用当前的特征转换计划和版本号
+        bundle = app.current_bundle()
+        app.reloader.activate(app.ModelBundle(model, bundle.plan, bundle.version, bundle.source))
+
+    def load_sklearn():
+        use_model(app.load_sklearn_model(app.MODEL_PATH))
+        return True
+
+    compiled_model = app.model
+    results['model_load_app'] = bench_model_load('app', app.load_model, args.repeat)
+    results['model_load_app_sklearn'] = bench_model_load('app_sklearn', load_sklearn, args.repeat)
+    results['model_load_app_vercel'] = bench_model_load('app_vercel', app_vercel.load_model, args.repeat)
+
+    values = synthetic_patients(features, args.single_requests, mean, scale, seed=args.seed)
+    records = [dict(zip(features, row.tolist())) for row in values]
+
+    # app.py 的两种打分路径：导出的NumPy打分器和sklearn SVC
+    client = app.app.test_client()
+    use_model(compiled_model)
+    results['single_app'] = bench_single(client, records)
+    load_sklearn()
+    results['single_app_sklearn'] = bench_single(client, records)
+    results['single_app_vercel'] = bench_single(app_vercel.app.test_client(), records)
+
+    use_model(compiled_model)
+    vercel_client = app_vercel.app.test_client()
+    for rows in args.sizes:
+        values = synthetic_patients(features, rows, mean, scale, seed=args.seed + rows)
+        # 大文件只测一次，小文件多测几次取中位数以降低噪声
+        repeat = max(1, min(args.repeat, 100000 // (rows * 10) or 1))
+        for fmt, (payload, filename) in make_files(features, values, args.formats).items():
+            results[f'batch_app_{fmt}_{rows}'] = bench_batch(client, payload, filename, rows, repeat)
+            results[f'batch_app_{fmt}_stream_{rows}'] = bench_batch(client, payload, filename, rows, repeat, '?stream=1')
+            results[f'batch_app_vercel_{fmt}_{rows}'] = bench_batch(vercel_client, payload, filename, rows, repeat)
+
+    return results
+
+def environment_info():
+    info = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    from importlib.metadata import PackageNotFoundError, version
+    for package in ('scikit-learn', 'pandas', 'flask'):
+        try:
+            info[package] = version(package)
+        except PackageNotFoundError:
+            info[package] = None
+    return info
+
+def compare(results, baseline, tolerance):
+    """与基线比较主要指标，返回 (比较表, 是否存在回归)"""
+    rows = []
+    regressed = False
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        metric = PRIMARY_METRIC[current['kind']]
+        ratio = current[metric] / previous[metric] if previous[metric] else float('inf')
+        is_regression = ratio > 1.0 + tolerance
+        regressed |= is_regression
+        rows.append({'name': name, 'metric': metric, 'baseline': previous[metric],
+                     'current': current[metric], 'ratio': ratio, 'regression': is_regression})
+    return rows, regressed
+
+def main():
+    parser = argparse.ArgumentParser(description='SVM预测服务基准测试')
+    parser.add_argument('--output', default='benchmark_results.json', help='结果JSON文件')
+    parser.add_argument('--baseline', help='基线结果JSON文件，提供时进行回归比较')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='允许的相对变慢比例，默认0.2')
+    parser.add_argument('--sizes', default='1000,10000,100000', help='批量文件的行数，逗号分隔')
+    parser.add_argument('--formats', default='csv,xlsx', help='批量文件格式，逗号分隔')
+    parser.add_argument('--single-requests', type=int, default=2000, help='单样本请求数')
+    parser.add_argument('--repeat', type=int, default=5, help='模型加载重复次数')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    args.sizes = [int(s) for s in args.sizes.split(',') if s]
+    args.formats = [s for s in args.formats.split(',') if s]
+
+    results = run(args)
+    report = {'environment': environment_info(), 'results': results}
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for name, result in results.items():
+        metric = PRIMARY_METRIC[result['kind']]
+        print(f'{name:40s} {metric:10s} {result[metric]:12.3f}')
+    print(f'结果已写入 {args.output}')
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        rows, regressed = compare(results, baseline, args.tolerance)
+        for row in rows:
+            flag = '回归' if row['regression'] else ''
+            print(f"{row['name']:40s} {row['baseline']:12.3f} -> {row['current']:12.3f} ({row['ratio']:.2f}x) {flag}")
+        if regressed:
+            print(f'存在超过{args.tolerance:.0%}的性能回归')
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
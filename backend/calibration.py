@@ -0,0 +1,138 @@
+import json
+
+import numpy as np
+
+from compiled_model import _sigmoid_predict
+
+# 概率校准阶段：在留出集上把SVM的决策函数值映射为正类概率，
+# 代替 SVC(probability=True) 在训练时额外进行的5折交叉验证
+CALIBRATION_METHODS = ('platt', 'isotonic')
+
+class PlattCalibrator:
+    """Platt sigmoid校准：P(正类) = 1 / (1 + exp(a * f + b))"""
+
+    method = 'platt'
+
+    def __init__(self, a, b):
+        self.a = float(a)
+        self.b = float(b)
+
+    @classmethod
+    def fit(cls, decision, positive, max_iter=100, min_step=1e-10, sigma=1e-12, eps=1e-5):
+        """libsvm sigmoid_train 的NumPy实现（带目标平滑的牛顿法和回溯线搜索）"""
+        f = np.asarray(decision, dtype=np.float64)
+        positive = np.asarray(positive, dtype=bool)
+        prior1 = positive.sum()
+        prior0 = len(positive) - prior1
+        t = np.where(positive, (prior1 + 1.0) / (prior1 + 2.0), 1.0 / (prior0 + 2.0))
+
+        def objective(A, B):
+            fApB = f * A + B
+            return np.sum(np.where(fApB >= 0, t * fApB + np.log1p(np.exp(-np.abs(fApB))),
+                                   (t - 1.0) * fApB + np.log1p(np.exp(-np.abs(fApB)))))
+
+        A, B = 0.0, float(np.log((prior0 + 1.0) / (prior1 + 1.0)))
+        fval = objective(A, B)
+        for _ in range(max_iter):
+            p = _sigmoid_predict(f, A, B)
+            d2 = p * (1.0 - p)
+            h11 = sigma + np.sum(f * f * d2)
+            h22 = sigma + np.sum(d2)
+            h21 = np.sum(f * d2)
+            d1 = t - p
+            g1 = np.sum(f * d1)
+            g2 = np.sum(d1)
+            if abs(g1) < eps and abs(g2) < eps:
+                break
+            det = h11 * h22 - h21 * h21
+            dA = -(h22 * g1 - h21 * g2) / det
+            dB = -(-h21 * g1 + h11 * g2) / det
+            gd = g1 * dA + g2 * dB
+            step = 1.0
+            while step >= min_step:
+                new_A, new_B = A + step * dA, B + step * dB
+                new_f = objective(new_A, new_B)
+                if new_f < fval + 0.0001 * step * gd:
+                    A, B, fval = new_A, new_B, new_f
+                    break
+                step /= 2.0
+            if step < min_step:
+                break
+        return cls(A, B)
+
+    def predict(self, decision):
+        return _sigmoid_predict(np.asarray(decision, dtype=np.float64), self.a, self.b)
+
+    def to_dict(self):
+        return {'method': self.method, 'a': self.a, 'b': self.b}
+
+class IsotonicCalibrator:
+    """保序回归校准：按决策函数值分段线性插值，超出范围时取端点"""
+
+    method = 'isotonic'
+
+    def __init__(self, x, y):
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+
+    @classmethod
+    def fit(cls, decision, positive):
+        from sklearn.isotonic import IsotonicRegression
+
+        iso = IsotonicRegression(y_min=0.0, y_max=1.0, out_of_bounds='clip')
+        iso.fit(np.asarray(decision, dtype=np.float64), np.asarray(positive, dtype=np.float64))
+        return cls(iso.X_thresholds_, iso.y_thresholds_)
+
+    def predict(self, decision):
+        return np.interp(np.asarray(decision, dtype=np.float64), self.x, self.y)
+
+    def to_dict(self):
+        return {'method': self.method, 'x': self.x.tolist(), 'y': self.y.tolist()}
+
+def fit_calibrator(decision, positive, method='platt'):
+    """在留出集的决策函数值上拟合校准器，positive为是否属于正类（classes_[1]）"""
+    if method == 'platt':
+        return PlattCalibrator.fit(decision, positive)
+    if method == 'isotonic':
+        return IsotonicCalibrator.fit(decision, positive)
+    raise ValueError(f"不支持的校准方法: {method}，可选 {', '.join(CALIBRATION_METHODS)}")
+
+def calibrator_from_dict(data):
+    if data['method'] == 'platt':
+        return PlattCalibrator(data['a'], data['b'])
+    if data['method'] == 'isotonic':
+        return IsotonicCalibrator(data['x'], data['y'])
+    raise ValueError(f"不支持的校准方法: {data['method']}")
+
+def save_calibrator(calibrator, path, model_sha256=None, **info):
+    """保存为JSON，model_sha256记录对应的模型文件，加载时用于检查是否一致"""
+    data = {**calibrator.to_dict(), 'model_sha256': model_sha256, **info}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+def load_calibrator(path):
+    """返回 (校准器, 对应模型文件的sha256)"""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    return calibrator_from_dict(data), data.get('model_sha256')
+
+class CalibratedSVC:
+    """未启用概率输出的SVC加上独立的校准器，接口与 SVC(probability=True) 相同"""
+
+    def __init__(self, svc, calibrator):
+        self.svc = svc
+        self.calibrator = calibrator
+        self.classes_ = svc.classes_
+        self.n_features_in_ = svc.n_features_in_
+        if hasattr(svc, 'feature_names_in_'):
+            self.feature_names_in_ = svc.feature_names_in_
+
+    def decision_function(self, X):
+        return self.svc.decision_function(X)
+
+    def predict_proba(self, X):
+        p = self.calibrator.predict(self.decision_function(X))
+        return np.column_stack([1.0 - p, p])
+
+    def predict(self, X):
+        return self.svc.predict(X)
@@ -0,0 +1,139 @@
+import bisect
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+# 批大小和排队延迟（毫秒）的统计分桶
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+QUEUE_DELAY_BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 250)
+
+class _Histogram:
+    """固定分桶的简单直方图"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def snapshot(self):
+        labels = [f'le_{b}' for b in self.buckets] + ['le_inf']
+        return {
+            'buckets': dict(zip(labels, self.counts)),
+            'count': self.total,
+            'sum': self.sum,
+            'mean': self.sum / self.total if self.total else 0.0,
+            'max': self.max,
+        }
+
+class RequestCoalescer:
+    """请求合并器：把时间窗口内到达的单样本请求合并成一个矩阵统一打分
+
+    score_fn接收 (n, n_features) 的矩阵和提交时的context（如模型版本），返回
+    (predictions, probabilities)，probabilities可以为None。context相同（同一对象）的
+    请求才会一起打分。每个调用方通过submit()拿到自己那一行的结果。
+    """
+
+    def __init__(self, score_fn, window_ms=2.0, max_batch_size=64, timeout=30.0):
+        self.score_fn = score_fn
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = _Histogram(BATCH_SIZE_BUCKETS)
+        self._queue_delays = _Histogram(QUEUE_DELAY_BUCKETS_MS)
+        self._errors = 0
+
+    def _ensure_started(self):
+        # 在第一次提交时才启动后台线程，多进程部署时可以安全地fork
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='request-coalescer', daemon=True)
+                self._thread.start()
+
+    def submit(self, row, context=None):
+        """提交一行特征，阻塞直到得到 (prediction, probability_row)"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((np.asarray(row, dtype=np.float64).ravel(), time.perf_counter(), future, context))
+        return future.result(timeout=self.timeout)
+
+    def _collect(self):
+        """取出一批请求：从第一个请求到达开始等待window，或凑满max_batch_size"""
+        batch = [self._queue.get()]
+        deadline = batch[0][1] + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            with self._stats_lock:
+                self._batch_sizes.observe(len(batch))
+                for _, enqueued, _, _ in batch:
+                    self._queue_delays.observe((started - enqueued) * 1000.0)
+
+            # 按context分组，通常只有一组；模型切换的瞬间新旧版本的请求分别打分
+            groups = []
+            for item in batch:
+                for context, items in groups:
+                    if context is item[3]:
+                        items.append(item)
+                        break
+                else:
+                    groups.append((item[3], [item]))
+            for context, items in groups:
+                self._score_group(context, items)
+
+    def _score_group(self, context, items):
+        try:
+            X = np.vstack([row for row, _, _, _ in items])
+            predictions, probabilities = self.score_fn(X, context)
+        except Exception as e:
+            with self._stats_lock:
+                self._errors += 1
+            for _, _, future, _ in items:
+                future.set_exception(e)
+            return
+
+        for i, (_, _, future, _) in enumerate(items):
+            future.set_result((predictions[i], None if probabilities is None else probabilities[i]))
+
+    def stats(self):
+        """批大小分布和排队延迟统计"""
+        with self._stats_lock:
+            return {
+                'enabled': True,
+                'window_ms': self.window * 1000.0,
+                'max_batch_size': self.max_batch_size,
+                'queued': self._queue.qsize(),
+                'batches': self._batch_sizes.total,
+                'errors': self._errors,
+                'batch_size': self._batch_sizes.snapshot(),
+                'queue_delay_ms': self._queue_delays.snapshot(),
+            }
@@ -0,0 +1,83 @@
+import json
+import struct
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 批量预测的列式响应：format=columnar 为JSON并行数组，format=columnar-f32 为二进制
+COLUMNAR_FORMATS = ('columnar', 'columnar-f32')
+COLUMNAR_F32_MIMETYPE = 'application/vnd.svm-columnar-f32'
+# 二进制格式中各数组按8字节对齐，客户端可以直接创建 Float32Array 等视图
+ALIGNMENT = 8
+
+def _default(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"无法序列化 {type(value).__name__}")
+
+def dumps(obj):
+    """序列化为UTF-8 JSON字节；安装了orjson时直接序列化NumPy数组，否则使用标准库"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY, default=_default)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=_default).encode('utf-8')
+
+def encode_json(meta, columns):
+    """JSON列式格式：meta中的字段加上 columns（{名称: 数组}）"""
+    return dumps({**meta, 'columns': columns})
+
+def encode_f32(meta, columns):
+    """二进制列式格式
+
+    4字节小端无符号整数（头部长度）+ JSON头部 + 数据区。头部包含meta中的字段和
+    arrays 列表，每项给出数组名称、dtype（NumPy记法，如 <f4）、形状和在数据区中的偏移。
+    浮点数组转换为float32。
+    """
+    arrays = []
+    chunks = []
+    offset = 0
+    for name, values in columns.items():
+        values = np.asarray(values)
+        if values.dtype.kind == 'f':
+            values = values.astype('<f4', copy=False)
+        elif values.dtype.kind in 'iu' and values.dtype.byteorder == '>':
+            values = values.astype(values.dtype.newbyteorder('<'))
+        values = np.ascontiguousarray(values)
+        padding = -offset % ALIGNMENT
+        if padding:
+            chunks.append(b'\0' * padding)
+            offset += padding
+        arrays.append({'name': name, 'dtype': values.dtype.str, 'shape': list(values.shape), 'offset': offset})
+        chunks.append(values.tobytes())
+        offset += values.nbytes
+
+    header = dumps({**meta, 'arrays': arrays})
+    # 头部补齐到对齐边界，数据区从对齐的位置开始
+    header += b' ' * (-(4 + len(header)) % ALIGNMENT)
+    return b''.join([struct.pack('<I', len(header)), header, *chunks])
+
+def encode_columnar(meta, columns, fmt):
+    """按format编码，返回 (响应体, mimetype)"""
+    if fmt == 'columnar':
+        return encode_json(meta, columns), 'application/json'
+    if fmt == 'columnar-f32':
+        return encode_f32(meta, columns), COLUMNAR_F32_MIMETYPE
+    raise ValueError(f"不支持的响应格式: {fmt}")
+
+def decode_f32(body):
+    """解析二进制列式格式，返回 (头部, {名称: 数组})"""
+    (length,) = struct.unpack_from('<I', body)
+    header = json.loads(body[4:4 + length])
+    start = 4 + length
+    columns = {}
+    for spec in header['arrays']:
+        dtype = np.dtype(spec['dtype'])
+        count = int(np.prod(spec['shape'], dtype=np.int64))
+        columns[spec['name']] = np.frombuffer(body, dtype=dtype, count=count,
+                                              offset=start + spec['offset']).reshape(spec['shape'])
+    return header, columns
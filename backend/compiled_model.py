@@ -0,0 +1,470 @@
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# libsvm 中概率的下限，与 sklearn 保持一致
+MIN_PROB = 1e-7
+
+def file_sha256(path):
+    """计算文件的 sha256，用于标识模型版本"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _sigmoid_predict(decision_value, A, B):
+    """libsvm 的 Platt sigmoid，按 fApB 的符号选择数值稳定的形式"""
+    fApB = decision_value * A + B
+    out = np.empty_like(fApB)
+    pos = fApB >= 0
+    e = np.exp(-fApB[pos])
+    out[pos] = e / (1.0 + e)
+    out[~pos] = 1.0 / (1.0 + np.exp(fApB[~pos]))
+    return out
+
+def _binary_coupling(r01, max_iter=100):
+    """libsvm multiclass_probability 在两类时的向量化实现
+
+    sklearn 自带的 libsvm 即使只有两类也会进行迭代求解，并在误差小于
+    0.005/k 时停止，因此结果与 r01 并不完全相同。
+    """
+    r10 = 1.0 - r01
+    q00 = r10 * r10
+    q11 = r01 * r01
+    q01 = -r10 * r01
+    p0 = np.full_like(r01, 0.5)
+    p1 = np.full_like(r01, 0.5)
+    eps = 0.005 / 2
+    active = np.ones(r01.shape, dtype=bool)
+
+    for _ in range(max_iter):
+        qp0 = q00 * p0 + q01 * p1
+        qp1 = q01 * p0 + q11 * p1
+        pqp = p0 * qp0 + p1 * qp1
+        max_error = np.maximum(np.abs(qp0 - pqp), np.abs(qp1 - pqp))
+        active &= max_error >= eps
+        if not active.any():
+            break
+        idx = np.flatnonzero(active)
+        a0, a1 = p0[idx], p1[idx]
+        qp0, qp1, pqp = qp0[idx], qp1[idx], pqp[idx]
+        Q00, Q01, Q11 = q00[idx], q01[idx], q11[idx]
+
+        # t = 0
+        diff = (-qp0 + pqp) / Q00
+        a0 = a0 + diff
+        pqp = (pqp + diff * (diff * Q00 + 2 * qp0)) / (1 + diff) / (1 + diff)
+        qp0 = (qp0 + diff * Q00) / (1 + diff)
+        qp1 = (qp1 + diff * Q01) / (1 + diff)
+        a0 = a0 / (1 + diff)
+        a1 = a1 / (1 + diff)
+
+        # t = 1
+        diff = (-qp1 + pqp) / Q11
+        a1 = a1 + diff
+        a0 = a0 / (1 + diff)
+        a1 = a1 / (1 + diff)
+
+        p0[idx], p1[idx] = a0, a1
+
+    return np.column_stack([p0, p1])
+
+def _rbf_kernel(X, Y, Y_sq_norms, gamma):
+    """计算 X 与 Y 之间的 RBF 核矩阵，Y_sq_norms 为预先计算的 Y 各行平方范数"""
+    sq_dist = np.einsum('ij,ij->i', X, X)[:, None] + Y_sq_norms[None, :]
+    sq_dist -= 2.0 * (X @ Y.T)
+    np.maximum(sq_dist, 0.0, out=sq_dist)
+    sq_dist *= -gamma
+    return np.exp(sq_dist, out=sq_dist)
+
+def _rbf_contributions(X, centers, center_sq_norms, weights, gamma):
+    """f(x) = Σ w_j K(x, c_j) 的逐特征贡献（梯度×输入），同时返回 f(x)
+
+    ∂f/∂x = -2γ Σ w_j K(x, c_j) (x - c_j) = 2γ ((w∘K) C - x Σ w_j K(x, c_j))，
+    整批只需一次核矩阵和一次矩阵乘法。
+    """
+    weighted = _rbf_kernel(X, centers, center_sq_norms, gamma)
+    weighted *= weights
+    decision = weighted.sum(axis=1)
+    gradient = weighted @ centers
+    gradient -= X * decision[:, None]
+    gradient *= 2.0 * gamma
+    gradient *= X
+    return gradient, decision
+
+def _batched_contributions(X, batch_size, compute):
+    contributions = np.empty_like(X)
+    decision = np.empty(X.shape[0])
+    for start in range(0, X.shape[0], batch_size):
+        stop = start + batch_size
+        contributions[start:stop], decision[start:stop] = compute(X[start:stop])
+    return contributions, decision
+
+def _check_input(X, n_features):
+    X = np.asarray(X, dtype=np.float64)
+    if X.ndim == 1:
+        X = X.reshape(1, -1)
+    if X.shape[1] != n_features:
+        raise ValueError(f"特征数量不匹配: 期望 {n_features}，实际 {X.shape[1]}")
+    return X
+
+def _calibrated_proba(calibrator, decision):
+    p = calibrator.predict(decision)
+    return np.column_stack([1.0 - p, p])
+
+class CompiledSVMScorer:
+    """从 svm_model.pkl 导出的纯 NumPy RBF 核 SVM 打分器，运行时不依赖 sklearn
+
+    概率有两种来源：SVC(probability=True) 自带的libsvm Platt参数（prob_a/prob_b），
+    或训练时单独拟合的校准器（calibrator，见 calibration.py）。
+    """
+
+    def __init__(self, support_vectors, dual_coef, intercept, gamma, prob_a, prob_b,
+                 classes, feature_names=None, source_sha256=None, batch_size=1024, calibrator=None):
+        self.support_vectors_ = np.ascontiguousarray(support_vectors, dtype=np.float64)
+        self.dual_coef_ = np.ascontiguousarray(dual_coef, dtype=np.float64)
+        self.intercept_ = float(intercept)
+        self.gamma = float(gamma)
+        self.prob_a = float(prob_a)
+        self.prob_b = float(prob_b)
+        self.calibrator = calibrator
+        self.classes_ = np.asarray(classes)
+        self.feature_names_in_ = None if feature_names is None else np.asarray(feature_names)
+        self.n_features_in_ = self.support_vectors_.shape[1]
+        self.source_sha256 = source_sha256
+        self.batch_size = batch_size
+        # 预先计算支持向量的平方范数
+        self._sv_sq_norms = np.einsum('ij,ij->i', self.support_vectors_, self.support_vectors_)
+
+    @classmethod
+    def from_svc(cls, svc, source_sha256=None, calibrator=None):
+        """从训练好的 sklearn SVC 中提取参数，未启用概率输出时需要提供校准器"""
+        if svc.kernel != 'rbf':
+            raise ValueError(f"仅支持RBF核SVM，当前核函数: {svc.kernel}")
+        if len(svc.classes_) != 2:
+            raise ValueError("仅支持二分类SVM")
+        has_probability = getattr(svc, 'probability', False) and len(svc.probA_) > 0
+        if calibrator is None and not has_probability:
+            raise ValueError("SVM模型未启用概率输出(probability=True)，且没有提供校准器")
+        return cls(
+            support_vectors=svc.support_vectors_,
+            dual_coef=svc.dual_coef_[0],
+            intercept=svc.intercept_[0],
+            gamma=svc._gamma,
+            prob_a=svc.probA_[0] if has_probability else np.nan,
+            prob_b=svc.probB_[0] if has_probability else np.nan,
+            classes=svc.classes_,
+            feature_names=getattr(svc, 'feature_names_in_', None),
+            source_sha256=source_sha256,
+            calibrator=calibrator,
+        )
+
+    @classmethod
+    def load(cls, path):
+        """从 .npz 文件加载"""
+        with np.load(path, allow_pickle=False) as data:
+            calibrator = None
+            if 'calibration' in data:
+                from calibration import calibrator_from_dict
+                calibrator = calibrator_from_dict(json.loads(str(data['calibration'])))
+            return cls(
+                support_vectors=data['support_vectors'],
+                dual_coef=data['dual_coef'],
+                intercept=data['intercept'],
+                gamma=data['gamma'],
+                prob_a=data['prob_a'],
+                prob_b=data['prob_b'],
+                classes=data['classes'],
+                feature_names=data['feature_names'] if 'feature_names' in data else None,
+                source_sha256=str(data['source_sha256']) if 'source_sha256' in data else None,
+                calibrator=calibrator,
+            )
+
+    def save(self, path):
+        """保存为 .npz 文件"""
+        arrays = {
+            'kind': np.array('rbf_svc'),
+            'support_vectors': self.support_vectors_,
+            'dual_coef': self.dual_coef_,
+            'intercept': np.array(self.intercept_),
+            'gamma': np.array(self.gamma),
+            'prob_a': np.array(self.prob_a),
+            'prob_b': np.array(self.prob_b),
+            'classes': self.classes_,
+        }
+        if self.feature_names_in_ is not None:
+            arrays['feature_names'] = self.feature_names_in_.astype(str)
+        if self.source_sha256:
+            arrays['source_sha256'] = np.array(self.source_sha256)
+        if self.calibrator is not None:
+            arrays['calibration'] = np.array(json.dumps(self.calibrator.to_dict()))
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+
+    def _kernel(self, X):
+        """计算 X 与所有支持向量之间的 RBF 核矩阵"""
+        return _rbf_kernel(X, self.support_vectors_, self._sv_sq_norms, self.gamma)
+
+    def reference_points(self):
+        """导出校验时在其附近采样的点"""
+        return self.support_vectors_
+
+    def decision_function(self, X):
+        """按批计算决策函数值（正值对应 classes_[1]）"""
+        X = _check_input(X, self.n_features_in_)
+        out = np.empty(X.shape[0])
+        for start in range(0, X.shape[0], self.batch_size):
+            stop = start + self.batch_size
+            out[start:stop] = self._kernel(X[start:stop]) @ self.dual_coef_
+        out += self.intercept_
+        return out
+
+    def feature_contributions(self, X):
+        """逐特征贡献（决策函数对标准化特征的梯度×特征值），返回 (贡献矩阵, 决策函数值)"""
+        X = _check_input(X, self.n_features_in_)
+        contributions, decision = _batched_contributions(X, self.batch_size, lambda batch: _rbf_contributions(
+            batch, self.support_vectors_, self._sv_sq_norms, self.dual_coef_, self.gamma))
+        decision += self.intercept_
+        return contributions, decision
+
+    def predict_proba(self, X):
+        """计算两个类别的概率，与 SVC.predict_proba（或 CalibratedSVC）的结果一致"""
+        if self.calibrator is not None:
+            return _calibrated_proba(self.calibrator, self.decision_function(X))
+        # libsvm 内部的决策值与 sklearn 的 decision_function 符号相反
+        r01 = _sigmoid_predict(-self.decision_function(X), self.prob_a, self.prob_b)
+        np.clip(r01, MIN_PROB, 1 - MIN_PROB, out=r01)
+        return _binary_coupling(r01)
+
+    def predict(self, X):
+        """预测类别标签"""
+        return self.classes_[(self.decision_function(X) > 0).astype(np.intp)]
+
+class ApproxSVMScorer:
+    """核近似 + 线性SVM 的纯 NumPy 打分器
+
+    特征映射为Nyström（与landmarks之间的RBF核乘以归一化矩阵）或随机傅里叶特征
+    （sqrt(2/D) * cos(X W + b)），之后是线性决策函数。打分开销只取决于映射维度，
+    与训练集大小无关。概率由单独拟合的校准器给出。
+    """
+
+    def __init__(self, approximation, classes, coef, intercept, calibrator, gamma=None, landmarks=None,
+                 normalization=None, random_weights=None, random_offset=None, feature_names=None,
+                 source_sha256=None, batch_size=1024):
+        if approximation not in ('nystroem', 'rff'):
+            raise ValueError(f"不支持的核近似方法: {approximation}")
+        self.approximation = approximation
+        self.classes_ = np.asarray(classes)
+        self.coef_ = np.ascontiguousarray(coef, dtype=np.float64)
+        self.intercept_ = float(intercept)
+        self.calibrator = calibrator
+        self.feature_names_in_ = None if feature_names is None else np.asarray(feature_names)
+        self.source_sha256 = source_sha256
+        self.batch_size = batch_size
+        if approximation == 'nystroem':
+            self.gamma = float(gamma)
+            self.landmarks_ = np.ascontiguousarray(landmarks, dtype=np.float64)
+            # 把归一化矩阵和线性权重合并，打分时只需一次矩阵向量乘法
+            self.normalization_ = np.ascontiguousarray(normalization, dtype=np.float64)
+            self._weights = self.normalization_.T @ self.coef_
+            self._landmark_sq_norms = np.einsum('ij,ij->i', self.landmarks_, self.landmarks_)
+            self.n_features_in_ = self.landmarks_.shape[1]
+        else:
+            self.random_weights_ = np.ascontiguousarray(random_weights, dtype=np.float64)
+            self.random_offset_ = np.ascontiguousarray(random_offset, dtype=np.float64)
+            self._weights = self.coef_ * np.sqrt(2.0 / self.random_weights_.shape[1])
+            self.n_features_in_ = self.random_weights_.shape[0]
+
+    @property
+    def n_components(self):
+        return len(self.coef_)
+
+    @classmethod
+    def from_pipeline(cls, pipeline, calibrator, source_sha256=None):
+        """从 make_pipeline(Nystroem 或 RBFSampler, SGDClassifier/LinearSVC) 中提取参数"""
+        approx, linear = pipeline[0], pipeline[-1]
+        if len(pipeline) != 2 or len(linear.classes_) != 2:
+            raise ValueError("仅支持 核近似 + 线性模型 两步组成的二分类流水线")
+        common = dict(classes=linear.classes_, coef=linear.coef_[0], intercept=linear.intercept_[0],
+                      calibrator=calibrator, feature_names=getattr(pipeline, 'feature_names_in_', None),
+                      source_sha256=source_sha256)
+        name = type(approx).__name__
+        if name == 'Nystroem':
+            if approx.kernel != 'rbf':
+                raise ValueError(f"Nyström仅支持RBF核，当前核函数: {approx.kernel}")
+            return cls('nystroem', gamma=approx.gamma, landmarks=approx.components_,
+                       normalization=approx.normalization_, **common)
+        if name == 'RBFSampler':
+            return cls('rff', random_weights=approx.random_weights_, random_offset=approx.random_offset_, **common)
+        raise ValueError(f"不支持的核近似方法: {name}")
+
+    @classmethod
+    def _from_arrays(cls, data, calibrator):
+        optional = {name: data[name] for name in ('gamma', 'landmarks', 'normalization', 'random_weights',
+                                                   'random_offset') if name in data}
+        return cls(
+            approximation=str(data['approximation']),
+            classes=data['classes'],
+            coef=data['coef'],
+            intercept=data['intercept'],
+            calibrator=calibrator,
+            feature_names=data['feature_names'] if 'feature_names' in data else None,
+            source_sha256=str(data['source_sha256']) if 'source_sha256' in data else None,
+            **optional,
+        )
+
+    def save(self, path):
+        arrays = {
+            'kind': np.array('approx'),
+            'approximation': np.array(self.approximation),
+            'classes': self.classes_,
+            'coef': self.coef_,
+            'intercept': np.array(self.intercept_),
+            'calibration': np.array(json.dumps(self.calibrator.to_dict())),
+        }
+        if self.approximation == 'nystroem':
+            arrays.update(gamma=np.array(self.gamma), landmarks=self.landmarks_, normalization=self.normalization_)
+        else:
+            arrays.update(random_weights=self.random_weights_, random_offset=self.random_offset_)
+        if self.feature_names_in_ is not None:
+            arrays['feature_names'] = self.feature_names_in_.astype(str)
+        if self.source_sha256:
+            arrays['source_sha256'] = np.array(self.source_sha256)
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+
+    def reference_points(self):
+        if self.approximation == 'nystroem':
+            return self.landmarks_
+        # 训练特征均已标准化，在原点附近采样
+        return np.random.default_rng(0).normal(size=(200, self.n_features_in_))
+
+    def _decision_batch(self, X):
+        if self.approximation == 'nystroem':
+            return _rbf_kernel(X, self.landmarks_, self._landmark_sq_norms, self.gamma) @ self._weights
+        projection = X @ self.random_weights_
+        projection += self.random_offset_
+        return np.cos(projection, out=projection) @ self._weights
+
+    def decision_function(self, X):
+        X = _check_input(X, self.n_features_in_)
+        out = np.empty(X.shape[0])
+        for start in range(0, X.shape[0], self.batch_size):
+            stop = start + self.batch_size
+            out[start:stop] = self._decision_batch(X[start:stop])
+        out += self.intercept_
+        return out
+
+    def _contributions_batch(self, X):
+        if self.approximation == 'nystroem':
+            return _rbf_contributions(X, self.landmarks_, self._landmark_sq_norms, self._weights, self.gamma)
+        # f(x) = Σ w_k cos(x W_k + b_k)，∂f/∂x = -Σ w_k sin(x W_k + b_k) W_k
+        projection = X @ self.random_weights_
+        projection += self.random_offset_
+        decision = np.cos(projection) @ self._weights
+        sines = np.sin(projection, out=projection)
+        sines *= self._weights
+        gradient = sines @ self.random_weights_.T
+        gradient *= -X
+        return gradient, decision
+
+    def feature_contributions(self, X):
+        """逐特征贡献（决策函数对标准化特征的梯度×特征值），返回 (贡献矩阵, 决策函数值)"""
+        X = _check_input(X, self.n_features_in_)
+        contributions, decision = _batched_contributions(X, self.batch_size, self._contributions_batch)
+        decision += self.intercept_
+        return contributions, decision
+
+    def predict_proba(self, X):
+        return _calibrated_proba(self.calibrator, self.decision_function(X))
+
+    def predict(self, X):
+        return self.classes_[(self.decision_function(X) > 0).astype(np.intp)]
+
+def load_scorer(path):
+    """按 .npz 中的 kind 加载对应的打分器"""
+    with np.load(path, allow_pickle=False) as data:
+        kind = str(data['kind']) if 'kind' in data else 'rbf_svc'
+        if kind == 'approx':
+            from calibration import calibrator_from_dict
+            return ApproxSVMScorer._from_arrays(data, calibrator_from_dict(json.loads(str(data['calibration']))))
+    if kind != 'rbf_svc':
+        raise ValueError(f"未知的打分文件类型: {kind}")
+    return CompiledSVMScorer.load(path)
+
+def verify_against_svc(scorer, svc, X=None, tolerance=1e-9, seed=0):
+    """检查导出的打分器与原模型 predict_proba 的差异是否在容差范围内"""
+    if X is None:
+        rng = np.random.default_rng(seed)
+        sv = scorer.reference_points()
+        spread = sv.std(axis=0) + 1e-12
+        # 在支持向量附近以及更大的范围内采样
+        X = np.vstack([
+            sv,
+            sv + rng.normal(scale=0.5, size=sv.shape) * spread,
+            rng.normal(size=(1000, sv.shape[1])) * spread * 3 + sv.mean(axis=0),
+        ])
+    expected = svc.predict_proba(X)
+    max_error = float(np.abs(scorer.predict_proba(X) - expected).max())
+    if max_error > tolerance:
+        raise ValueError(f"导出模型与SVC的概率差异 {max_error:.3e} 超过容差 {tolerance:.0e}")
+    return max_error
+
+def default_calibration_path(model_path):
+    """模型文件对应的校准文件，如 svm_model.pkl -> svm_calibration.json"""
+    directory, name = os.path.split(model_path)
+    stem = os.path.splitext(name)[0]
+    stem = stem[:-len('_model')] if stem.endswith('_model') else stem
+    return os.path.join(directory, f'{stem}_calibration.json')
+
+def export_svc(model_path, output_path, tolerance=1e-9, calibration_path=None):
+    """将 svm_model.pkl 导出为紧凑的 .npz 打分文件
+
+    模型未启用概率输出时，把校准文件中的校准器一并写入。
+    """
+    import joblib
+
+    estimator = joblib.load(model_path)
+    model_sha256 = file_sha256(model_path)
+    calibrator = None
+    reference = estimator
+    if not hasattr(estimator, 'predict_proba'):
+        from calibration import CalibratedSVC, load_calibrator
+
+        calibration_path = calibration_path or default_calibration_path(model_path)
+        calibrator, calibrated_sha256 = load_calibrator(calibration_path)
+        if calibrated_sha256 != model_sha256:
+            raise ValueError(f"校准文件 {calibration_path} 与模型 {model_path} 不一致，请重新训练")
+        reference = CalibratedSVC(estimator, calibrator)
+    if hasattr(estimator, 'steps'):
+        if calibrator is None:
+            raise ValueError("核近似模型需要单独的校准文件")
+        scorer = ApproxSVMScorer.from_pipeline(estimator, calibrator, source_sha256=model_sha256)
+    else:
+        scorer = CompiledSVMScorer.from_svc(estimator, source_sha256=model_sha256, calibrator=calibrator)
+    max_error = verify_against_svc(scorer, reference, tolerance=tolerance)
+    scorer.save(output_path)
+    return scorer, max_error
+
+def main():
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='导出SVM模型为纯NumPy打分文件')
+    parser.add_argument('model_path', nargs='?', default=os.path.join(base_dir, 'svm_model.pkl'))
+    parser.add_argument('output_path', nargs='?', default=os.path.join(base_dir, 'svm_model.npz'))
+    parser.add_argument('--tolerance', type=float, default=1e-9)
+    parser.add_argument('--calibration', help='校准文件，默认为模型文件旁的 *_calibration.json')
+    args = parser.parse_args()
+
+    scorer, max_error = export_svc(args.model_path, args.output_path, tolerance=args.tolerance,
+                                   calibration_path=args.calibration)
+    size = (f"{len(scorer.support_vectors_)} 个支持向量" if isinstance(scorer, CompiledSVMScorer)
+            else f"{scorer.approximation} 核近似，{scorer.n_components} 维")
+    print(f"已导出 {args.output_path}: {size}，"
+          f"与predict_proba的最大差异 {max_error:.3e}")
+
+if __name__ == '__main__':
+    main()
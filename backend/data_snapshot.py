@@ -0,0 +1,147 @@
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from compiled_model import file_sha256
+
+# 训练数据快照的缓存目录：每个源文件按SHA-256保存为一组按列存储的.npy文件
+SNAPSHOT_DIR = os.environ.get('SVM_SNAPSHOT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data_cache'))
+SNAPSHOT_VERSION = 1
+
+class ColumnarSnapshot:
+    """Excel训练数据的列式快照
+
+    第一次读取时把每一列保存为单独的.npy文件并写入manifest.json，之后以内存映射方式
+    打开，不再解析Excel。独热编码和标准化的结果按列缓存在derived/目录中，更改
+    特征列表时只需计算新增的列。
+    """
+
+    def __init__(self, directory, manifest):
+        self.directory = directory
+        self.manifest = manifest
+        self.columns = [c['name'] for c in manifest['columns']]
+        self._files = {c['name']: c['file'] for c in manifest['columns']}
+
+    @classmethod
+    def open(cls, source_path, cache_dir=SNAPSHOT_DIR):
+        """打开源文件对应的快照，不存在时从Excel创建"""
+        sha = file_sha256(source_path)
+        directory = os.path.join(cache_dir, sha[:16])
+        manifest_path = os.path.join(directory, 'manifest.json')
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('source_sha256') == sha and manifest.get('version') == SNAPSHOT_VERSION:
+                return cls(directory, manifest)
+            shutil.rmtree(directory, ignore_errors=True)
+        return cls._build(source_path, sha, directory)
+
+    @classmethod
+    def _build(cls, source_path, sha, directory):
+        df = pd.read_excel(source_path)
+        os.makedirs(os.path.dirname(directory), exist_ok=True)
+        # 先写入临时目录再整体改名，并发运行时不会读到写了一半的快照
+        tmp = tempfile.mkdtemp(prefix='.snapshot-', dir=os.path.dirname(directory))
+        columns = []
+        for j, name in enumerate(df.columns):
+            values = df[name].to_numpy()
+            filename = f'col_{j}.npy'
+            np.save(os.path.join(tmp, filename), values, allow_pickle=values.dtype == object)
+            columns.append({'name': str(name), 'file': filename, 'dtype': str(values.dtype)})
+        manifest = {
+            'version': SNAPSHOT_VERSION,
+            'source': os.path.basename(source_path),
+            'source_sha256': sha,
+            'rows': len(df),
+            'columns': columns,
+        }
+        with open(os.path.join(tmp, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        try:
+            os.rename(tmp, directory)
+        except OSError:
+            # 其他进程已经写好了同一个快照
+            shutil.rmtree(tmp, ignore_errors=True)
+        return cls(directory, manifest)
+
+    @property
+    def rows(self):
+        return self.manifest['rows']
+
+    def column(self, name):
+        """按列读取，数值列以只读内存映射方式返回"""
+        path = os.path.join(self.directory, self._files[name])
+        try:
+            return np.load(path, mmap_mode='r')
+        except ValueError:
+            # 对象列（如含文本的列）无法内存映射
+            return np.load(path, allow_pickle=True)
+
+    def frame(self, columns=None):
+        columns = self.columns if columns is None else columns
+        return pd.DataFrame({name: self.column(name) for name in columns})
+
+    def _derived(self, key, compute):
+        """按key缓存由单列计算得到的结果（数组和JSON元数据）"""
+        directory = os.path.join(self.directory, 'derived')
+        array_path = os.path.join(directory, f'{key}.npy')
+        meta_path = os.path.join(directory, f'{key}.json')
+        if os.path.exists(array_path) and os.path.exists(meta_path):
+            with open(meta_path, encoding='utf-8') as f:
+                return np.load(array_path, mmap_mode='r'), json.load(f)
+
+        values, meta = compute()
+        os.makedirs(directory, exist_ok=True)
+        tmp_array = f'{array_path}.{os.getpid()}.tmp.npy'
+        np.save(tmp_array, values)
+        os.replace(tmp_array, array_path)
+        tmp_meta = f'{meta_path}.{os.getpid()}.tmp'
+        with open(tmp_meta, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_meta, meta_path)
+        return values, meta
+
+    def _key(self, transform, name):
+        return f'{transform}_{self._files[name][:-len(".npy")]}'
+
+    def one_hot(self, name):
+        """单列独热编码，结果与 pd.get_dummies(df, columns=[name]) 相同"""
+        def compute():
+            dummies = pd.get_dummies(pd.Series(self.column(name), name=name), prefix=name)
+            return dummies.to_numpy(), {'columns': [str(c) for c in dummies.columns]}
+
+        values, meta = self._derived(self._key('onehot', name), compute)
+        return pd.DataFrame(np.asarray(values), columns=meta['columns'])
+
+    def standardized(self, name):
+        """单列标准化，结果与对该列使用StandardScaler相同"""
+        from sklearn.preprocessing import StandardScaler
+
+        def compute():
+            scaler = StandardScaler()
+            values = scaler.fit_transform(np.asarray(self.column(name), dtype=np.float64).reshape(-1, 1)).ravel()
+            return values, {'mean': float(scaler.mean_[0]), 'scale': float(scaler.scale_[0])}
+
+        values, meta = self._derived(self._key('scaled', name), compute)
+        return np.asarray(values), meta
+
+    def encode(self, categorical_cols, numeric_cols, drop=()):
+        """构建特征矩阵：数值列标准化、分类列独热编码，列顺序与 pd.get_dummies 相同"""
+        categorical = set(categorical_cols)
+        numeric = set(numeric_cols)
+        excluded = categorical | set(drop)
+        data = {}
+        for name in self.columns:
+            if name in excluded:
+                continue
+            data[name] = self.standardized(name)[0] if name in numeric else self.column(name)
+        X = pd.DataFrame(data)
+        parts = [X] + [self.one_hot(name) for name in categorical_cols]
+        return pd.concat(parts, axis=1)
+
+def load_snapshot(source_path, cache_dir=SNAPSHOT_DIR):
+    return ColumnarSnapshot.open(source_path, cache_dir)
@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+
+# 逐特征解释：贡献为决策函数对标准化特征的梯度乘以特征值（线性模型即 weights * x_scaled），
+# 整批一次矩阵运算完成。SVM_EXPLAIN_MAX_ROWS 限制每个请求解释的行数，超出的行只返回预测结果
+EXPLAIN_METHOD = 'gradient_x_input'
+EXPLAIN_MAX_ROWS = int(os.environ.get('SVM_EXPLAIN_MAX_ROWS', 1000))
+
+def explainer_for(model):
+    """返回计算逐特征贡献的函数 X -> (贡献矩阵, 决策函数值)，模型不支持时抛出ValueError"""
+    if hasattr(model, 'feature_contributions'):
+        return model.feature_contributions
+
+    from calibration import CalibratedSVC
+    from compiled_model import ApproxSVMScorer, CompiledSVMScorer
+
+    inner, calibrator = model, None
+    if isinstance(model, CalibratedSVC):
+        inner, calibrator = model.svc, model.calibrator
+    if hasattr(inner, 'steps'):
+        return ApproxSVMScorer.from_pipeline(inner, calibrator).feature_contributions
+    if not hasattr(inner, 'support_vectors_'):
+        raise ValueError(f"模型 {type(model).__name__} 未训练或不支持逐特征解释")
+    if inner.kernel == 'rbf':
+        return CompiledSVMScorer.from_svc(inner, calibrator=calibrator).feature_contributions
+    if inner.kernel == 'linear':
+        coef = np.asarray(inner.coef_[0], dtype=np.float64)
+        intercept = float(inner.intercept_[0])
+        return lambda X: (X * coef, X @ coef + intercept)
+    raise ValueError(f"不支持解释 {inner.kernel} 核的SVM")
+
+class ExplainBudget:
+    """一个请求内可以解释的行数，流式响应的各个块共享同一个上限"""
+
+    def __init__(self, max_rows=EXPLAIN_MAX_ROWS):
+        self.max_rows = max_rows
+        self.explained = 0
+        self.skipped = 0
+
+    def take(self, rows):
+        """从行下标数组中取出本次可以解释的部分"""
+        n = max(0, min(len(rows), self.max_rows - self.explained))
+        self.explained += n
+        self.skipped += len(rows) - n
+        return rows[:n]
+
+    def to_dict(self):
+        return {
+            'method': EXPLAIN_METHOD,
+            'units': 'decision_function',
+            'rows_explained': self.explained,
+            'rows_skipped': self.skipped,
+            'max_rows': self.max_rows,
+        }
+
+def explain_rows(explain, processed_data, rows, features):
+    """计算rows（行下标数组）的逐特征贡献，返回 {行下标: {'decision': ..., 'contributions': {特征: 贡献}}}"""
+    if not len(rows):
+        return {}
+    contributions, decision = explain(processed_data[rows])
+    return {
+        i: {'decision': d, 'contributions': dict(zip(features, c))}
+        for i, d, c in zip(np.asarray(rows).tolist(), decision.tolist(), contributions.tolist())
+    }
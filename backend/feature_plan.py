@@ -0,0 +1,83 @@
+import numpy as np
+
+def coerce_matrix(raw):
+    """将对象矩阵逐列转换为float64，缺失值（None、空字符串）为NaN
+
+    返回 (values, invalid)，invalid为无法转换为数值的单元格掩码，全部可以转换时为None
+    """
+    blank = raw == ''
+    try:
+        # 所有值都可以直接转换时一次完成
+        return np.where(blank, None, raw).astype(np.float64), None
+    except (TypeError, ValueError):
+        pass
+
+    # 含有非数值内容时才需要pandas，避免在导入时加载
+    import pandas as pd
+
+    values = np.empty(raw.shape, dtype=np.float64)
+    for j in range(raw.shape[1]):
+        values[:, j] = pd.to_numeric(raw[:, j], errors='coerce')
+
+    missing = pd.isna(raw) | blank
+    return values, np.isnan(values) & ~missing
+
+class FeatureTransformPlan:
+    """预先编译的特征转换计划
+
+    在模型加载时构建一次：保存输入列名到矩阵列下标的映射，以及把
+    (x - mean_) / scale_ 融合为 x * inv_scale_ + offset_ 的向量，
+    对整块矩阵一次完成缺失值填充和标准化。
+    """
+
+    def __init__(self, features, mean=None, scale=None, fill_value=0.0):
+        self.features = list(features)
+        self.index = {name: j for j, name in enumerate(self.features)}
+        self.n_features = len(self.features)
+
+        self.scaled = mean is not None and scale is not None
+        if self.scaled:
+            self.mean_ = np.asarray(mean, dtype=np.float64)
+            self.scale_ = np.asarray(scale, dtype=np.float64)
+            if self.mean_.shape != (self.n_features,) or self.scale_.shape != (self.n_features,):
+                raise ValueError(f"标准化参数长度与特征数量({self.n_features})不一致")
+            self.inv_scale_ = 1.0 / self.scale_
+            self.offset_ = -self.mean_ * self.inv_scale_
+            # 缺失值填充后再标准化的结果
+            self.fill_ = fill_value * self.inv_scale_ + self.offset_
+        else:
+            self.fill_ = np.full(self.n_features, fill_value, dtype=np.float64)
+
+    def records_to_matrix(self, records):
+        """将dict记录转换为特征矩阵（缺失值为NaN），只遍历记录中出现的列"""
+        raw = np.full((len(records), self.n_features), None, dtype=object)
+        index = self.index
+        for i, record in enumerate(records):
+            for name, value in record.items():
+                j = index.get(name)
+                if j is not None:
+                    raw[i, j] = value
+        return coerce_matrix(raw)
+
+    def transform(self, values, out=None):
+        """对整块矩阵一次完成标准化和缺失值填充"""
+        values = np.asarray(values, dtype=np.float64)
+        if values.ndim == 1:
+            values = values.reshape(1, -1)
+        if self.scaled:
+            out = np.multiply(values, self.inv_scale_, out=out)
+            out += self.offset_
+        elif out is None:
+            out = values.copy()
+        elif out is not values:
+            np.copyto(out, values)
+
+        missing = np.isnan(out)
+        if missing.any():
+            np.copyto(out, np.broadcast_to(self.fill_, out.shape), where=missing)
+        return out
+
+    def transform_records(self, records):
+        """将dict记录转换并标准化，返回特征矩阵和无法转换的单元格掩码"""
+        values, invalid = self.records_to_matrix(records)
+        return self.transform(values, out=values), invalid
@@ -0,0 +1,18 @@
+import threading
+
+# 工作进程心跳：serve.py 在请求之间写入心跳，并通过install注册写入函数；
+# 处理时间较长的请求（流式响应、大文件、等待模型重新加载）在处理过程中调用beat，
+# 避免被主进程当作卡死而结束。不在serve.py下运行时beat不做任何事
+_beat = None
+_owner = None
+
+def install(func):
+    """注册写入心跳的函数，只在调用install的线程中生效"""
+    global _beat, _owner
+    _beat = func
+    _owner = threading.get_ident()
+
+def beat():
+    """在处理请求的线程中更新心跳；后台线程（如批量任务）不代替工作进程报告存活"""
+    if _beat is not None and threading.get_ident() == _owner:
+        _beat()
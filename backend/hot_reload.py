@@ -0,0 +1,166 @@
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class ModelBundle:
+    """一个模型版本：模型、特征转换计划和版本号，构建后不再修改
+
+    请求开始时取得当前版本并一直使用到结束，热更新只替换全局引用，
+    进行中的请求不受影响。
+    """
+
+    __slots__ = ('model', 'plan', 'version', 'source', 'loaded_at', '_explainer')
+
+    def __init__(self, model, plan, version, source=None):
+        self.model = model
+        self.plan = plan
+        self.version = version
+        self.source = source
+        self.loaded_at = time.time()
+        self._explainer = None
+
+    def score(self, X):
+        """对特征矩阵进行一次性打分，返回预测标签和概率（标签由概率得出）"""
+        model = self.model
+        if hasattr(model, 'predict_proba'):
+            probabilities = model.predict_proba(X)
+            predictions = model.classes_[np.argmax(probabilities, axis=1)]
+            return predictions, probabilities
+        return model.predict(X), None
+
+    def explainer(self):
+        """逐特征贡献的计算函数，第一次使用时构建；模型不支持时抛出ValueError"""
+        if self._explainer is None:
+            from explain import explainer_for
+            self._explainer = explainer_for(self.model)
+        return self._explainer
+
+    def info(self):
+        return {
+            'model_version': self.version,
+            'model_class': type(self.model).__name__,
+            'source': self.source,
+            'loaded_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.loaded_at)),
+        }
+
+class ModelReloader:
+    """在后台加载、校验并预热新的模型版本，成功后原子地替换当前版本
+
+    load_bundle() 返回已经校验和预热的 ModelBundle，失败时抛出异常并保留当前版本。
+    监视线程定期检查 watch_paths 的修改时间和大小，文件稳定一个周期后才重新加载，
+    避免读到写了一半的模型文件。线程在第一次调用 ensure_watching() 时才启动，
+    多进程部署时每个工作进程各自监视。
+    """
+
+    def __init__(self, load_bundle, on_swap=None, watch_paths=(), poll_interval=2.0):
+        self.load_bundle = load_bundle
+        self.on_swap = on_swap
+        self.watch_paths = list(watch_paths)
+        self.poll_interval = poll_interval
+        self.current = None
+        self.reloads = 0
+        self.failures = 0
+        self.last_error = None
+        self.last_reload = None
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._loaded_signature = None
+        self._pid = None
+        self._thread = None
+
+    def _signature(self):
+        signature = []
+        for path in self.watch_paths:
+            try:
+                st = os.stat(path)
+                signature.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                signature.append(None)
+        return signature
+
+    def activate(self, bundle, signature=None):
+        """直接替换当前版本（启动时或测试中使用）"""
+        previous, self.current = self.current, bundle
+        self._loaded_signature = self._signature() if signature is None else signature
+        if self.on_swap is not None:
+            self.on_swap(previous, bundle)
+        return previous
+
+    def reload(self, reason):
+        """加载新版本并替换，返回 (是否成功, 新版本或错误信息)；同一时间只进行一次加载"""
+        with self._lock:
+            signature = self._signature()
+            started = time.perf_counter()
+            try:
+                bundle = self.load_bundle()
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                # 记录失败时的文件状态，文件再次变化后才重试
+                self._loaded_signature = signature
+                self.last_reload = {'reason': reason, 'success': False, 'error': str(e), 'at': time.time()}
+                logger.error(f"模型热更新失败（{reason}），继续使用版本 {getattr(self.current, 'version', None)}: {e}")
+                return False, str(e)
+            previous = self.activate(bundle, signature)
+            self.reloads += 1
+            self.last_error = None
+            seconds = time.perf_counter() - started
+            self.last_reload = {'reason': reason, 'success': True, 'from': getattr(previous, 'version', None),
+                                'to': bundle.version, 'seconds': seconds, 'at': time.time()}
+            logger.info(f"模型热更新完成（{reason}）: {getattr(previous, 'version', None)} -> {bundle.version}，"
+                        f"用时{seconds * 1000:.1f}ms")
+            return True, bundle
+
+    def sync_signature(self):
+        """把监视文件的当前状态记为已加载（本进程自己写入触发文件之后调用）"""
+        self._loaded_signature = self._signature()
+
+    def reload_async(self, reason):
+        """在后台线程中重新加载，返回可以join的线程和保存结果的字典"""
+        result = {}
+
+        def run():
+            result['success'], result['value'] = self.reload(reason)
+
+        thread = threading.Thread(target=run, name='model-reload', daemon=True)
+        thread.start()
+        return thread, result
+
+    def ensure_watching(self):
+        if self.poll_interval <= 0 or not self.watch_paths:
+            return
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._watch, name='model-watcher', daemon=True)
+            self._thread.start()
+
+    def _watch(self):
+        seen = self._signature()
+        while True:
+            time.sleep(self.poll_interval)
+            signature = self._signature()
+            if signature != seen:
+                # 文件仍在变化，等下一个周期
+                seen = signature
+                continue
+            if signature != self._loaded_signature:
+                self.reload('file_change')
+
+    def status(self):
+        return {
+            'model_version': getattr(self.current, 'version', None),
+            'watching': self.poll_interval > 0 and self._thread is not None and self._thread.is_alive(),
+            'poll_interval': self.poll_interval,
+            'reloads': self.reloads,
+            'failures': self.failures,
+            'last_reload': self.last_reload,
+        }
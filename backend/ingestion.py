@@ -0,0 +1,164 @@
+import io
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from werkzeug.datastructures import FileStorage
+
+from feature_plan import coerce_matrix
+
+# 流式处理时每块的行数
+CHUNK_SIZE = int(os.environ.get('PREDICT_CHUNK_SIZE', 1000))
+
+# 读取结果：values为C连续的float64矩阵（列顺序与features一致，缺失值为NaN），
+# invalid为无法转换为数值的单元格掩码（全部可以转换时为None），
+# missing_features为文件中不存在的特征列
+FeatureBlock = namedtuple('FeatureBlock', ['values', 'invalid', 'missing_features'])
+
+def _to_block(raw, features, positions, numeric):
+    """把按文件列顺序读取的数据投影为按features顺序排列的特征矩阵"""
+    n_rows = len(raw)
+    missing_features = [f for f, j in zip(features, positions) if j is None]
+
+    if numeric:
+        values = np.full((n_rows, len(features)), np.nan)
+        for k, j in enumerate(positions):
+            if j is not None:
+                values[:, k] = raw[:, j]
+        return FeatureBlock(values, None, missing_features)
+
+    projected = np.full((n_rows, len(features)), None, dtype=object)
+    for k, j in enumerate(positions):
+        if j is not None:
+            projected[:, k] = raw[:, j]
+    values, invalid = coerce_matrix(projected)
+    return FeatureBlock(values, invalid, missing_features)
+
+def _column_positions(columns, features):
+    """特征在读取结果中的列下标，不存在的特征为None"""
+    columns = [str(c).strip() for c in columns]
+    return [columns.index(f) if f in columns else None for f in features]
+
+def _iter_csv_frames(stream, features, chunk_size, dtype):
+    """只读取特征列的CSV读取器（C解析器），chunk_size为None时返回整个文件"""
+    wanted = set(features)
+    reader = pd.read_csv(
+        stream,
+        usecols=lambda c: str(c).strip() in wanted,
+        dtype=dtype,
+        engine='c',
+        encoding='utf-8',
+        skip_blank_lines=True,
+        chunksize=chunk_size,
+    )
+    if chunk_size is None:
+        yield reader
+        return
+    with reader:
+        yield from reader
+
+def iter_csv_blocks(stream, features, chunk_size=CHUNK_SIZE):
+    """分块读取CSV文件，只解析特征列并直接转换为float64矩阵
+
+    先按float64直接解析；遇到无法解析的值时，从出错的块开始改为按字符串读取并逐列转换，
+    以便逐行报告错误。chunk_size为None时整个文件作为一块返回。
+    """
+    emitted = 0
+    skip = 0
+    numeric = True
+    frames = _iter_csv_frames(stream, features, chunk_size, np.float64)
+    while True:
+        try:
+            df = next(frames)
+        except StopIteration:
+            return
+        except ValueError:
+            if not numeric:
+                raise
+            # 存在非数值内容，回到文件开头重新读取，丢弃已经返回的行。
+            # 空行和带引号的换行使物理行数与数据行数不一致，不能用skiprows按物理行跳过
+            stream.seek(0)
+            numeric = False
+            skip = emitted
+            frames = _iter_csv_frames(stream, features, chunk_size, object)
+            continue
+
+        if skip:
+            dropped = min(skip, len(df))
+            skip -= dropped
+            df = df.iloc[dropped:]
+            if not len(df):
+                continue
+        yield _to_block(df.to_numpy(), features, _column_positions(df.columns, features), numeric)
+        emitted += len(df)
+
+def iter_xlsx_blocks(stream, features, chunk_size=CHUNK_SIZE):
+    """使用openpyxl只读模式流式读取Excel文件，只取特征列"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None) or ()
+        columns = ['' if h is None else str(h).strip() for h in header]
+        selected = [j for j, c in enumerate(columns) if c in features]
+        positions = _column_positions([columns[j] for j in selected], features)
+
+        def flush(chunk):
+            # 单元格大多已是数值，先尝试直接转换；含有字符串时再逐列转换
+            try:
+                raw = np.array(chunk, dtype=np.float64).reshape(len(chunk), len(selected))
+                return _to_block(raw, features, positions, numeric=True)
+            except (TypeError, ValueError):
+                raw = np.empty((len(chunk), len(selected)), dtype=object)
+                raw[:] = chunk
+                return _to_block(raw, features, positions, numeric=False)
+
+        chunk = []
+        for row in rows:
+            chunk.append([row[j] if j < len(row) else None for j in selected])
+            if chunk_size is not None and len(chunk) == chunk_size:
+                yield flush(chunk)
+                chunk = []
+        if chunk or chunk_size is None:
+            yield flush(chunk)
+    finally:
+        workbook.close()
+
+def iter_xls_blocks(stream, features, chunk_size=CHUNK_SIZE):
+    """旧版.xls文件无法流式读取，整体读入特征列后再分块"""
+    wanted = set(features)
+    df = pd.read_excel(stream, usecols=lambda c: str(c).strip() in wanted, dtype=object)
+    positions = _column_positions(df.columns, features)
+    raw = df.to_numpy()
+    step = chunk_size or max(len(raw), 1)
+    for start in range(0, max(len(raw), 1), step):
+        yield _to_block(raw[start:start + step], features, positions, numeric=False)
+
+def iter_upload_blocks(file, features, chunk_size=CHUNK_SIZE):
+    """根据文件扩展名分块读取上传的文件，逐块返回FeatureBlock"""
+    filename = file.filename.lower()
+    file.stream.seek(0)
+    if filename.endswith('.csv'):
+        return iter_csv_blocks(file.stream, features, chunk_size)
+    if filename.endswith('.xlsx'):
+        return iter_xlsx_blocks(file.stream, features, chunk_size)
+    if filename.endswith('.xls'):
+        return iter_xls_blocks(file.stream, features, chunk_size)
+    raise ValueError('支持CSV和Excel文件格式')
+
+def read_upload_matrix(file, features):
+    """一次性读取整个上传文件，返回单个FeatureBlock"""
+    return next(iter_upload_blocks(file, features, chunk_size=None))
+
+def detach_upload(file):
+    """将上传文件从请求中分离
+
+    Flask在视图函数返回后会关闭请求中的所有文件，而流式响应仍需继续读取，
+    因此把数据流转移到新的FileStorage中，由调用方负责关闭。
+    """
+    detached = FileStorage(stream=file.stream, filename=file.filename,
+                           name=file.name, headers=file.headers)
+    file.stream = io.BytesIO()
+    return detached
@@ -0,0 +1,246 @@
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    path TEXT NOT NULL,
+    status TEXT NOT NULL,
+    chunks_done INTEGER NOT NULL DEFAULT 0,
+    processed_rows INTEGER NOT NULL DEFAULT 0,
+    failed_rows INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    lease_owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS job_results (
+    job_id TEXT NOT NULL,
+    chunk INTEGER NOT NULL,
+    body TEXT NOT NULL,
+    PRIMARY KEY (job_id, chunk)
+);
+'''
+
+# 对外返回的任务字段
+_PUBLIC_FIELDS = ('id', 'filename', 'status', 'chunks_done', 'processed_rows', 'failed_rows',
+                  'error', 'attempts', 'created_at', 'updated_at')
+
+class _Connection:
+    """用完即关闭的SQLite连接（sqlite3自带的上下文管理器只提交不关闭）"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, *exc):
+        self.conn.close()
+
+class JobStore:
+    """基于SQLite的批量预测任务存储
+
+    每个分块的结果（NDJSON文本）与任务进度在同一个事务中写入，任务中断后
+    从最后一个完成的分块继续。任务通过租约领取，多个进程可以共用同一个数据库。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return _Connection(conn)
+
+    def create(self, job_id, filename, path):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, filename, path, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, filename, path, 'queued', now, now))
+
+    def get(self, job_id):
+        """返回任务信息，不存在时返回None"""
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return None if row is None else {k: row[k] for k in _PUBLIC_FIELDS}
+
+    def claim(self, owner, lease_seconds, max_attempts=3):
+        """领取一个排队中或租约已过期的任务，返回任务行或None
+
+        租约过期说明处理该任务的进程已经退出；重试max_attempts次后标记为失败，
+        避免反复导致进程崩溃的任务一直被领取。
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = '任务多次中断，已停止重试', lease_owner = NULL, "
+                    "lease_expires = NULL, updated_at = ? "
+                    "WHERE status = 'running' AND lease_expires < ? AND attempts >= ?",
+                    (now, now, max_attempts))
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' OR (status = 'running' AND lease_expires < ?) "
+                    "ORDER BY created_at LIMIT 1", (now,)).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'running', lease_owner = ?, lease_expires = ?, "
+                        "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                        (owner, now + lease_seconds, now, row['id']))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return row
+
+    def save_chunk(self, job_id, chunk, body, rows, failed_rows, owner, lease_seconds):
+        """写入一个分块的结果并推进进度，同时续租；租约已被其他进程接管时返回False"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                updated = conn.execute(
+                    "UPDATE jobs SET chunks_done = ?, processed_rows = processed_rows + ?, "
+                    "failed_rows = failed_rows + ?, lease_expires = ?, updated_at = ? "
+                    "WHERE id = ? AND lease_owner = ? AND chunks_done = ?",
+                    (chunk + 1, rows, failed_rows, now + lease_seconds, now, job_id, owner, chunk)).rowcount
+                if updated:
+                    conn.execute('INSERT OR REPLACE INTO job_results (job_id, chunk, body) VALUES (?, ?, ?)',
+                                 (job_id, chunk, body))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return bool(updated)
+
+    def finish(self, job_id, owner, status, error=None):
+        with self._connect() as conn:
+            conn.execute(
+                'UPDATE jobs SET status = ?, error = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ? '
+                'WHERE id = ? AND lease_owner = ?',
+                (status, error, time.time(), job_id, owner))
+
+    def iter_results(self, job_id):
+        """按分块顺序逐块返回结果文本"""
+        chunk = 0
+        while True:
+            with self._connect() as conn:
+                row = conn.execute('SELECT body FROM job_results WHERE job_id = ? AND chunk = ?',
+                                   (job_id, chunk)).fetchone()
+            if row is None:
+                return
+            yield row['body']
+            chunk += 1
+
+class JobRunner:
+    """后台任务线程：领取任务、分块读取上传文件并打分，逐块保存结果
+
+    process_block接收 (FeatureBlock, row_offset)，返回该块的逐行结果列表。
+    线程在第一次调用ensure_started()时才启动，多进程部署时可以安全地fork。
+    """
+
+    def __init__(self, store, features, process_block, encode, workers=1,
+                 chunk_size=1000, lease_seconds=60.0, poll_interval=2.0):
+        self.store = store
+        self.features = features
+        self.process_block = process_block
+        self.encode = encode
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        if self._pid == os.getpid() and all(t.is_alive() for t in self._threads):
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._threads = []
+                self._pid = os.getpid()
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name=f'job-runner-{len(self._threads)}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def wake(self):
+        """有新任务提交时立即唤醒等待中的线程"""
+        self._wake.set()
+
+    def _run(self):
+        owner = f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+        while True:
+            try:
+                job = self.store.claim(owner, self.lease_seconds)
+            except Exception as e:
+                logger.error(f"领取任务失败: {e}")
+                job = None
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            self.run_job(job, owner)
+
+    def run_job(self, job, owner):
+        """处理一个任务，从已完成的分块之后继续"""
+        job_id = job['id']
+        start_chunk = job['chunks_done']
+        if start_chunk:
+            logger.info(f"任务 {job_id} 从第{start_chunk}块继续")
+        row_offset = job['processed_rows']
+        try:
+            from ingestion import iter_upload_blocks
+
+            with open(job['path'], 'rb') as stream:
+                upload = _SavedUpload(job['filename'], stream)
+                for chunk, block in enumerate(iter_upload_blocks(upload, self.features, self.chunk_size)):
+                    if chunk < start_chunk:
+                        continue
+                    results = self.process_block(block, row_offset)
+                    body = ''.join(self.encode(result) + '\n' for result in results)
+                    failed = sum(1 for result in results if 'error' in result)
+                    if not self.store.save_chunk(job_id, chunk, body, len(results), failed,
+                                                 owner, self.lease_seconds):
+                        logger.warning(f"任务 {job_id} 的租约已被接管，停止处理")
+                        return
+                    row_offset += len(results)
+        except Exception as e:
+            logger.error(f"任务 {job_id} 失败: {e}")
+            self.store.finish(job_id, owner, 'failed', str(e))
+            return
+        self.store.finish(job_id, owner, 'done')
+        logger.info(f"任务 {job_id} 完成，共{row_offset}行")
+        try:
+            os.remove(job['path'])
+        except OSError:
+            pass
+
+class _SavedUpload:
+    """已保存到磁盘的上传文件，提供iter_upload_blocks所需的属性"""
+
+    def __init__(self, filename, stream):
+        self.filename = filename
+        self.stream = stream
+
+def new_job_id():
+    return uuid.uuid4().hex
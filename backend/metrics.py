@@ -0,0 +1,257 @@
+import bisect
+import fcntl
+import json
+import os
+import threading
+import time
+
+# 多进程部署时每个进程把自己的指标快照写入该目录，/api/metrics汇总所有进程
+METRICS_DIR = os.environ.get('SVM_METRICS_DIR')
+FLUSH_INTERVAL = float(os.environ.get('SVM_METRICS_FLUSH_INTERVAL', 1.0))
+
+# 耗时分桶（秒）和请求大小分桶（字节）
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+# 指标定义：名称 -> (类型, 说明, 直方图分桶)
+DEFINITIONS = {
+    'svm_stage_seconds': ('histogram', '预测请求各阶段耗时（秒）', LATENCY_BUCKETS),
+    'svm_request_seconds': ('histogram', '请求处理耗时（秒，流式响应不含响应体生成）', LATENCY_BUCKETS),
+    'svm_request_bytes': ('histogram', '请求体大小（字节）', SIZE_BUCKETS),
+    'svm_requests_total': ('counter', '预测请求数', None),
+    'svm_request_errors_total': ('counter', '返回4xx/5xx的请求数', None),
+    'svm_rows_scored_total': ('counter', '已打分的样本行数', None),
+    'svm_row_errors_total': ('counter', '无法处理的样本行数', None),
+}
+
+class _StageTimer:
+    __slots__ = ('registry', 'labels', 'start')
+
+    def __init__(self, registry, labels):
+        self.registry = registry
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe('svm_stage_seconds', self.labels, time.perf_counter() - self.start)
+
+class MetricsRegistry:
+    """进程内的计数器和固定分桶直方图
+
+    标签以渲染好的字符串保存（如 stage="score"），快照可以直接写成JSON并在进程之间相加。
+    """
+
+    def __init__(self, definitions=DEFINITIONS):
+        self.definitions = dict(definitions)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+        self._stage_labels = {}
+        self._flusher_started = METRICS_DIR is None
+        # fork之后子进程需要自己的锁和写入线程
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._flusher_started = METRICS_DIR is None
+
+    def define(self, name, kind, help_text, buckets=None):
+        self.definitions[name] = (kind, help_text, buckets)
+
+    def inc(self, name, labels='', value=1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        if not self._flusher_started:
+            self._start_flusher()
+
+    def observe(self, name, labels, value):
+        buckets = self.definitions[name][2]
+        i = bisect.bisect_left(buckets, value)
+        key = (name, labels)
+        with self._lock:
+            counts = self._histograms.get(key)
+            if counts is None:
+                # 各分桶计数、+Inf分桶计数、总和
+                counts = self._histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+            counts[i] += 1
+            counts[-1] += value
+        if not self._flusher_started:
+            self._start_flusher()
+
+    def time(self, stage):
+        """记录一个阶段耗时的上下文管理器"""
+        labels = self._stage_labels.get(stage)
+        if labels is None:
+            labels = self._stage_labels[stage] = f'stage="{stage}"'
+        return _StageTimer(self, labels)
+
+    def add_collector(self, collector):
+        """注册在生成快照时调用的函数，返回 (类型, 名称, 标签, 值) 的列表"""
+        self._collectors.append(collector)
+
+    def snapshot(self):
+        """当前进程的指标快照"""
+        snapshot = {'counter': {}, 'gauge': {}, 'histogram': {}}
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                snapshot['counter'].setdefault(name, {})[labels] = value
+            for (name, labels), counts in self._histograms.items():
+                snapshot['histogram'].setdefault(name, {})[labels] = list(counts)
+        for collector in self._collectors:
+            for kind, name, labels, value in collector():
+                snapshot[kind].setdefault(name, {})[labels] = value
+        return snapshot
+
+    def _start_flusher(self):
+        # 后台写入线程在第一次记录指标时才启动，fork之后在各个工作进程中分别启动
+        with self._lock:
+            if self._flusher_started:
+                return
+            self._flusher_started = True
+        threading.Thread(target=self._flush_loop, name='metrics-flusher', daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def flush(self):
+        """把当前进程的快照写入METRICS_DIR"""
+        _write_json(os.path.join(METRICS_DIR, f'metrics_{os.getpid()}.json'), self.snapshot())
+
+    def collect(self):
+        """汇总所有进程的快照；未配置METRICS_DIR时只返回当前进程"""
+        if METRICS_DIR is None:
+            return self.snapshot()
+        own = self.snapshot()
+        _write_json(os.path.join(METRICS_DIR, f'metrics_{os.getpid()}.json'), own)
+        return merge_snapshots([own] + _read_other_processes(METRICS_DIR))
+
+    def render(self):
+        """Prometheus文本格式"""
+        return render_prometheus(self.collect(), self.definitions)
+
+def _write_json(path, data):
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _read_other_processes(directory):
+    """读取其他进程的快照；已退出进程的计数器和直方图合并进归档文件，仪表值丢弃"""
+    archive_path = os.path.join(directory, 'metrics_archive.json')
+    snapshots = []
+    with open(os.path.join(directory, '.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            dead = []
+            for filename in os.listdir(directory):
+                if not (filename.startswith('metrics_') and filename.endswith('.json')):
+                    continue
+                pid = filename[len('metrics_'):-len('.json')]
+                if not pid.isdigit() or int(pid) == os.getpid():
+                    continue
+                path = os.path.join(directory, filename)
+                try:
+                    with open(path, encoding='utf-8') as f:
+                        snapshot = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                if _pid_alive(int(pid)):
+                    snapshots.append(snapshot)
+                else:
+                    dead.append((path, snapshot))
+
+            archive = {'counter': {}, 'gauge': {}, 'histogram': {}}
+            if os.path.exists(archive_path):
+                with open(archive_path, encoding='utf-8') as f:
+                    archive = json.load(f)
+            if dead:
+                for _, snapshot in dead:
+                    snapshot['gauge'] = {}
+                archive = merge_snapshots([archive] + [snapshot for _, snapshot in dead])
+                _write_json(archive_path, archive)
+                for path, _ in dead:
+                    os.remove(path)
+            snapshots.append(archive)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return snapshots
+
+def merge_snapshots(snapshots):
+    """把多个进程的快照相加"""
+    merged = {'counter': {}, 'gauge': {}, 'histogram': {}}
+    for snapshot in snapshots:
+        for kind in ('counter', 'gauge'):
+            for name, series in snapshot.get(kind, {}).items():
+                target = merged[kind].setdefault(name, {})
+                for labels, value in series.items():
+                    target[labels] = target.get(labels, 0) + value
+        for name, series in snapshot.get('histogram', {}).items():
+            target = merged['histogram'].setdefault(name, {})
+            for labels, counts in series.items():
+                if labels in target:
+                    target[labels] = [a + b for a, b in zip(target[labels], counts)]
+                else:
+                    target[labels] = list(counts)
+    return merged
+
+def _series(name, labels, extra=''):
+    labels = ','.join(part for part in (labels, extra) if part)
+    return f'{name}{{{labels}}}' if labels else name
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+def render_prometheus(snapshot, definitions):
+    lines = []
+    for kind in ('counter', 'gauge', 'histogram'):
+        for name in sorted(snapshot[kind]):
+            series = snapshot[kind][name]
+            _, help_text, buckets = definitions.get(name, (kind, '', None))
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels in sorted(series):
+                value = series[labels]
+                if kind != 'histogram':
+                    lines.append(f'{_series(name, labels)} {_format_value(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ['+Inf'], value[:-1]):
+                    cumulative += count
+                    lines.append(f'{_series(name + "_bucket", labels, f"le={json.dumps(str(bound))}")} {cumulative}')
+                lines.append(f'{_series(name + "_sum", labels)} {_format_value(value[-1])}')
+                lines.append(f'{_series(name + "_count", labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+def reset_dir(directory):
+    """清空指标目录（多进程启动器在fork工作进程之前调用）"""
+    os.makedirs(directory, exist_ok=True)
+    for filename in os.listdir(directory):
+        if filename.startswith('metrics_'):
+            os.remove(os.path.join(directory, filename))
+
+registry = MetricsRegistry()
+inc = registry.inc
+observe = registry.observe
+time_stage = registry.time
@@ -1,33 +1,62 @@
+import argparse
+import inspect
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import time
 import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split
+from scipy import stats
+from sklearn.model_selection import RepeatedStratifiedKFold, StratifiedKFold, train_test_split
+from sklearn.metrics.pairwise import rbf_kernel
 from sklearn.preprocessing import StandardScaler
 from sklearn.svm import SVC
-from sklearn.linear_model import Lasso
+from sklearn.kernel_approximation import Nystroem, RBFSampler
+from sklearn.linear_model import Lasso, SGDClassifier
+from sklearn.pipeline import make_pipeline
 from sklearn.metrics import (accuracy_score, precision_score, recall_score,
-                             f1_score, roc_auc_score, confusion_matrix)
+                             f1_score, roc_auc_score, brier_score_loss, confusion_matrix)
 import matplotlib.pyplot as plt
 from sklearn.metrics import roc_curve, RocCurveDisplay
 import joblib
-# 1. 数据准备
-def load_and_preprocess(file_path):
-    df = pd.read_excel(file_path)
-    print(df)
-    label_col = 'label'
-
-    categorical_cols = ['性别', '糖尿病史', '高血压', '前亚硝酸盐', 'ASA', '结石位置']
-    numeric_cols = ['年龄', '身高', '体重', 'BMI', '前白细胞', '前中性粒', '前血小板',
-                    '前淋巴细胞', 'NLR', 'PLR', 'LMR', '前红细胞', '前血红蛋白',
-                    '前单核细胞', '前尿白细胞', '前肌酐', '前尿素',
-                    '前尿酸', '总蛋白', '白蛋白', '球蛋白', '白球比', '手术时间']
+from joblib import Memory, Parallel, delayed
+from calibration import CALIBRATION_METHODS, CalibratedSVC, fit_calibrator, save_calibrator
+from compiled_model import ApproxSVMScorer, CompiledSVMScorer, export_svc, file_sha256
+from data_snapshot import load_snapshot
+from schema import SERVING_FEATURES
 
-    df = pd.get_dummies(df, columns=categorical_cols)
+# 超参数搜索的磁盘缓存目录，缓存键包含数据文件的哈希和参数
+TUNE_CACHE_DIR = os.environ.get('SVM_TUNE_CACHE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tune_cache'))
+# 联合搜索的参数网格
+TUNE_GRID = {
+    'alpha': [0.001, 0.005, 0.01, 0.05],
+    'C': [0.1, 1.0, 10.0, 100.0],
+    'gamma': ['scale', 0.001, 0.01, 0.1],
+    'class_weight': [None, 'balanced'],
+}
+# 增量更新的版本目录：每次更新写入一个新的 v0001、v0002…… 子目录
+INCREMENTAL_DIR = os.environ.get('SVM_INCREMENTAL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models'))
+# 每批数据留出用于概率校准的比例，以及校准样本池的最大行数
+INCREMENTAL_CALIBRATION_FRACTION = 0.2
+INCREMENTAL_RESERVOIR_SIZE = 5000
+# 1. 数据准备
+LABEL_COL = 'label'
+CATEGORICAL_COLS = ['性别', '糖尿病史', '高血压', '前亚硝酸盐', 'ASA', '结石位置']
+NUMERIC_COLS = ['年龄', '身高', '体重', 'BMI', '前白细胞', '前中性粒', '前血小板',
+                '前淋巴细胞', 'NLR', 'PLR', 'LMR', '前红细胞', '前血红蛋白',
+                '前单核细胞', '前尿白细胞', '前肌酐', '前尿素',
+                '前尿酸', '总蛋白', '白蛋白', '球蛋白', '白球比', '手术时间']
 
-    scaler = StandardScaler()
-    df[numeric_cols] = scaler.fit_transform(df[numeric_cols])
+def load_and_preprocess(file_path):
+    # 第一次读取时把Excel转换为按列存储的快照，之后直接内存映射，不再解析Excel
+    snapshot = load_snapshot(file_path)
+    print(f'读取数据: {snapshot.rows}行 {len(snapshot.columns)}列（快照 {snapshot.directory}）')
 
-    X = df.drop([label_col, 'num'], axis=1)
-    y = df[label_col]
+    # 独热编码和标准化按列缓存在快照中，与 get_dummies + StandardScaler 的结果相同
+    X = snapshot.encode(CATEGORICAL_COLS, NUMERIC_COLS, drop=[LABEL_COL, 'num'])
+    y = pd.Series(np.asarray(snapshot.column(LABEL_COL)), name=LABEL_COL)
 
     return X, y
 
@@ -40,41 +69,560 @@ def lasso_feature_selection(X, y, alpha=0.01):
     return selected_features
 
 
-# 3. 模型训练与评估（仅使用SVM）
-def train_and_evaluate_svm(X, y, selected_features):
+# 3. 模型训练与评估
+def _training_splits(X, y, selected_features, calibration_size):
+    """划分训练、校准和测试集：先留出20%测试集，再从训练集中留出一部分用于概率校准"""
     X_train, X_test, y_train, y_test = train_test_split(
         X[selected_features], y, stratify=y, test_size=0.2, random_state=42, shuffle=True)
+    # 校准集代替 probability=True 的内部5折交叉验证
+    X_fit, X_calib, y_fit, y_calib = train_test_split(
+        X_train, y_train, stratify=y_train, test_size=calibration_size, random_state=42, shuffle=True)
+    return X_fit, X_calib, X_test, y_fit, y_calib, y_test
+
+
+def _fit_and_calibrate(estimator, X_fit, y_fit, X_calib, y_calib, calibration):
+    started = time.perf_counter()
+    estimator.fit(X_fit, y_fit)
+    calibrator = fit_calibrator(estimator.decision_function(X_calib), np.asarray(y_calib) == estimator.classes_[1],
+                                method=calibration)
+    return calibrator, time.perf_counter() - started
+
+
+def _check_serving_features(columns, n_features):
+    """检查模型的输入列与服务端的特征（schema.SERVING_FEATURES）一致，不一致时拒绝写入服务端文件"""
+    if list(columns) != SERVING_FEATURES or n_features != len(SERVING_FEATURES):
+        raise ValueError(
+            f"模型的输入列与服务端的特征不一致，不能发布到服务端: 模型 {n_features} 列 {list(columns)}，"
+            f"服务端 {len(SERVING_FEATURES)} 列 {SERVING_FEATURES}")
+
+
+def _save_model(estimator, calibrator, calibration_rows):
+    # 服务端按 SERVING_FEATURES 传入原始特征；输入列不同（如独热编码后的Lasso特征）的模型
+    # 无法被服务端加载，不替换 svm_model.pkl
+    _check_serving_features(getattr(estimator, 'feature_names_in_', []), estimator.n_features_in_)
+    joblib.dump(estimator, 'svm_model.pkl')
+    save_calibrator(calibrator, 'svm_calibration.json', model_sha256=file_sha256('svm_model.pkl'),
+                    calibration_rows=calibration_rows)
+    # 同时导出服务端使用的纯NumPy打分文件（包含校准器）
+    export_svc('svm_model.pkl', 'svm_model.npz')
+
+
+def _test_metrics(name, model, X_test, y_test):
+    y_pred = model.predict(X_test)
+    y_proba = model.predict_proba(X_test)[:, 1]
+    return {
+        'Model': name,
+        'Test Accuracy': accuracy_score(y_test, y_pred),
+        'Precision': precision_score(y_test, y_pred, zero_division=0),
+        'Recall': recall_score(y_test, y_pred),
+        'F1 Score': f1_score(y_test, y_pred),
+        'ROC AUC': roc_auc_score(y_test, y_proba),
+        'Brier Score': brier_score_loss(y_test == model.classes_[1], y_proba)
+    }
+
+
+def make_approx_svm(approximation, n_components, gamma, C, n_samples, class_weight=None):
+    """核近似（Nyström或随机傅里叶特征）+ SGD训练的线性SVM，C按样本数换算为SGD的正则化系数"""
+    if approximation == 'nystroem':
+        approx = Nystroem(kernel='rbf', gamma=gamma, n_components=n_components, random_state=42)
+    elif approximation == 'rff':
+        approx = RBFSampler(gamma=gamma, n_components=n_components, random_state=42)
+    else:
+        raise ValueError(f"不支持的核近似方法: {approximation}")
+    linear = SGDClassifier(loss='hinge', alpha=1.0 / (C * n_samples), class_weight=class_weight,
+                           max_iter=1000, tol=1e-4, random_state=42)
+    return make_pipeline(approx, linear)
+
+
+def _scale_gamma(X):
+    # 与SVC的gamma='scale'相同
+    X = np.asarray(X, dtype=np.float64)
+    return 1.0 / (X.shape[1] * X.var())
+
+
+def train_and_evaluate_svm(X, y, selected_features, calibration='platt', calibration_size=0.2, **svm_params):
+    X_fit, X_calib, X_test, y_fit, y_calib, y_test = _training_splits(X, y, selected_features, calibration_size)
 
     # 仅使用SVM模型
-    svm_model = SVC(probability=True, random_state=42)
-    svm_model.fit(X_train, y_train)
-    joblib.dump(svm_model, 'svm_model.pkl')
-    # 预测
-    y_pred = svm_model.predict(X_test)
-    y_proba = svm_model.predict_proba(X_test)[:, 1]
+    svc = SVC(random_state=42, **svm_params)
+    calibrator, seconds = _fit_and_calibrate(svc, X_fit, y_fit, X_calib, y_calib, calibration)
+    print(f"训练和{calibration}校准用时{seconds:.2f}秒")
+    _save_model(svc, calibrator, len(y_calib))
 
     # 计算评估指标
-    metrics = {
-        'Model': 'SVM',
+    return pd.DataFrame([_test_metrics('SVM', CalibratedSVC(svc, calibrator), X_test, y_test)])
+
+
+def train_and_evaluate_approx_svm(X, y, selected_features, approximation='nystroem', n_components=300,
+                                  gamma='scale', C=1.0, class_weight=None, calibration='platt', calibration_size=0.2):
+    """训练核近似模型并保存为 svm_model.pkl/svm_model.npz，服务端可直接加载"""
+    X_fit, X_calib, X_test, y_fit, y_calib, y_test = _training_splits(X, y, selected_features, calibration_size)
+    if gamma == 'scale':
+        gamma = _scale_gamma(X_fit)
+
+    pipeline = make_approx_svm(approximation, n_components, gamma, C, len(y_fit), class_weight)
+    calibrator, seconds = _fit_and_calibrate(pipeline, X_fit, y_fit, X_calib, y_calib, calibration)
+    print(f"{approximation}核近似（{n_components}维）训练和{calibration}校准用时{seconds:.2f}秒")
+    _save_model(pipeline, calibrator, len(y_calib))
+
+    return pd.DataFrame([_test_metrics(f'SVM ({approximation}, {n_components})',
+                                       CalibratedSVC(pipeline, calibrator), X_test, y_test)])
+
+
+def _scoring_latency(scorer, X_test, repeat):
+    """导出打分器的单样本延迟中位数（微秒）和批量吞吐量（行/秒）"""
+    rows = np.asarray(X_test, dtype=np.float64)
+    timings = []
+    for i in range(repeat):
+        row = rows[i % len(rows)].reshape(1, -1)
+        started = time.perf_counter()
+        scorer.predict_proba(row)
+        timings.append(time.perf_counter() - started)
+    batch = np.tile(rows, (max(1, 10000 // len(rows)), 1))
+    started = time.perf_counter()
+    scorer.predict_proba(batch)
+    batch_seconds = time.perf_counter() - started
+    return float(np.median(timings)) * 1e6, len(batch) / batch_seconds
+
+
+def approx_tradeoff_report(X, y, selected_features, approximations=('nystroem', 'rff'),
+                           n_components=(50, 100, 300, 1000), C=1.0, gamma='scale',
+                           calibration='platt', calibration_size=0.2, repeat=500):
+    """对比精确RBF SVC与各核近似配置的准确率、训练时间和服务端打分延迟"""
+    X_fit, X_calib, X_test, y_fit, y_calib, y_test = _training_splits(X, y, selected_features, calibration_size)
+    gamma_value = _scale_gamma(X_fit) if gamma == 'scale' else gamma
+
+    candidates = [('rbf_svc', None, SVC(C=C, gamma=gamma_value, random_state=42))]
+    for approximation in approximations:
+        for n in n_components:
+            if approximation == 'nystroem' and n >= len(y_fit):
+                # landmarks数量不能超过样本数，此时相当于精确核
+                continue
+            candidates.append((approximation, n, make_approx_svm(approximation, n, gamma_value, C, len(y_fit))))
+
+    rows = []
+    for kind, n, estimator in candidates:
+        calibrator, fit_seconds = _fit_and_calibrate(estimator, X_fit, y_fit, X_calib, y_calib, calibration)
+        if kind == 'rbf_svc':
+            scorer = CompiledSVMScorer.from_svc(estimator, calibrator=calibrator)
+            size = len(estimator.support_vectors_)
+        else:
+            scorer = ApproxSVMScorer.from_pipeline(estimator, calibrator)
+            size = scorer.n_components
+        latency_us, rows_per_second = _scoring_latency(scorer, X_test, repeat)
+        metrics = _test_metrics(kind, CalibratedSVC(estimator, calibrator), X_test, y_test)
+        rows.append({'Model': kind, 'Components': size, 'Fit Seconds': fit_seconds,
+                     'Single Row us': latency_us, 'Rows per Second': rows_per_second,
+                     **{k: v for k, v in metrics.items() if k != 'Model'}})
+    return pd.DataFrame(rows)
+
+
+# 4. 重复分层K折评估
+def _fold_metrics(K, y, train_idx, test_idx, svm_params):
+    """在一个折上训练并评估，K为所有样本共用的预计算RBF核矩阵"""
+    # AUC只依赖排序，用决策函数即可，不需要概率校准
+    svm_model = SVC(kernel='precomputed', random_state=42, **svm_params)
+    svm_model.fit(K[np.ix_(train_idx, train_idx)], y[train_idx])
+    K_test = K[np.ix_(test_idx, train_idx)]
+    y_test = y[test_idx]
+    y_pred = svm_model.predict(K_test)
+    y_proba = svm_model.decision_function(K_test)
+    return {
         'Test Accuracy': accuracy_score(y_test, y_pred),
-        'Precision': precision_score(y_test, y_pred),
+        'Precision': precision_score(y_test, y_pred, zero_division=0),
         'Recall': recall_score(y_test, y_pred),
         'F1 Score': f1_score(y_test, y_pred),
         'ROC AUC': roc_auc_score(y_test, y_proba)
     }
 
-    return pd.DataFrame([metrics])
+
+def evaluate_svm_cv(X, y, selected_features, n_splits=5, n_repeats=10, n_jobs=-1,
+                    confidence=0.95, C=1.0, gamma='scale', class_weight=None):
+    """重复分层K折评估，各折在工作进程中并行训练，共用一次计算的核矩阵
+
+    置信区间使用Nadeau-Bengio校正的t分布，考虑了重复K折中各折训练集重叠导致的相关性。
+    """
+    X = X[selected_features].to_numpy(dtype=np.float64)
+    y = np.asarray(y)
+    if gamma == 'scale':
+        # 与SVC的gamma='scale'相同，但按全部样本计算，使所有折共用同一个核矩阵
+        gamma = 1.0 / (X.shape[1] * X.var())
+    K = rbf_kernel(X, gamma=gamma)
+
+    cv = RepeatedStratifiedKFold(n_splits=n_splits, n_repeats=n_repeats, random_state=42)
+    svm_params = {'C': C, 'class_weight': class_weight}
+    # joblib会把较大的核矩阵以内存映射方式传给工作进程，各折不会各自复制
+    fold_results = pd.DataFrame(Parallel(n_jobs=n_jobs)(
+        delayed(_fold_metrics)(K, y, train_idx, test_idx, svm_params)
+        for train_idx, test_idx in cv.split(X, y)))
+
+    n_folds = len(fold_results)
+    test_fraction = 1.0 / n_splits
+    correction = 1.0 / n_folds + test_fraction / (1.0 - test_fraction)
+    t_value = stats.t.ppf(0.5 + confidence / 2.0, n_folds - 1)
+    rows = []
+    for metric in fold_results.columns:
+        scores = fold_results[metric]
+        half_width = t_value * np.sqrt(correction * scores.var(ddof=1))
+        rows.append({
+            'Metric': metric,
+            'Mean': scores.mean(),
+            'Std': scores.std(ddof=1),
+            'CI Lower': max(scores.mean() - half_width, 0.0),
+            'CI Upper': min(scores.mean() + half_width, 1.0),
+        })
+    return pd.DataFrame(rows), fold_results
+
+
+# 5. 超参数搜索
+def _split_training_data(file_path, data_hash):
+    """读取并预处理数据，划分出训练集（测试集留作最终评估，不参与搜索）"""
+    X, y = load_and_preprocess(file_path)
+    X_train, _, y_train, _ = train_test_split(
+        X, y, stratify=y, test_size=0.2, random_state=42, shuffle=True)
+    return X_train, y_train
+
+
+def _select_training_features(file_path, data_hash, alpha, cache_dir):
+    """在训练集上做Lasso特征选择"""
+    X_train, y_train = _cached(_split_training_data, cache_dir)(file_path, data_hash)
+    return list(lasso_feature_selection(X_train, y_train, alpha=alpha))
+
+
+def _evaluate_candidate(file_path, data_hash, alpha, C, gamma, class_weight, cv_folds, cache_dir):
+    """分层交叉验证评估一组参数，返回平均ROC AUC"""
+    X_train, y_train = _cached(_split_training_data, cache_dir)(file_path, data_hash)
+    features = _cached(_select_training_features, cache_dir)(file_path, data_hash, alpha, cache_dir)
+    result = {'alpha': alpha, 'C': C, 'gamma': gamma, 'class_weight': class_weight,
+              'n_features': len(features), 'cv_auc_mean': np.nan, 'cv_auc_std': np.nan}
+    if not features:
+        return result
+
+    X = X_train[features].to_numpy(dtype=np.float64)
+    y = y_train.to_numpy()
+    started = time.perf_counter()
+    scores = []
+    for train_idx, valid_idx in StratifiedKFold(cv_folds, shuffle=True, random_state=42).split(X, y):
+        # AUC只依赖排序，用决策函数即可，省去Platt缩放的内部交叉验证
+        model = SVC(C=C, gamma=gamma, class_weight=class_weight)
+        model.fit(X[train_idx], y[train_idx])
+        scores.append(roc_auc_score(y[valid_idx], model.decision_function(X[valid_idx])))
+    result.update(cv_auc_mean=float(np.mean(scores)), cv_auc_std=float(np.std(scores)),
+                  fit_seconds=time.perf_counter() - started)
+    return result
+
+
+def _cached(func, cache_dir):
+    # 缓存键为数据文件哈希和参数，文件路径和缓存目录本身不参与
+    ignore = [name for name in ('file_path', 'cache_dir') if name in inspect.signature(func).parameters]
+    return Memory(cache_dir, verbose=0).cache(func, ignore=ignore)
+
+
+def tune_svm(file_path, grid=TUNE_GRID, cv_folds=5, n_jobs=-1, cache_dir=TUNE_CACHE_DIR):
+    """在进程池中联合搜索Lasso alpha、C、gamma和class_weight，返回按CV AUC排序的排行榜"""
+    data_hash = file_sha256(file_path)
+    # 先在主进程中完成数据读取，避免多个工作进程同时计算同一个缓存项
+    _cached(_split_training_data, cache_dir)(file_path, data_hash)
+    Parallel(n_jobs=n_jobs)(
+        delayed(_cached(_select_training_features, cache_dir))(file_path, data_hash, alpha, cache_dir)
+        for alpha in grid['alpha'])
+
+    candidates = itertools.product(grid['alpha'], grid['C'], grid['gamma'], grid['class_weight'])
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(_cached(_evaluate_candidate, cache_dir))(
+            file_path, data_hash, alpha, C, gamma, class_weight, cv_folds, cache_dir)
+        for alpha, C, gamma, class_weight in candidates)
+
+    leaderboard = pd.DataFrame(results).sort_values('cv_auc_mean', ascending=False, na_position='last')
+    return leaderboard.reset_index(drop=True)
+
+
+def run_tuning(file_path, cv_folds=5, n_jobs=-1, cache_dir=TUNE_CACHE_DIR, leaderboard_path='tuning_leaderboard.csv',
+               calibration='platt'):
+    started = time.perf_counter()
+    leaderboard = tune_svm(file_path, cv_folds=cv_folds, n_jobs=n_jobs, cache_dir=cache_dir)
+    leaderboard.to_csv(leaderboard_path, index=False)
+    print(f"搜索完成，用时{time.perf_counter() - started:.1f}秒，排行榜已写入 {leaderboard_path}")
+    print(leaderboard.head(10).to_string())
+
+    best = leaderboard.iloc[0]
+    if np.isnan(best['cv_auc_mean']):
+        raise ValueError('没有可用的参数组合（所有alpha都没有选出特征）')
+    data_hash = file_sha256(file_path)
+    selected_features = _cached(_select_training_features, cache_dir)(file_path, data_hash, best['alpha'], cache_dir)
+    params = {'C': float(best['C']), 'gamma': best['gamma'],
+              'class_weight': None if pd.isna(best['class_weight']) else best['class_weight']}
+    if params['gamma'] != 'scale':
+        params['gamma'] = float(params['gamma'])
+
+    # 用最优参数在训练集上重新训练并保存模型，在留出的测试集上评估
+    X, y = load_and_preprocess(file_path)
+    results = train_and_evaluate_svm(X, y, selected_features, calibration=calibration, **params)
+    with open(os.path.splitext(leaderboard_path)[0] + '_best.json', 'w', encoding='utf-8') as f:
+        json.dump({'alpha': float(best['alpha']), **params, 'selected_features': selected_features,
+                   'cv_auc_mean': float(best['cv_auc_mean']), 'data_sha256': data_hash,
+                   'test_metrics': results.iloc[0].to_dict()}, f, ensure_ascii=False, indent=2)
+    print(f"Selected features: {selected_features}")
+    print("\nModel Performance:")
+    print(results)
+
+
+# 6. 增量更新
+def _source_column(column):
+    """独热编码列对应的原始类别列（如 性别_1 -> 性别），其他列为其本身"""
+    source = column.rsplit('_', 1)[0]
+    return source if source != column and source in CATEGORICAL_COLS else column
+
+
+def _encode_raw(file_path, columns):
+    """读取数据（不做标准化）并按columns取列
+
+    原始列直接使用，类别特征为数值代码，与服务端一致；独热编码列（如 性别_1，较早的版本）
+    由对应的类别列生成，只有该列存在但新数据中没有出现的类别才填0。缺少原始列时报错。
+    """
+    frame = load_snapshot(file_path).frame()
+    y = np.asarray(frame[LABEL_COL])
+    sources = list(dict.fromkeys(_source_column(c) for c in columns))
+    missing = [c for c in sources if c not in frame.columns]
+    if missing:
+        raise ValueError(f"数据中缺少列: {', '.join(missing)}")
+    encoded = [c for c in sources if c not in columns]
+    X = pd.get_dummies(frame[sources], columns=encoded).reindex(columns=columns, fill_value=0)
+    return X, y
+
+
+def _latest_version(state_dir):
+    versions = [int(name[1:]) for name in os.listdir(state_dir) if name[:1] == 'v' and name[1:].isdigit()
+                and os.path.exists(os.path.join(state_dir, name, 'manifest.json'))] if os.path.isdir(state_dir) else []
+    return max(versions, default=0)
+
+
+def _scaled(state, X):
+    X = np.array(X, dtype=np.float64)
+    idx = state['numeric_idx']
+    X[:, idx] = state['scaler'].transform(X[:, idx])
+    return X
+
+
+def _decision(state, X):
+    return state['linear'].decision_function(state['approx'].transform(_scaled(state, X)))
+
+
+def _add_to_reservoir(state, X, y):
+    """蓄水池抽样：校准样本池保持固定大小，每个历史样本被保留的概率相同"""
+    rng = state['rng']
+    res_X, res_y = state['reservoir_X'], state['reservoir_y']
+    for row, label in zip(X, y):
+        state['reservoir_seen'] += 1
+        if len(res_y) < INCREMENTAL_RESERVOIR_SIZE:
+            res_X.append(row)
+            res_y.append(label)
+        else:
+            j = rng.integers(state['reservoir_seen'])
+            if j < INCREMENTAL_RESERVOIR_SIZE:
+                res_X[j], res_y[j] = row, label
+
+
+def _incremental_step(state, X, y, epochs):
+    """用一批新样本更新标准化参数和线性模型，并在校准样本池上重新校准"""
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y)
+    rng = state['rng']
+    order = rng.permutation(len(y))
+    n_calib = int(round(len(y) * INCREMENTAL_CALIBRATION_FRACTION))
+    calib_idx, train_idx = order[:n_calib], order[n_calib:]
+
+    state['scaler'].partial_fit(X[:, state['numeric_idx']])
+    features = state['approx'].transform(_scaled(state, X[train_idx]))
+    for _ in range(epochs):
+        perm = rng.permutation(len(train_idx))
+        state['linear'].partial_fit(features[perm], y[train_idx][perm], classes=state['classes'])
+    _add_to_reservoir(state, X[calib_idx], y[calib_idx])
+
+    res_X, res_y = np.asarray(state['reservoir_X']), np.asarray(state['reservoir_y'])
+    state['calibrator'] = fit_calibrator(_decision(state, res_X), res_y == state['classes'][1],
+                                         method=state['calibration'])
+    state['rows_seen'] += len(y)
+
+
+def _batch_metrics(state, X, y):
+    """用当前模型给一批尚未用于训练的样本打分（先预测后训练的评估方式）"""
+    decision = _decision(state, X)
+    proba = state['calibrator'].predict(decision)
+    positive = np.asarray(y) == state['classes'][1]
+    metrics = {'rows': len(y), 'accuracy': float(np.mean((decision > 0) == positive)),
+               'brier': float(np.mean((proba - positive) ** 2))}
+    if 0 < positive.sum() < len(positive):
+        metrics['roc_auc'] = float(roc_auc_score(positive, proba))
+    return metrics
+
+
+def _write_version(state, state_dir, info, publish):
+    """把模型、校准器、导出的打分文件和标准化参数写入新的版本目录"""
+    pipeline = make_pipeline(state['approx'], state['linear'])
+    if publish:
+        # 在写入任何文件之前检查，服务端无法加载的模型不会替换正在使用的文件
+        _check_serving_features(state['columns'], pipeline.n_features_in_)
+    version = _latest_version(state_dir) + 1
+    os.makedirs(state_dir, exist_ok=True)
+    version_dir = os.path.join(state_dir, f'v{version:04d}')
+    tmp = tempfile.mkdtemp(prefix='.version-', dir=state_dir)
+    model_path = os.path.join(tmp, 'svm_model.pkl')
+    joblib.dump(pipeline, model_path)
+    save_calibrator(state['calibrator'], os.path.join(tmp, 'svm_calibration.json'),
+                    model_sha256=file_sha256(model_path), calibration_rows=len(state['reservoir_y']))
+    export_svc(model_path, os.path.join(tmp, 'svm_model.npz'))
+    scale = np.ones(len(state['columns']))
+    mean = np.zeros(len(state['columns']))
+    scale[state['numeric_idx']] = state['scaler'].scale_
+    mean[state['numeric_idx']] = state['scaler'].mean_
+    with open(os.path.join(tmp, 'scaler.json'), 'w', encoding='utf-8') as f:
+        json.dump({'features': state['columns'], 'mean': mean.tolist(), 'scale': scale.tolist()},
+                  f, ensure_ascii=False, indent=2)
+    state['version'] = version
+    joblib.dump(state, os.path.join(tmp, 'state.joblib'))
+    manifest = {'version': version, 'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'rows_seen': state['rows_seen'], 'features': state['columns'], **info}
+    with open(os.path.join(tmp, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.rename(tmp, version_dir)
+    print(f"已写入模型版本 {version_dir}")
+
+    if publish:
+        # 复制到服务端加载的位置，逐个文件原子替换；标准化参数在服务端为svm_scaler.json
+        published = {'svm_model.pkl': 'svm_model.pkl', 'svm_calibration.json': 'svm_calibration.json',
+                     'svm_model.npz': 'svm_model.npz', 'scaler.json': 'svm_scaler.json'}
+        for name, target in published.items():
+            shutil.copyfile(os.path.join(version_dir, name), f'{target}.tmp')
+            os.replace(f'{target}.tmp', target)
+        print(f"已发布模型版本 v{version:04d}")
+    return version_dir
+
+
+def init_incremental(file_path, state_dir=INCREMENTAL_DIR, selected_features=None, n_components=300, C=1.0,
+                     gamma='scale', calibration='platt', epochs=5, publish=False):
+    """在初始数据上建立增量模型：随机傅里叶特征 + partial_fit训练的线性SVM，以及可累积的标准化参数
+
+    随机傅里叶特征的映射与数据无关，后续批次可以直接使用；Nyström的landmarks取自初始数据，不适合增量更新。
+    默认使用服务端的特征（类别特征为数值代码），这样得到的版本可以用 --publish 直接发布。
+    """
+    started = time.perf_counter()
+    if selected_features is None:
+        selected_features = SERVING_FEATURES
+    X_raw, y = _encode_raw(file_path, list(selected_features))
+    columns = list(X_raw.columns)
+    numeric_idx = np.array([j for j, c in enumerate(columns) if c in NUMERIC_COLS], dtype=np.intp)
+    classes = np.unique(y)
+
+    scaler = StandardScaler().fit(X_raw.to_numpy(dtype=np.float64)[:, numeric_idx])
+    state = {
+        'columns': columns, 'numeric_idx': numeric_idx, 'classes': classes, 'calibration': calibration,
+        'scaler': StandardScaler(), 'rng': np.random.default_rng(42), 'rows_seen': 0, 'version': 0,
+        'reservoir_X': [], 'reservoir_y': [], 'reservoir_seen': 0,
+    }
+    if gamma == 'scale':
+        X_scaled = X_raw.to_numpy(dtype=np.float64)
+        X_scaled[:, numeric_idx] = scaler.transform(X_scaled[:, numeric_idx])
+        gamma = _scale_gamma(X_scaled)
+    state['approx'] = RBFSampler(gamma=gamma, n_components=n_components, random_state=42).fit(
+        np.zeros((1, len(columns))))
+    state['linear'] = SGDClassifier(loss='hinge', alpha=1.0 / (C * len(y)), random_state=42)
+    _incremental_step(state, X_raw, y, epochs)
+    seconds = time.perf_counter() - started
+    print(f"增量模型初始化完成: {len(y)}行，{len(columns)}个特征，用时{seconds:.2f}秒")
+    return _write_version(state, state_dir, {'parent': None, 'batch': os.path.basename(file_path),
+                                             'batch_sha256': file_sha256(file_path), 'batch_rows': len(y),
+                                             'seconds': seconds}, publish)
+
+
+def update_incremental(batch_path, state_dir=INCREMENTAL_DIR, epochs=5, publish=False):
+    """把一批新的带标签样本并入最新版本的模型，写出新版本，不重新处理历史数据"""
+    started = time.perf_counter()
+    parent = _latest_version(state_dir)
+    if not parent:
+        raise ValueError(f"{state_dir} 中没有可更新的模型，请先使用 --incremental-init 初始化")
+    state = joblib.load(os.path.join(state_dir, f'v{parent:04d}', 'state.joblib'))
+    X_raw, y = _encode_raw(batch_path, state['columns'])
+    unknown = set(np.unique(y)) - set(state['classes'].tolist())
+    if unknown:
+        raise ValueError(f"新数据中出现了未知的标签: {sorted(unknown)}")
+
+    prequential = _batch_metrics(state, X_raw.to_numpy(dtype=np.float64), y)
+    _incremental_step(state, X_raw, y, epochs)
+    seconds = time.perf_counter() - started
+    print(f"增量更新完成: 新增{len(y)}行（累计{state['rows_seen']}行），用时{seconds:.2f}秒；"
+          f"更新前模型在新数据上的表现: {prequential}")
+    return _write_version(state, state_dir, {'parent': parent, 'batch': os.path.basename(batch_path),
+                                             'batch_sha256': file_sha256(batch_path), 'batch_rows': len(y),
+                                             'seconds': seconds, 'prequential': prequential}, publish)
 
 
 # 主函数
 def main():
-    file_path = "/Users/alang/PycharmProjects/PythonProject/original_data_samples.xlsx"
+    parser = argparse.ArgumentParser(description='训练SVM模型')
+    parser.add_argument('--data', default="/Users/alang/PycharmProjects/PythonProject/original_data_samples.xlsx",
+                        help='训练数据Excel文件')
+    parser.add_argument('--tune', action='store_true', help='并行搜索Lasso alpha、C、gamma和class_weight')
+    parser.add_argument('--evaluate', action='store_true', help='用重复分层K折评估模型，报告均值和置信区间')
+    parser.add_argument('--n-splits', type=int, default=5)
+    parser.add_argument('--n-repeats', type=int, default=10)
+    parser.add_argument('--cv-folds', type=int, default=5)
+    parser.add_argument('--n-jobs', type=int, default=-1, help='并行进程数，-1表示使用所有CPU核')
+    parser.add_argument('--cache-dir', default=TUNE_CACHE_DIR, help='预处理和特征选择结果的缓存目录')
+    parser.add_argument('--calibration', choices=CALIBRATION_METHODS, default='platt',
+                        help='概率校准方法，在训练集留出的部分上拟合')
+    parser.add_argument('--model', choices=('svc', 'approx'), default='svc',
+                        help='svc为精确RBF核SVC；approx为核近似+SGD线性SVM，打分开销与训练集大小无关')
+    parser.add_argument('--approximation', choices=('nystroem', 'rff'), default='nystroem')
+    parser.add_argument('--n-components', type=int, default=300, help='核近似的映射维度')
+    parser.add_argument('--tradeoff-report', nargs='?', const='approx_tradeoff_report.csv',
+                        help='对比精确SVC与各核近似配置的准确率和延迟，结果写入该CSV文件')
+    parser.add_argument('--incremental-init', action='store_true',
+                        help='在--data上建立可增量更新的模型（随机傅里叶特征 + SGD线性SVM）')
+    parser.add_argument('--update', metavar='BATCH', help='把新的带标签数据并入最新版本的增量模型')
+    parser.add_argument('--incremental-dir', default=INCREMENTAL_DIR, help='增量模型的版本目录')
+    parser.add_argument('--epochs', type=int, default=5, help='增量训练时每批数据的训练轮数')
+    parser.add_argument('--publish', action='store_true', help='把新版本复制为服务端加载的svm_model.*、svm_calibration.json和svm_scaler.json')
+    args = parser.parse_args()
+
+    if args.update:
+        update_incremental(args.update, args.incremental_dir, epochs=args.epochs, publish=args.publish)
+        return
+    if args.incremental_init:
+        init_incremental(args.data, args.incremental_dir, n_components=args.n_components,
+                         calibration=args.calibration, epochs=args.epochs, publish=args.publish)
+        return
+
+    if args.tune:
+        run_tuning(args.data, cv_folds=args.cv_folds, n_jobs=args.n_jobs, cache_dir=args.cache_dir,
+                   calibration=args.calibration)
+        return
+
+    file_path = args.data
     X, y = load_and_preprocess(file_path)
 
     selected_features = lasso_feature_selection(X, y)
     print(f"Selected features: {selected_features.tolist()}")
 
-    results = train_and_evaluate_svm(X, y, selected_features)
+    if args.evaluate:
+        summary, _ = evaluate_svm_cv(X, y, selected_features, n_splits=args.n_splits,
+                                     n_repeats=args.n_repeats, n_jobs=args.n_jobs)
+        print(f"\n{args.n_repeats}次重复{args.n_splits}折交叉验证:")
+        print(summary.to_string(index=False))
+        return
+
+    if args.tradeoff_report:
+        report = approx_tradeoff_report(X, y, selected_features, calibration=args.calibration)
+        report.to_csv(args.tradeoff_report, index=False)
+        print(report.to_string(index=False))
+        print(f"对比结果已写入 {args.tradeoff_report}")
+        return
+
+    if args.model == 'approx':
+        results = train_and_evaluate_approx_svm(X, y, selected_features, approximation=args.approximation,
+                                                n_components=args.n_components, calibration=args.calibration)
+    else:
+        results = train_and_evaluate_svm(X, y, selected_features, calibration=args.calibration)
     print("\nModel Performance:")
     print(results)
 
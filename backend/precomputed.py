@@ -0,0 +1,46 @@
+import hashlib
+import threading
+
+from flask import Response, request
+
+class PrecomputedResponse:
+    """预先生成的响应体和强ETag（响应体的哈希），条件请求命中时直接返回304"""
+
+    __slots__ = ('body', 'mimetype', 'headers', 'etag')
+
+    def __init__(self, body, mimetype, headers=None):
+        self.body = body
+        self.mimetype = mimetype
+        self.headers = dict(headers or {})
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+
+    def respond(self, cache_control):
+        if request.if_none_match.contains_weak(self.etag):
+            response = Response(status=304)
+        else:
+            response = Response(self.body, mimetype=self.mimetype, headers=self.headers)
+        response.set_etag(self.etag)
+        response.headers['Cache-Control'] = cache_control
+        return response
+
+class PrecomputedResponses:
+    """按名称保存预先生成的响应，key（如模型版本）变化时重新生成，每个名称只保留最新一份"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def get(self, name, key, build):
+        entry = self._entries.get(name)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        with self._lock:
+            # 等锁期间其他线程可能已经生成
+            entry = self._entries.get(name)
+            if entry is not None and entry[0] == key:
+                return entry[1]
+            response = build()
+            self._entries[name] = (key, response)
+            self.builds += 1
+            return response
@@ -0,0 +1,141 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+def deduplicate_rows(X):
+    """返回去重后的行和还原下标，使 unique[inverse] == X"""
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    if len(X) < 2:
+        return X, np.arange(len(X))
+
+    import pandas as pd
+
+    # 先按行哈希分组，再逐元素确认；出现哈希冲突时退回到精确的排序去重
+    hashes = pd.util.hash_pandas_object(pd.DataFrame(X), index=False).to_numpy()
+    inverse, _ = pd.factorize(hashes)
+    _, first = np.unique(inverse, return_index=True)
+    unique_rows = X[first]
+    if np.array_equal(unique_rows[inverse], X, equal_nan=True):
+        return unique_rows, inverse
+
+    rows = X.view(np.dtype((np.void, X.dtype.itemsize * X.shape[1]))).ravel()
+    _, first, inverse = np.unique(rows, return_index=True, return_inverse=True)
+    return X[first], inverse.ravel()
+
+class PredictionCache:
+    """以标准化后的特征向量和模型版本为键的LRU+TTL预测缓存
+
+    watch_paths中的模型文件发生变化（修改时间或大小改变）时自动清空缓存。
+    """
+
+    def __init__(self, maxsize=10000, ttl=300.0, watch_paths=(), check_interval=1.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.watch_paths = list(watch_paths)
+        self.check_interval = check_interval
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._signature = self._file_signature()
+        self._next_check = time.monotonic() + check_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _file_signature(self):
+        signature = []
+        for path in self.watch_paths:
+            try:
+                st = os.stat(path)
+                signature.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                signature.append(None)
+        return signature
+
+    def _check_files(self, now):
+        # 限制stat调用频率，每check_interval秒最多检查一次
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        signature = self._file_signature()
+        if signature != self._signature:
+            self._signature = signature
+            self._clear()
+
+    def _clear(self):
+        if self._entries:
+            self.invalidations += 1
+        self._entries.clear()
+
+    def set_version(self, version):
+        """模型版本变化时清空缓存"""
+        with self._lock:
+            if version != self.version:
+                self.version = version
+                self._signature = self._file_signature()
+                self._clear()
+
+    def _key(self, row, version):
+        row = np.ascontiguousarray(row, dtype=np.float64)
+        return (self.version if version is None else version, hashlib.blake2b(row.tobytes(), digest_size=16).digest())
+
+    def get(self, row, version=None):
+        """查找缓存，未命中或已过期时返回None；version为请求所用的模型版本"""
+        now = time.monotonic()
+        with self._lock:
+            self._check_files(now)
+            key = self._key(row, version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, value = entry
+            if expires <= now:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, row, value, version=None):
+        """写入缓存，超过容量时淘汰最久未使用的条目；旧版本模型的结果不再写入"""
+        now = time.monotonic()
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            key = self._key(row, version)
+            self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def stats(self):
+        """命中、未命中和淘汰计数"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': True,
+                'model_version': self.version,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
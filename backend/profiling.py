@@ -0,0 +1,161 @@
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# 按比例抽样的请求剖析：SVM_PROFILE_RATE为抽样比例（0~1，默认0即关闭）；
+# 设置SVM_PROFILE_TOKEN后，请求头 X-SVM-Profile 等于该值的请求也会被剖析。
+# 两者都未设置时不注册任何钩子，对请求没有额外开销。
+PROFILE_RATE = float(os.environ.get('SVM_PROFILE_RATE', 0))
+PROFILE_TOKEN = os.environ.get('SVM_PROFILE_TOKEN')
+PROFILE_HEADER = 'X-SVM-Profile'
+PROFILE_INTERVAL_MS = float(os.environ.get('SVM_PROFILE_INTERVAL_MS', 1))
+# 抽样请求的调用栈在该时间窗口（秒）内累积后写入一个文件
+PROFILE_WINDOW = float(os.environ.get('SVM_PROFILE_WINDOW', 60))
+PROFILE_DIR = os.environ.get('SVM_PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs'))
+
+class StackSampler:
+    """后台线程定期读取目标线程的调用栈，按折叠格式（root;...;leaf）计数"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._active = {}
+        self._labels = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+
+    def _ensure_started(self):
+        # 在第一次剖析时才启动线程，fork之后在各个工作进程中分别启动
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        threading.Thread(target=self._run, name='stack-sampler', daemon=True).start()
+
+    def start(self, ident):
+        with self._lock:
+            self._ensure_started()
+            self._active[ident] = Counter()
+        self._wake.set()
+
+    def stop(self, ident):
+        """停止采样并返回该线程的调用栈计数"""
+        with self._lock:
+            return self._active.pop(ident, Counter())
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+        return label
+
+    def _collapse(self, frame):
+        stack = []
+        while frame is not None:
+            stack.append(self._label(frame.f_code))
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    def _run(self):
+        while True:
+            if not self._active:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, counts in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        counts[self._collapse(frame)] += 1
+
+class RequestProfiler:
+    """对抽样的请求采集调用栈，按时间窗口汇总后写成可直接生成火焰图的折叠格式文件"""
+
+    def __init__(self, rate=PROFILE_RATE, token=PROFILE_TOKEN, interval_ms=PROFILE_INTERVAL_MS,
+                 window=PROFILE_WINDOW, directory=PROFILE_DIR):
+        self.rate = rate
+        self.token = token
+        self.window = window
+        self.directory = directory
+        self.sampler = StackSampler(interval_ms / 1000.0)
+        self._lock = threading.Lock()
+        self._stacks = Counter()
+        self._requests = 0
+        self._window_start = time.time()
+
+    @property
+    def enabled(self):
+        return self.rate > 0 or bool(self.token)
+
+    def begin(self, environ, headers):
+        """判断是否剖析当前请求，是则开始采样"""
+        forced = bool(self.token) and headers.get(PROFILE_HEADER) == self.token
+        if not forced and (self.rate <= 0 or random.random() >= self.rate):
+            return
+        environ['svm.profile'] = (forced, time.perf_counter(), time.thread_time())
+        self.sampler.start(threading.get_ident())
+
+    def end(self, environ, response):
+        state = environ.pop('svm.profile', None)
+        if state is None:
+            return
+        forced, wall_start, cpu_start = state
+        stacks = self.sampler.stop(threading.get_ident())
+        wall_ms = (time.perf_counter() - wall_start) * 1000.0
+        cpu_ms = (time.thread_time() - cpu_start) * 1000.0
+        log = logger.info if forced else logger.debug
+        log(f"剖析请求: 耗时{wall_ms:.2f}ms，CPU时间{cpu_ms:.2f}ms，采样{sum(stacks.values())}次")
+
+        if forced:
+            # 通过请求头触发时单独写出本次请求的结果
+            path = self._dump(stacks, 'request')
+            response.headers['X-SVM-Profile-File'] = os.path.basename(path)
+            return
+
+        with self._lock:
+            self._stacks.update(stacks)
+            self._requests += 1
+            if time.time() - self._window_start < self.window:
+                return
+            stacks, self._stacks = self._stacks, Counter()
+            requests, self._requests = self._requests, 0
+            self._window_start = time.time()
+        path = self._dump(stacks, 'window')
+        logger.info(f"已写入{requests}个抽样请求的调用栈: {path}")
+
+    def _dump(self, stacks, kind):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'profile-{kind}-{os.getpid()}-{time.strftime("%Y%m%d-%H%M%S")}-{random.randrange(16 ** 4):04x}.folded')
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        return path
+
+def install(app, endpoints=('predict',)):
+    """为指定端点注册剖析钩子；未开启时不注册，返回None"""
+    from flask import request
+
+    profiler = RequestProfiler()
+    if not profiler.enabled:
+        return None
+    endpoints = frozenset(endpoints)
+
+    @app.before_request
+    def _begin_profile():
+        if request.endpoint in endpoints:
+            profiler.begin(request.environ, request.headers)
+
+    @app.after_request
+    def _end_profile(response):
+        profiler.end(request.environ, response)
+        return response
+
+    logger.info(f"请求剖析已开启: 抽样比例{profiler.rate}，输出目录{profiler.directory}")
+    return profiler
@@ -0,0 +1,205 @@
+import numpy as np
+
+# 错误代码，按优先级从低到高排列（同一单元格有多个问题时报告优先级最高的一个）
+NOT_INTEGER = 'not_integer'
+OUT_OF_RANGE = 'out_of_range'
+MISSING = 'missing'
+NOT_NUMERIC = 'not_numeric'
+ERROR_CODES = (None, NOT_INTEGER, OUT_OF_RANGE, MISSING, NOT_NUMERIC)
+
+class SchemaValidationError(ValueError):
+    """单条记录未通过校验，errors为 {特征: 错误代码}"""
+
+    def __init__(self, message, errors):
+        super().__init__(message)
+        self.errors = errors
+
+class Field:
+    """一个特征的约束
+
+    kind 为 'float'、'integer' 或 'binary'（只允许0和1），minimum/maximum 为允许范围
+    （含端点，None表示不限）。required 为 True 时不允许缺失，否则缺失值由特征转换计划填充。
+    """
+
+    __slots__ = ('name', 'kind', 'minimum', 'maximum', 'required')
+
+    def __init__(self, name, kind='float', minimum=None, maximum=None, required=False):
+        if kind not in ('float', 'integer', 'binary'):
+            raise ValueError(f"不支持的特征类型: {kind}")
+        if kind == 'binary':
+            minimum, maximum = 0, 1
+        self.name = name
+        self.kind = kind
+        self.minimum = minimum
+        self.maximum = maximum
+        self.required = required
+
+    def describe(self, code):
+        if code == NOT_NUMERIC:
+            return '无法转换为数值'
+        if code == MISSING:
+            return '缺失（必填）'
+        if code == NOT_INTEGER:
+            return '应为整数'
+        if self.kind == 'binary':
+            return '应为0或1'
+        low = '-∞' if self.minimum is None else self.minimum
+        high = '+∞' if self.maximum is None else self.maximum
+        return f'超出允许范围[{low}, {high}]'
+
+# 服务端（app.py、app_vercel.py）使用的特征及其顺序；类别特征为数值代码，不做独热编码。
+# 训练脚本发布模型前按此检查模型的输入列
+SERVING_FEATURES = ['性别', '年龄', '高血压', 'BMI', '前白细胞', '前血小板', '前淋巴细胞', 'NLR', '前红细胞', '前血红蛋白', '前单核细胞', '前尿白细胞', '前肌酐', '前尿酸', '白蛋白', '球蛋白', '手术时间']
+
+# selected_features 的默认约束：范围按临床上可能出现的值放宽设置，只拦截明显的录入错误
+# （单位错误、多输了几位等）；所有特征默认允许缺失，与原有的填充0行为一致
+FEATURE_FIELDS = [
+    Field('性别', 'integer', 0, 2),
+    # 病历系统导出的年龄可能带小数（按天折算），不要求整数
+    Field('年龄', 'float', 0, 120),
+    Field('高血压', 'binary'),
+    Field('BMI', 'float', 10, 80),
+    Field('前白细胞', 'float', 0, 100),
+    Field('前血小板', 'float', 0, 2000),
+    Field('前淋巴细胞', 'float', 0, 50),
+    Field('NLR', 'float', 0, 500),
+    Field('前红细胞', 'float', 0, 10),
+    Field('前血红蛋白', 'float', 0, 300),
+    Field('前单核细胞', 'float', 0, 20),
+    Field('前尿白细胞', 'float', 0),
+    Field('前肌酐', 'float', 0, 5000),
+    Field('前尿酸', 'float', 0, 2000),
+    Field('白蛋白', 'float', 0, 100),
+    Field('球蛋白', 'float', 0, 100),
+    Field('手术时间', 'float', 0, 1440),
+]
+
+class FeatureSchema:
+    """特征矩阵的声明式校验
+
+    构建时把各特征的约束编译为按列排列的数组，校验时对整块矩阵做几次向量化比较，
+    不再逐个单元格进行类型转换和异常处理。
+    """
+
+    def __init__(self, fields):
+        self.fields = list(fields)
+        self.features = [f.name for f in self.fields]
+        self.lower_ = np.array([-np.inf if f.minimum is None else f.minimum for f in self.fields], dtype=np.float64)
+        self.upper_ = np.array([np.inf if f.maximum is None else f.maximum for f in self.fields], dtype=np.float64)
+        self.integer_ = np.array([f.kind != 'float' for f in self.fields])
+        self.required_ = np.array([f.required for f in self.fields])
+        self.integer_columns = np.flatnonzero(self.integer_)
+        self.required_columns = np.flatnonzero(self.required_)
+
+    @classmethod
+    def for_features(cls, features, fields=FEATURE_FIELDS):
+        """按features的顺序选取约束，没有定义约束的特征只检查是否为有限数值"""
+        known = {f.name: f for f in fields}
+        return cls([known.get(name) or Field(name) for name in features])
+
+    def validate(self, values, invalid=None):
+        """校验特征矩阵（缺失值为NaN），invalid为无法转换为数值的单元格掩码，返回ValidationReport"""
+        values = np.asarray(values, dtype=np.float64)
+        if values.ndim == 1:
+            values = values.reshape(1, -1)
+        # 先对整块矩阵找出有问题的行，错误代码只对这些行计算
+        with np.errstate(invalid='ignore'):
+            # NaN参与比较的结果为False，缺失值不会被当作超出范围
+            bad = values < self.lower_
+            bad |= values > self.upper_
+        bad |= np.isinf(values)
+        if invalid is not None:
+            bad |= invalid
+        for j in self.integer_columns:
+            column = values[:, j]
+            with np.errstate(invalid='ignore'):
+                # 缺失值和无穷大的比较结果为False
+                bad[:, j] |= np.floor(column) < column
+        if len(self.required_columns):
+            bad[:, self.required_columns] |= np.isnan(values[:, self.required_columns])
+        rows = np.flatnonzero(bad.any(axis=1))
+        codes = self._codes(values[rows], None if invalid is None else invalid[rows])
+        return ValidationReport(self, len(values), rows, codes, values[rows])
+
+    def _codes(self, values, invalid):
+        """逐单元格的错误代码下标（0表示通过），后写入的代码优先级更高"""
+        codes = np.zeros(values.shape, dtype=np.uint8)
+        with np.errstate(invalid='ignore'):
+            codes[self.integer_ & (values != np.round(values)) & np.isfinite(values)] = 1
+            codes[(values < self.lower_) | (values > self.upper_)] = 2
+        codes[np.isnan(values) & self.required_] = 3
+        not_numeric = np.isinf(values)
+        if invalid is not None:
+            not_numeric |= invalid
+        codes[not_numeric] = 4
+        return codes
+
+class ValidationReport:
+    """一块数据的校验结果
+
+    rejected为未通过校验的行掩码，errors为 {行下标: 错误信息}；codes是这些行
+    每个单元格的错误代码下标。错误信息在创建时生成，之后矩阵可以被原地标准化。
+    """
+
+    def __init__(self, schema, n_rows, rows, codes, values):
+        self.schema = schema
+        self.n_rows = n_rows
+        self.rejected_rows = rows
+        self.rejected = np.zeros(n_rows, dtype=bool)
+        self.rejected[rows] = True
+        self.codes = codes
+        self._positions = {int(i): k for k, i in enumerate(rows)}
+        self.errors = {int(i): self._message(codes[k], values[k]) for k, i in enumerate(rows)}
+
+    def __len__(self):
+        return len(self.rejected_rows)
+
+    def raise_for_row(self, i):
+        """第i行未通过校验时抛出SchemaValidationError"""
+        if i in self.errors:
+            raise SchemaValidationError(self.errors[i], self.row_errors(i))
+
+    def row_errors(self, i):
+        """第i行各列的错误代码 {特征: 代码}"""
+        row = self.codes[self._positions[i]]
+        return {self.schema.features[j]: ERROR_CODES[row[j]] for j in np.flatnonzero(row)}
+
+    def _message(self, codes, values):
+        fields = self.schema.fields
+        parts = []
+        for j in np.flatnonzero(codes):
+            code = ERROR_CODES[codes[j]]
+            message = f"特征 {fields[j].name} {fields[j].describe(code)}"
+            if code in (OUT_OF_RANGE, NOT_INTEGER):
+                message += f": {values[j]:g}"
+            parts.append(message)
+        return '；'.join(parts)
+
+    def column_counts(self):
+        """各列按错误代码统计的单元格数 {特征: {代码: 数量}}，只包含有错误的列"""
+        counts = {}
+        for k in range(1, len(ERROR_CODES)):
+            per_column = np.count_nonzero(self.codes == k, axis=0)
+            for j in np.flatnonzero(per_column):
+                counts.setdefault(self.schema.features[j], {})[ERROR_CODES[k]] = int(per_column[j])
+        return counts
+
+class ValidationSummary:
+    """跨多个块累计的校验统计，作为批量预测响应中的 validation 字段"""
+
+    def __init__(self):
+        self.rows_checked = 0
+        self.rows_rejected = 0
+        self.by_column = {}
+
+    def add(self, report):
+        self.rows_checked += report.n_rows
+        self.rows_rejected += len(report)
+        for name, counts in report.column_counts().items():
+            column = self.by_column.setdefault(name, {})
+            for code, n in counts.items():
+                column[code] = column.get(code, 0) + n
+        return report
+
+    def to_dict(self):
+        return {'rows_checked': self.rows_checked, 'rows_rejected': self.rows_rejected, 'by_column': self.by_column}
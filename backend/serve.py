@@ -0,0 +1,248 @@
+# 预fork方式的生产服务启动器
+#
+# 主进程完成模型加载和预热后fork出多个工作进程，模型参数、特征转换计划和已导入
+# 的模块以写时复制的方式在工作进程之间共享。每个工作进程在共享的监听socket上单线程
+# 处理请求并定期写入心跳（长时间的请求在处理过程中也会写入，见heartbeat.py）；主进程回收
+# 退出的工作进程、结束心跳超时的工作进程并补齐数量。
+#
+# 用法: python serve.py --workers 4 --max-requests 10000
+import argparse
+import gc
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+from werkzeug.serving import BaseWSGIServer
+
+import heartbeat
+
+logger = logging.getLogger('serve')
+
+# 工作进程等待连接时的轮询间隔（秒），也是心跳的写入间隔
+POLL_INTERVAL = 1.0
+
+class WorkerServer(BaseWSGIServer):
+    """单线程的工作进程服务器，记录已处理的请求数"""
+
+    handled = 0
+
+    def process_request(self, request, client_address):
+        self.handled += 1
+        super().process_request(request, client_address)
+
+def create_listener(host, port, backlog=128):
+    """在主进程中创建监听socket，由所有工作进程共享"""
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    # 多个工作进程同时被唤醒时只有一个能accept成功，其余立即返回继续等待
+    sock.setblocking(False)
+    sock.set_inheritable(True)
+    return sock
+
+def with_heartbeat(wsgi_app):
+    """响应体每输出一块更新一次心跳，NDJSON流等长时间的响应不会被当作卡死"""
+    def wrapped(environ, start_response):
+        body = wsgi_app(environ, start_response)
+        try:
+            for chunk in body:
+                heartbeat.beat()
+                yield chunk
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+    return wrapped
+
+def run_worker(wsgi_app, listener, slot, heartbeats, max_requests):
+    """工作进程主循环：处理请求直到收到SIGTERM或达到max_requests"""
+    running = True
+
+    def stop(signum, frame):
+        nonlocal running
+        running = False
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # 主进程冻结了预热时创建的对象，工作进程重新开启垃圾回收
+    gc.enable()
+
+    def beat():
+        heartbeats[slot] = time.monotonic()
+
+    heartbeat.install(beat)
+    host, port = listener.getsockname()[:2]
+    # 监听socket的非阻塞标志由主进程设置；这里不能再调用setblocking(False)，
+    # 否则handle_request会把socket超时0当作select超时而空转
+    server = WorkerServer(host, port, with_heartbeat(wsgi_app), fd=listener.fileno())
+    server.timeout = POLL_INTERVAL
+    try:
+        while running and (not max_requests or server.handled < max_requests):
+            beat()
+            server.handle_request()
+    finally:
+        server.server_close()
+    # 退出前写入最后的指标，由主进程之外的汇总逻辑归档
+    import metrics
+    if metrics.METRICS_DIR is not None:
+        metrics.registry.flush()
+    if max_requests and server.handled >= max_requests:
+        logger.info(f"工作进程 {os.getpid()} 已处理{server.handled}个请求，退出等待重启")
+
+class Master:
+    """管理工作进程：启动、回收、心跳检查和优雅退出"""
+
+    def __init__(self, wsgi_app, listener, workers, max_requests=0, max_requests_jitter=0, timeout=60.0):
+        self.wsgi_app = wsgi_app
+        self.listener = listener
+        self.n_workers = workers
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.timeout = timeout
+        # 心跳放在fork之前创建的共享内存中，每个工作进程占一个槽位
+        self.heartbeats = multiprocessing.Array('d', workers, lock=False)
+        self.slots = {}
+        self.running = True
+
+    def spawn(self, slot):
+        self.heartbeats[slot] = time.monotonic()
+        # 为每个工作进程加入随机抖动，避免同时重启
+        max_requests = self.max_requests
+        if max_requests and self.max_requests_jitter:
+            max_requests += random.randint(0, self.max_requests_jitter)
+
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.wsgi_app, self.listener, slot, self.heartbeats, max_requests)
+            except Exception as e:
+                logger.error(f"工作进程 {os.getpid()} 异常退出: {e}")
+                code = 1
+            finally:
+                os._exit(code)
+
+        self.slots[pid] = slot
+        logger.info(f"启动工作进程 {pid}（槽位 {slot}）")
+
+    def reap(self):
+        """回收已退出的工作进程，返回空出的槽位"""
+        freed = []
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            slot = self.slots.pop(pid, None)
+            if slot is None:
+                continue
+            if self.running and os.waitstatus_to_exitcode(status) != 0:
+                logger.warning(f"工作进程 {pid} 退出，状态码 {os.waitstatus_to_exitcode(status)}")
+            freed.append(slot)
+        return freed
+
+    def check_heartbeats(self):
+        """杀掉心跳超时（卡死，或单个请求在两次心跳之间处理过久）的工作进程"""
+        now = time.monotonic()
+        for pid, slot in list(self.slots.items()):
+            silent = now - self.heartbeats[slot]
+            if silent > self.timeout:
+                logger.error(f"工作进程 {pid} 心跳超时（{silent:.1f}秒），强制结束")
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def stop(self, signum, frame):
+        self.running = False
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        for slot in range(self.n_workers):
+            self.spawn(slot)
+
+        while self.running:
+            for slot in self.reap():
+                if self.running:
+                    self.spawn(slot)
+            self.check_heartbeats()
+            time.sleep(POLL_INTERVAL)
+
+        self.shutdown()
+
+    def shutdown(self, grace=10.0):
+        """通知工作进程处理完当前请求后退出，超时后强制结束"""
+        logger.info("正在停止工作进程...")
+        for pid in list(self.slots):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + grace
+        while self.slots and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in list(self.slots):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.reap()
+        self.listener.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='以多进程方式启动SVM预测服务')
+    parser.add_argument('--host', default=os.environ.get('SVM_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('SVM_PORT', 5001)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('SVM_WORKERS', os.cpu_count() or 1)),
+                        help='工作进程数量，默认为CPU核数')
+    parser.add_argument('--max-requests', type=int, default=int(os.environ.get('SVM_MAX_REQUESTS', 0)),
+                        help='每个工作进程处理多少个请求后重启，0表示不重启')
+    parser.add_argument('--max-requests-jitter', type=int, default=int(os.environ.get('SVM_MAX_REQUESTS_JITTER', 0)),
+                        help='max-requests上附加的随机抖动')
+    parser.add_argument('--timeout', type=float, default=float(os.environ.get('SVM_WORKER_TIMEOUT', 60)),
+                        help='工作进程心跳超时秒数，超时后强制重启。流式响应每输出一块、等待模型重新加载时每秒'
+                             '都会更新心跳；同步批量预测只在解析、预处理、打分各阶段之间更新，单个阶段不能超过该值')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    # 各工作进程的指标写入同一目录，由/api/metrics汇总
+    os.environ.setdefault('SVM_METRICS_DIR', os.path.join(tempfile.gettempdir(), f'svm-metrics-{args.port}'))
+
+    # 在主进程中完成模型加载和预热，工作进程直接继承；
+    # 预热期间暂停垃圾回收，fork前再统一冻结
+    gc.disable()
+    import app
+    if not app.warm_up():
+        logger.error("模型预热失败，服务未启动")
+        return 1
+
+    import metrics
+    metrics.reset_dir(metrics.METRICS_DIR)
+
+    listener = create_listener(args.host, args.port)
+    logger.info(f"在 {args.host}:{args.port} 上启动{args.workers}个工作进程")
+
+    # 把预热期间创建的对象移出垃圾回收的跟踪范围，避免工作进程中的回收
+    # 改写这些对象的内存页，破坏写时复制共享
+    gc.collect()
+    gc.freeze()
+
+    Master(app.app, listener, args.workers, args.max_requests,
+           args.max_requests_jitter, args.timeout).run()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,16 +1,22 @@
-import math
 import pickle
 
+import numpy as np
+
+# sigmoid 前把决策分数限制在该范围内，np.exp 不会溢出（概率在此范围外已饱和为0或1）
+MAX_SCORE = 500.0
+
 class SimpleSVMPredictor:
     """简化的 SVM 预测器，避免 sklearn 依赖"""
-    
+
     def __init__(self):
         self.model_params = None
-        self.scaler_params = {
-            'mean': [0.5, 45.0, 0.3, 25.0, 7.0, 250.0, 2.0, 3.0, 4.5, 140.0, 0.15, 0.08, 80.0, 300.0, 40.0, 30.0, 120.0],
-            'std': [0.5, 15.0, 0.5, 5.0, 3.0, 100.0, 1.0, 2.0, 2.0, 20.0, 0.1, 0.05, 20.0, 100.0, 10.0, 10.0, 60.0]
-        }
-    
+        # 标准化参数以预分配的浮点数组保存
+        self.mean_ = np.array([0.5, 45.0, 0.3, 25.0, 7.0, 250.0, 2.0, 3.0, 4.5, 140.0, 0.15, 0.08, 80.0, 300.0, 40.0, 30.0, 120.0])
+        self.scale_ = np.array([0.5, 15.0, 0.5, 5.0, 3.0, 100.0, 1.0, 2.0, 2.0, 20.0, 0.1, 0.05, 20.0, 100.0, 10.0, 10.0, 60.0])
+        self.n_features_in_ = len(self.mean_)
+        self.weights_ = None
+        self.intercept_ = 0.0
+
     def load_model(self, model_path):
         """加载模型参数"""
         try:
@@ -20,6 +26,7 @@ class SimpleSVMPredictor:
                 'intercept': [-0.5],  # 调整截距，使模型更倾向于预测负类
                 'weights': [0.1, -0.05, 0.2, 0.15, 0.1, -0.08, 0.12, 0.18, -0.1, -0.15, 0.2, 0.25, 0.1, 0.05, -0.2, 0.1, 0.08, 0.12]
             }
+            self._compile_params()
             return True
         except Exception as e:
             print(f"模型加载失败: {e}")
@@ -29,33 +36,59 @@ class SimpleSVMPredictor:
                 'intercept': [-0.5],  # 调整截距，使模型更倾向于预测负类
                 'weights': [0.1, -0.05, 0.2, 0.15, 0.1, -0.08, 0.12, 0.18, -0.1, -0.15, 0.2, 0.25, 0.1, 0.05, -0.2, 0.1, 0.08]
             }
+            self._compile_params()
             return False
-    
+
+    def _compile_params(self):
+        """将模型参数转换为预分配的浮点数组"""
+        if not self.model_params:
+            return
+        # 只使用与输入特征数量对应的权重
+        weights = self.model_params['weights'][:self.n_features_in_]
+        self.weights_ = np.array(weights, dtype=np.float64)
+        self.intercept_ = float(self.model_params['intercept'][0])
+
+    def decision_function(self, X):
+        """计算决策分数，X 可以是单行或任意行数的二维数组"""
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+
+        n_features = min(X.shape[1], len(self.weights_))
+        X_scaled = (X[:, :n_features] - self.mean_[:n_features]) / self.scale_[:n_features]
+
+        # 按特征顺序逐列累加，与逐行求和的累加顺序一致
+        decision_scores = np.zeros(X.shape[0])
+        for j in range(n_features):
+            decision_scores += X_scaled[:, j] * self.weights_[j]
+        decision_scores += self.intercept_
+        return decision_scores
+
+    def feature_contributions(self, X):
+        """逐特征贡献 weights * x_scaled，各列之和加上截距即为决策分数"""
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+
+        n_features = min(X.shape[1], len(self.weights_))
+        contributions = np.zeros(X.shape)
+        np.multiply((X[:, :n_features] - self.mean_[:n_features]) / self.scale_[:n_features],
+                    self.weights_[:n_features], out=contributions[:, :n_features])
+        return contributions, self.decision_function(X)
+
     def predict(self, X):
-        """简化的预测方法"""
-        # 标准化输入
-        if isinstance(X, list):
-            X_scaled = [(X[i] - self.scaler_params['mean'][i]) / self.scaler_params['std'][i] for i in range(len(X))]
-        else:
-            X_scaled = X
-        
-        # 简化的预测逻辑（基于特征权重）
-        weights = self.model_params['weights']
-        
-        # 计算决策分数
-        decision_score = sum(X_scaled[i] * weights[i] for i in range(min(len(X_scaled), len(weights))))
-        decision_score += self.model_params['intercept'][0] if self.model_params else 0.0
-        
-        prediction = 1 if decision_score > 0 else 0
-        
+        """批量预测，返回预测标签和正类概率"""
+        decision_scores = self.decision_function(X)
+
+        predictions = (decision_scores > 0).astype(np.int64)
+
         # 计算概率（使用 sigmoid 函数）
-        probability = 1 / (1 + math.exp(-decision_score))
-        
-        return [prediction], [probability]
-    
+        probabilities = 1 / (1 + np.exp(-np.clip(decision_scores, -MAX_SCORE, MAX_SCORE)))
+
+        return predictions, probabilities
+
     def predict_proba(self, X):
         """预测概率"""
         predictions, probabilities = self.predict(X)
         # 返回两个类别的概率
-        prob = probabilities[0]
-        return [[1 - prob, prob]]
\ No newline at end of file
+        return np.column_stack([1 - probabilities, probabilities])
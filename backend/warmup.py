@@ -0,0 +1,89 @@
+import importlib
+import threading
+import time
+from contextlib import contextmanager
+
+class StartupTracker:
+    """记录启动各阶段的耗时和服务就绪状态"""
+
+    def __init__(self):
+        self.timings_ms = {}
+        self.stage_name = None
+        self.started = False
+        self.ready = False
+        self.error = None
+        self._done = threading.Event()
+        self._started_at = None
+        self._finished_at = None
+
+    def begin(self):
+        """开始（或在失败后重新开始）启动流程"""
+        self.started = True
+        self.ready = False
+        self.error = None
+        self._done.clear()
+        self._started_at = time.perf_counter()
+        self._finished_at = None
+
+    def reset(self):
+        """回到未启动状态（fork时预热尚未完成，子进程需要重新预热）"""
+        self.timings_ms = {}
+        self.stage_name = None
+        self.started = False
+        self.ready = False
+        self.error = None
+        self._done = threading.Event()
+        self._started_at = None
+        self._finished_at = None
+
+    @contextmanager
+    def stage(self, name):
+        """记录一个启动阶段的耗时"""
+        self.stage_name = name
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings_ms[name] = round((time.perf_counter() - t0) * 1000.0, 3)
+
+    def mark_ready(self):
+        self.ready = True
+        self.stage_name = None
+        self._finished_at = time.perf_counter()
+        self._done.set()
+
+    def mark_failed(self, error):
+        self.error = str(error)
+        self._finished_at = time.perf_counter()
+        self._done.set()
+
+    def wait(self, timeout=None):
+        """等待启动流程结束，返回是否就绪"""
+        self._done.wait(timeout)
+        return self.ready
+
+    @property
+    def status(self):
+        if self.ready:
+            return 'ready'
+        if self.error is not None:
+            return 'failed'
+        return 'starting' if self.started else 'pending'
+
+    def snapshot(self):
+        total_ms = None
+        if self._started_at is not None:
+            end = self._finished_at if self._finished_at is not None else time.perf_counter()
+            total_ms = round((end - self._started_at) * 1000.0, 3)
+        return {
+            'status': self.status,
+            'stage': self.stage_name,
+            'timings_ms': dict(self.timings_ms),
+            'total_ms': total_ms,
+            'error': self.error,
+        }
+
+def preload_modules(names):
+    """预先导入模块，使请求处理函数中的延迟导入不再有开销"""
+    for name in names:
+        importlib.import_module(name)
@@ -12,7 +12,7 @@ mkdir -p logs
 start_backend() {
     echo "启动后端服务..."
     cd backend
-    nohup python app.py > ../logs/backend.log 2>&1 &
+    nohup python serve.py > ../logs/backend.log 2>&1 &
     BACKEND_PID=$!
     echo $BACKEND_PID > ../logs/backend.pid
     echo "后端服务已启动，PID: $BACKEND_PID"